@@ -145,12 +145,17 @@ class PipelineService(EngineService):
                  disable_engine=False,
                  disable_warmup=False,
                  warmup_size=(480, 640, 3)):
+        # Deployed models are loaded while the current engine keeps
+        # serving, see deploy().
+        comm_config.setdefault('model_swap',
+                               {'engine_factory': self.create_engine})
         super().__init__(service_name,
                          engine,
                          comm_config)
 
         self.pipeline_config_path = pipeline_config_path
         self.dyda_config_path = ''
+        self.disable_warmup = disable_warmup
         self.warmup_size = warmup_size
 
         self.disable_engine = disable_engine
@@ -189,7 +194,7 @@ class PipelineService(EngineService):
         # If the payload is
         #     - a list of items: keep the list
         #     - a single item: convert to a list with an item
-        mqtt_payload = payload.deserialize_payload(pl.decode('utf-8'))
+        mqtt_payload = payload.deserialize(pl)
         if isinstance(mqtt_payload, list):
             jpg_json = mqtt_payload
         else:
@@ -198,10 +203,13 @@ class PipelineService(EngineService):
                 type(mqtt_payload),
                 type(jpg_json)))
 
-        jpg_bytes_list = [
-            payload.destringify_jpg(img['bytes']) for img in jpg_json]
+        jpg_bytes_list = [payload.pop_image(img) for img in jpg_json]
+        if None in jpg_bytes_list:
+            logger.warning('Payload does not contain image or the '
+                           'referenced frame has expired, skip it')
+            return
         metas = [img.get('meta', {}) for img in jpg_json]
-        logger.debug('destringify_jpg: {} ms'.format(duration(t)))
+        logger.debug('deserialize: {} ms'.format(duration(t)))
 
         t = datetime.now()
         bgr_arrays = [
@@ -209,13 +217,16 @@ class PipelineService(EngineService):
         logger.debug('jpg2bgr: {} ms'.format(duration(t)))
 
         t = datetime.now()
+        # The whole payload is inferred by the same engine even if a
+        # deployed model replaces it meanwhile.
+        engine = self.engine
         # FIXME: Galaxy pipeline may or may not use a list as input, so we
         # check the length here and then choose whether to send a list or not.
         # We may drop it when Galaxy Pipline unite their input.
         if len(bgr_arrays) > 1:
-            image_data = self.engine.process_input(bgr_arrays)
+            image_data = engine.process_input(bgr_arrays)
         else:
-            image_data = self.engine.process_input(bgr_arrays[0])
+            image_data = engine.process_input(bgr_arrays[0])
         # FIXME: Galaxy pipeline doesn't support multiple metadata for multiple
         # images at the moment (which will be needed), so we provide the first
         # metadata here. This commit should be revert when Galaxy pipeline
@@ -224,10 +235,10 @@ class PipelineService(EngineService):
 
         try:
             logger.debug(meta_data)
-            output = self.engine.inference(image_data,
-                                           meta=meta_data,
-                                           base_name=base_name)
-            model_outputs = self.engine.process_output(output)
+            output = engine.inference(image_data,
+                                      meta=meta_data,
+                                      base_name=base_name)
+            model_outputs = engine.process_output(output)
         except IndexError as e:
             # FIXME: workaround for pipeline
             # Pipeline throw IndexError when there's no results, see:
@@ -292,7 +303,11 @@ class PipelineService(EngineService):
     def deploy(self, pl):
         """Deploy newly retrained model for pipeline engine
 
-        New dyda config filepath is in the payload.
+        New dyda config filepath is in the payload. In inference mode,
+        pipeline engine of the new config is created and warmed up in
+        background while the current engine keeps serving, and it
+        replaces the current engine between frames. The current engine
+        keeps serving if the new one fails.
 
         Args:
             pl: MQTT message payload w/ new dyda config filepath.
@@ -301,11 +316,34 @@ class PipelineService(EngineService):
             N/A
         """
         dyda_config_path = pl.decode('utf-8')
+        if self.disable_engine:
+            # Engine is created by the new config when service switches
+            # to inference mode.
+            self.deployed(dyda_config_path)
+        else:
+            self.swapper.swap(dyda_config_path)
+
+    def deployed(self, dyda_config_path):
         self.dyda_config_path = dyda_config_path
         self.comm.send('berrynet/data/deployed', '')
         logger.info(('New model has been deployed, '
                      'dyda config: {}'.format(self.dyda_config_path)))
 
+    def create_engine(self, dyda_config_path):
+        return PipelineEngine(self.pipeline_config_path,
+                              dyda_config_path=dyda_config_path,
+                              disable_warmup=self.disable_warmup,
+                              warmup_size=self.warmup_size)
+
+    def warmup_engine(self, engine):
+        # Pipeline engine is warmed up when it is created.
+        pass
+
+    def swap_hook(self, status):
+        super().swap_hook(status)
+        if status['status'] == 'swapped':
+            self.deployed(status['model'])
+
     def generalize_result(self, eng_input, eng_output):
         # Pipeline returns None if any error happened
         if eng_output is None:
@@ -46,14 +46,17 @@ class DataCollectorService(object):
                 logger.warn('Failed to create {}'.format(self.data_dirpath))
                 raise(e)
 
-        payload_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes = payload.destringify_jpg(payload_json['bytes'])
-        payload_json.pop('bytes')
+        payload_json = payload.deserialize(pl)
+        jpg_bytes = payload.pop_image(payload_json)
         logger.debug('inference text result: {}'.format(payload_json))
 
         timestamp = datetime.now().isoformat()
-        with open(pjoin(self.data_dirpath, timestamp + '.jpg'), 'wb') as f:
-            f.write(jpg_bytes)
+        if jpg_bytes is None:
+            logger.warning('Result does not contain image or the '
+                           'referenced frame has expired')
+        else:
+            with open(pjoin(self.data_dirpath, timestamp + '.jpg'), 'wb') as f:
+                f.write(jpg_bytes)
         with open(pjoin(self.data_dirpath, timestamp + '.json'), 'w') as f:
             f.write(json.dumps(payload_json, indent=4))
 
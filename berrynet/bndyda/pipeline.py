@@ -187,11 +187,16 @@ class PipelineService(EngineService):
         logger.debug('counter #{}'.format(self.counter))
         logger.debug('payload size: {}'.format(len(pl)))
         logger.debug('payload type: {}'.format(type(pl)))
-        jpg_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes_list = [
-            payload.destringify_jpg(img['bytes']) for img in jpg_json]
+        jpg_json = payload.deserialize(pl)
+        if not isinstance(jpg_json, list):
+            jpg_json = [jpg_json]
+        jpg_bytes_list = [payload.pop_image(img) for img in jpg_json]
+        if None in jpg_bytes_list:
+            logger.warning('Payload does not contain image or the '
+                           'referenced frame has expired, skip it')
+            return
         metas = [img.get('meta', {}) for img in jpg_json]
-        logger.debug('destringify_jpg: {} ms'.format(duration(t)))
+        logger.debug('deserialize: {} ms'.format(duration(t)))
 
         t = datetime.now()
         bgr_arrays = [
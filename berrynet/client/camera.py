@@ -29,6 +29,7 @@ import cv2
 from berrynet import logger
 from berrynet.comm import Communicator
 from berrynet.comm import payload
+from berrynet.comm import shm
 
 
 def parse_args():
@@ -68,6 +69,19 @@ def parse_args():
         type=int,
         help='MQTT broker port.'
     )
+    ap.add_argument(
+        '--qos',
+        default=0,
+        type=int,
+        help='MQTT QoS level of the sent frames. (default: 0)'
+    )
+    ap.add_argument(
+        '--pipeline-depth',
+        default=16,
+        type=int,
+        help=('Max number of frames waiting to be written to the broker. '
+              '0 means unlimited. (default: 16)')
+    )
     ap.add_argument('--topic',
         default='berrynet/data/rgbimage',
         help='The topic to send the captured frames.'
@@ -79,7 +93,45 @@ def parse_args():
     )
     ap.add_argument('--hash',
         action='store_true',
-        help='Add md5sum of a captured frame into the result.'
+        help=('Add legacy md5sum of a captured frame into the result. '
+              'Use --frame-id instead if md5sum is not required.')
+    )
+    ap.add_argument('--frame-id',
+        default='none',
+        choices=['none'] + list(payload.FRAME_ID_ALGORITHMS),
+        help=('Add content hash of a captured frame as frame id, which '
+              'can be used for caching and deduplication. xxh64 is '
+              'faster but needs xxhash. (default: none)')
+    )
+    ap.add_argument('--payload-format',
+        default='json',
+        choices=['json', 'binary'],
+        help=('Serialize frames as base64 JSON, or binary envelope '
+              'which is ~25%% smaller. (default: json)')
+    )
+    ap.add_argument('--shm-ring',
+        default=0,
+        type=int,
+        help=('Send raw frames through a shared-memory ring with the '
+              'given number of slots, and send only frame handles '
+              'through MQTT. It only works if broker and consumers are '
+              'on the same host. 0 means disabled. (default: 0)')
+    )
+    ap.add_argument('--shm-name',
+        default='berrynet-camera',
+        help='Name of the shared-memory ring in /dev/shm.'
+    )
+    ap.add_argument('--batch-size',
+        default=1,
+        type=int,
+        help=('Send multiple frames in one message in stream mode to '
+              'reduce per-message overhead. (default: 1)')
+    )
+    ap.add_argument('--batch-timeout',
+        default=100,
+        type=int,
+        help=('Send a batch in milliseconds after its first frame even '
+              'if the batch is not full. (default: 100)')
     )
     ap.add_argument('--meta',
         type=str,
@@ -105,6 +157,10 @@ def main():
         'broker': {
             'address': args['broker_ip'],
             'port': args['broker_port']
+        },
+        'publish': {
+            'qos': args['qos'],
+            'pipeline_depth': args['pipeline_depth']
         }
     }
     comm = Communicator(comm_config, debug=True)
@@ -112,6 +168,21 @@ def main():
     duration = lambda t: (datetime.now() - t).microseconds / 1000
 
     metadata = json.loads(args.get('meta', '{}'))
+    binary = args['payload_format'] == 'binary'
+
+    def make_frame_id(content_bytes):
+        if args['frame_id'] == 'none':
+            return None
+        return payload.generate_frame_id(content_bytes, args['frame_id'])
+
+    # Frame ring can only be read by consumers on the same host, so fall
+    # back to the normal payload if frames are sent to a remote broker.
+    use_shm = args['shm_ring'] > 0
+    if use_shm and args['broker_ip'] not in ('localhost', '127.0.0.1'):
+        logger.warning('Broker {} is not local, disable shared-memory '
+                       'ring'.format(args['broker_ip']))
+        use_shm = False
+    ring = None
 
     if args['mode'] == 'stream':
         counter = 0
@@ -132,6 +203,17 @@ def main():
         out_fps = args['fps']
         interval = int(cam_fps / out_fps)
 
+        # Frames of a batch are sent in one message with sequence numbers.
+        batch = []
+        batch_t0 = 0
+        batch_timeout = args['batch_timeout'] / 1000
+        seq = 0
+        if use_shm and args['batch_size'] > args['shm_ring']:
+            logger.warning('Batch size {0} is larger than frame ring size '
+                           '{1}, frames will expire before they are '
+                           'sent'.format(args['batch_size'],
+                                         args['shm_ring']))
+
         # warmup
         #t_warmup_start = time.time()
         #t_warmup_now = time.time()
@@ -151,6 +233,7 @@ def main():
         logger.debug('Output FPS: {}'.format(out_fps))
         logger.debug('Interval: {}'.format(interval))
         logger.debug('Send MQTT Topic: {}'.format(args['topic']))
+        logger.debug('Batch Size: {}'.format(args['batch_size']))
         #logger.debug('Warmup Counter: {}'.format(warmup_counter))
         logger.debug('====================================')
 
@@ -183,8 +266,38 @@ def main():
                         cv2.waitKey(1)
 
                     t = datetime.now()
-                    retval, jpg_bytes = cv2.imencode('.jpg', im)
-                    mqtt_payload = payload.serialize_jpg(jpg_bytes, args['hash'], metadata)
+                    if use_shm:
+                        if ring is None or im.nbytes > ring.slot_size:
+                            ring = shm.FrameRing(args['shm_name'],
+                                                 slots=args['shm_ring'],
+                                                 slot_size=im.nbytes,
+                                                 create=True)
+                        frame_obj = payload.create_frame_handle_object(
+                            ring.write(im), metadata,
+                            make_frame_id(im.data))
+                    else:
+                        retval, jpg_bytes = cv2.imencode('.jpg', im)
+                        frame_obj = payload.create_jpg_object(
+                            jpg_bytes, args['hash'], metadata,
+                            make_frame_id(jpg_bytes))
+
+                    if args['batch_size'] > 1:
+                        if not batch:
+                            batch_t0 = time.time()
+                        frame_obj['seq'] = seq
+                        seq += 1
+                        batch.append(frame_obj)
+                        # Timeout is checked when a frame is captured.
+                        if len(batch) < args['batch_size'] and \
+                                time.time() - batch_t0 < batch_timeout:
+                            continue
+                        mqtt_payload = payload.serialize_batch(batch, binary)
+                        logger.debug('batch size: {}'.format(len(batch)))
+                        batch = []
+                    elif use_shm:
+                        mqtt_payload = json.dumps(frame_obj)
+                    else:
+                        mqtt_payload = payload.serialize(frame_obj, binary)
                     comm.send(args['topic'], mqtt_payload)
                     logger.debug('send: {} ms'.format(duration(t)))
                 else:
@@ -204,13 +317,15 @@ def main():
         retval, jpg_bytes = cv2.imencode('.jpg', im)
 
         t = datetime.now()
-        mqtt_payload = payload.serialize_jpg(jpg_bytes, args['hash'], metadata)
+        mqtt_payload = payload.serialize_jpg(jpg_bytes, args['hash'], metadata,
+                                             binary, make_frame_id(jpg_bytes))
         logger.debug('payload: {} ms'.format(duration(t)))
         logger.debug('payload size: {}'.format(len(mqtt_payload)))
 
         # Client publishes payload
         t = datetime.now()
         comm.send(args['topic'], mqtt_payload)
+        comm.flush()
         logger.debug('mqtt.publish: {} ms'.format(duration(t)))
         logger.debug('publish at {}'.format(datetime.now().isoformat()))
     else:
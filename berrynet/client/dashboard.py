@@ -38,17 +38,21 @@ class DashboardService(object):
         self.basedir = '/usr/local/berrynet/dashboard/www/freeboard'
 
     def update(self, pl):
-        payload_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes = payload.destringify_jpg(payload_json['bytes'])
+        payload_json = payload.deserialize_lazy(pl)
         inference_result = [
             '{0}: {1}<br>'.format(anno['label'], anno['confidence'])
-            for anno in payload_json['annotations']
+            for anno in payload_json.annotations
         ]
         logger.debug('inference results: {}'.format(inference_result))
 
-        with open(pjoin(self.basedir, 'snapshot.jpg'), 'wb') as f:
-            f.write(jpg_bytes)
-        self.comm.send('berrynet/dashboard/snapshot', 'snapshot.jpg')
+        jpg_bytes = payload_json.image
+        if jpg_bytes is None:
+            logger.warning('Referenced frame is not available, '
+                           'skip snapshot')
+        else:
+            with open(pjoin(self.basedir, 'snapshot.jpg'), 'wb') as f:
+                f.write(jpg_bytes)
+            self.comm.send('berrynet/dashboard/snapshot', 'snapshot.jpg')
         self.comm.send('berrynet/dashboard/inferenceResult',
                        json.dumps(inference_result))
 
@@ -51,10 +51,15 @@ class DataCollectorService(object):
         self.data_dirpath = data_dirpath
 
     def update(self, pl):
-        payload_json = payload.deserialize_payload(pl.decode('utf-8'))
+        payload_json = payload.deserialize(pl)
+        jpg_bytes = payload.pop_image(payload_json)
+        if jpg_bytes is None:
+            logger.warning('Result does not contain image or the '
+                           'referenced frame has expired')
+            return
 
         # update UI with the latest inference result
-        self.ui.update(payload_json, 'bytes')
+        self.ui.update(payload_json, jpg_bytes)
 
         if self.data_dirpath:
             if not os.path.exists(self.data_dirpath):
@@ -64,8 +69,6 @@ class DataCollectorService(object):
                     logger.warn('Failed to create {}'.format(self.data_dirpath))
                     raise(e)
 
-            jpg_bytes = payload.destringify_jpg(payload_json['bytes'])
-            payload_json.pop('bytes')
             logger.debug('inference text result: {}'.format(payload_json))
 
             timestamp = datetime.now().isoformat()
@@ -75,10 +78,15 @@ class DataCollectorService(object):
                 f.write(json.dumps(payload_json, indent=4))
 
     def save_pipeline_result(self, pl):
-        payload_json = payload.deserialize_payload(pl.decode('utf-8'))
+        payload_json = payload.deserialize(pl, img_key='image_blob')
+        jpg_bytes = payload.pop_image(payload_json, img_key='image_blob')
+        if jpg_bytes is None:
+            logger.warning('Result does not contain image or the '
+                           'referenced frame has expired')
+            return
 
         # update UI with the latest inference result
-        self.ui.update(payload_json, 'image_blob')
+        self.ui.update(payload_json, jpg_bytes)
 
         if self.data_dirpath:
             if not os.path.exists(self.data_dirpath):
@@ -88,8 +96,6 @@ class DataCollectorService(object):
                     logger.warn('Failed to create {}'.format(self.data_dirpath))
                     raise(e)
 
-            jpg_bytes = payload.destringify_jpg(payload_json['image_blob'])
-            payload_json.pop('image_blob')
             logger.debug('inference text result: {}'.format(payload_json))
 
             timestamp = datetime.now().isoformat()
@@ -177,17 +183,16 @@ class UI(object):
         # Start the main UI program
         self.window.mainloop()
 
-    def update(self, data, imgkey='bytes'):
+    def update(self, data, jpg_bytes):
         '''
         Args:
-            data: Inference result loaded from JSON object
+            data: Inference result without image
+            jpg_bytes: Result image in JPEG bytes
         '''
         # Retrieve result image
-        jpg_bytes = payload.destringify_jpg(data[imgkey])
         img = payload.jpg2rgb(jpg_bytes)
 
         # Retrieve result text, and update text area
-        data.pop(imgkey)
         result_text = self.process_output(data)
         if 'safely' in result_text:
             text_color = 'blue'
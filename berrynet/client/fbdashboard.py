@@ -53,15 +53,21 @@ class FBDashboardService(object):
         self.save_frame = save_frame
 
     def update(self, pl):
-        payload_json = payload.deserialize_payload(pl.decode('utf-8'))
+        payload_json = payload.deserialize(pl)
         if 'bytes' in payload_json.keys():
             img_k = 'bytes'
         elif 'image_blob' in payload_json.keys():
             img_k = 'image_blob'
+        elif 'frame_ref' in payload_json.keys():
+            img_k = 'bytes'
         else:
             raise Exception('No image data in MQTT payload')
-        jpg_bytes = payload.destringify_jpg(payload_json[img_k])
-        payload_json.pop(img_k)
+        jpg_bytes = payload.pop_image(payload_json, img_key=img_k)
+        if jpg_bytes is None:
+            logger.warning('Referenced frame is not available, skip it')
+            return
+        if isinstance(jpg_bytes, str):
+            jpg_bytes = payload.destringify_jpg(jpg_bytes)
         logger.debug('inference text result: {}'.format(payload_json))
 
         img = payload.jpg2rgb(jpg_bytes)
@@ -110,13 +110,13 @@ class GmailService(object):
         return target_label in label_list
 
     def update(self, pl):
-        payload_json = payload.deserialize_payload(pl.decode('utf-8'))
         if self.pipeline_compatible:
             b64img_key = 'image_blob'
         else:
             b64img_key = 'bytes'
-        jpg_bytes = payload.destringify_jpg(payload_json[b64img_key])
-        payload_json.pop(b64img_key)
+        # Image is decoded only if target label is found.
+        lazy_payload = payload.deserialize_lazy(pl, img_key=b64img_key)
+        payload_json = lazy_payload.meta
         logger.debug('inference text result: {}'.format(payload_json))
 
         match_target_label = self.find_target_label(self.target_label,
@@ -129,8 +129,15 @@ class GmailService(object):
             timestamp = datetime.now().isoformat()
             notification_image = pjoin('/tmp', timestamp + '.jpg')
             notification_text = pjoin('/tmp', timestamp + '.json')
-            with open(notification_image, 'wb') as f:
-                f.write(jpg_bytes)
+            attachments = set([notification_text])
+            jpg_bytes = lazy_payload.image
+            if jpg_bytes is None:
+                logger.warning('Result does not contain image or the '
+                               'referenced frame has expired')
+            else:
+                with open(notification_image, 'wb') as f:
+                    f.write(jpg_bytes)
+                attachments.add(notification_image)
             with open(notification_text, 'w') as f:
                 f.write(json.dumps(payload_json, indent=4))
 
@@ -143,12 +150,12 @@ class GmailService(object):
                           'Please check the attachments.'
                           ''.format(self.target_label)),
                     subject='BerryNet mail client notification',
-                    attachments=set([notification_image, notification_text]))
+                    attachments=attachments)
             except Exception as e:
                 logger.warn(e)
 
-            os.remove(notification_image)
-            os.remove(notification_text)
+            for attachment in attachments:
+                os.remove(attachment)
         else:
             # target label is not in generalized result, do nothing
             pass
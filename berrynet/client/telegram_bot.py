@@ -72,34 +72,40 @@ class TelegramBotService(object):
 
     def update(self, pl):
         try:
-            payload_json = payload.deserialize_payload(pl.decode('utf-8'))
-            jpg_bytes = payload.destringify_jpg(payload_json["bytes"])
-            jpg_file_descriptor = io.BytesIO(jpg_bytes)
+            # Image is decoded only if a photo will be sent.
+            payload_json = payload.deserialize_lazy(pl)
 
             for u in self.cameraHandlers:
                 if self.updater is None:
                     continue
 
                 if self.target_label == '':
-                    if len(payload_json['annotations']) > 0:
+                    if len(payload_json.annotations) > 0:
                         logger.debug("Send photo to %s" % u)
-                        self.updater.bot.send_photo(chat_id = u, photo=jpg_file_descriptor)
+                        self.send_photo(u, payload_json.image)
                     else:
                         logger.debug("Does not detect any object, no action")
                 elif self.match_target_label(self.target_label, payload_json):
                     logger.info("Send notification photo with result to %s" % u)
-                    self.updater.bot.send_photo(chat_id = u, photo=jpg_file_descriptor)
+                    self.send_photo(u, payload_json.image)
                 else:
                     pass
         except Exception as e:
             logger.info(e)
 
+    def send_photo(self, chat_id, jpg_bytes):
+        if jpg_bytes is None:
+            logger.warning('Referenced frame is not available, skip it')
+            return
+        jpg_file_descriptor = io.BytesIO(jpg_bytes)
+        self.updater.bot.send_photo(chat_id=chat_id, photo=jpg_file_descriptor)
+
     def single_shot(self, pl):
         """Capture an image from camera client and send to the client.
         """
         if self.shot is True:
             try:
-                payload_json = payload.deserialize_payload(pl.decode('utf-8'))
+                payload_json = payload.deserialize(pl)
                 # WORKAROUND: Support customized camera client.
                 #
                 # Original camera client sends an `obj` in payload,
@@ -110,12 +116,11 @@ class TelegramBotService(object):
                 if type(payload_json) is list:
                     logger.debug('WORDAROUND: receive and unpack [obj]')
                     payload_json = payload_json[0]
-                jpg_bytes = payload.destringify_jpg(payload_json["bytes"])
-                jpg_file_descriptor = io.BytesIO(jpg_bytes)
-
+                if 'shm' in payload_json:
+                    payload_json = payload.attach_frame_jpg(payload_json)
                 logger.info('Send single shot')
-                self.updater.bot.send_photo(chat_id=self.single_shot_chat_id,
-                                            photo=jpg_file_descriptor)
+                self.send_photo(self.single_shot_chat_id,
+                                payload_json.get('bytes'))
             except Exception as e:
                 logger.info(e)
 
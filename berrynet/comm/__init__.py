@@ -1,25 +1,351 @@
 #!/usr/bin/python3
 
+import functools
+import inspect
+import threading
+import time
+
+from collections import deque
+from datetime import datetime
+
 import paho.mqtt.client as mqtt
 import paho.mqtt.publish as publish
 
 from berrynet import logger
+from berrynet.comm import payload
 from logzero import setup_logger
 
 
+# Default publish settings, can be overridden by comm_config['publish'].
+#
+# qos: MQTT QoS level of published messages.
+# pipeline_depth: How many published messages can be not yet written
+#     to the broker before send() blocks. It bounds the memory used by
+#     paho's outgoing queue when broker or network is slower than the
+#     producer (e.g. camera frames).
+DEFAULT_PUBLISH_CONFIG = {
+    'qos': 0,
+    'pipeline_depth': 16,
+}
+CONNECT_TIMEOUT = 10
+# Max seconds to wait for a pending message. paho drops queued QoS 0
+# messages on reconnect without marking them published, so waiting
+# without timeout can block forever after broker restarts.
+PUBLISH_TIMEOUT = 5
+
+# Mailbox policies, see Mailbox.
+MAILBOX_POLICIES = ('keep-latest', 'drop-oldest', 'deadline')
+MAILBOX_STATS_INTERVAL = 10
+
+
 def on_connect(client, userdata, flags, rc):
     logger.debug('Connected with result code ' + str(rc))
+    # Callbacks are always called from the network thread.
+    client.loop_thread = threading.current_thread()
+    client.dispatcher = TopicDispatcher(client.comm_config['subscribe'])
     for topic in client.comm_config['subscribe'].keys():
         logger.debug('Subscribe topic {}'.format(topic))
         client.subscribe(topic)
 
 
 def on_message(client, userdata, msg):
-    """Dispatch received message to its bound functor.
+    """Dispatch received message to its bound functor(s).
+
+    Subscribed topics can contain MQTT wildcards, and a message is
+    dispatched to the functors of all the matched subscriptions.
+
+    If the subscription has a mailbox, the message is put into the mailbox
+    and the functor is called by the mailbox worker thread instead.
     """
     logger.debug('Receive message from topic {}'.format(msg.topic))
     #logger.debug('Message payload {}'.format(msg.payload))
-    client.comm_config['subscribe'][msg.topic](msg.payload)
+    matches = client.dispatcher.match(msg.topic)
+    if not matches:
+        logger.warning('No functor for topic {}'.format(msg.topic))
+    for pattern, channel in matches:
+        if pattern in client.mailboxes:
+            client.mailboxes[pattern].put(msg.topic, channel, msg.payload)
+        else:
+            dispatch(client, pattern, msg.topic, channel, msg.payload)
+
+
+@functools.lru_cache(maxsize=128)
+def accepts_topic(functor):
+    """Check whether functor accepts topic and channel keyword arguments."""
+    try:
+        params = inspect.signature(functor).parameters
+    except (TypeError, ValueError):
+        return False
+    return ('topic' in params and 'channel' in params) or \
+        any(p.kind == p.VAR_KEYWORD for p in params.values())
+
+
+def dispatch(client, pattern, topic, channel, pl):
+    """Call the functor bound to the subscription pattern.
+
+    Functors are called as functor(payload) by default. If a functor
+    accepts `topic` and `channel` keyword arguments, it also receives the
+    concrete topic and the channel ID, which are the topic levels matched
+    by wildcards (None if the subscription has no wildcard), e.g.
+
+        subscription: berrynet/data/+/rgbimage
+        topic:        berrynet/data/camera1/rgbimage
+        channel:      camera1
+    """
+    functor = client.comm_config['subscribe'][pattern]
+    if accepts_topic(functor):
+        functor(pl, topic=topic, channel=channel)
+    else:
+        functor(pl)
+
+
+class TopicDispatcher(object):
+    """Match concrete topics against subscription patterns.
+
+    Subscription patterns are compiled into a trie of topic levels, and
+    the matched results are cached per concrete topic.
+    """
+    CACHE_SIZE = 1024
+
+    def __init__(self, patterns):
+        self.root = {}
+        for pattern in patterns:
+            node = self.root
+            for level in pattern.split('/'):
+                node = node.setdefault(level, {})
+            node[None] = pattern  # None key marks the end of a pattern
+        self.cache = {}
+
+    def match(self, topic):
+        """Match topic with subscription patterns.
+
+        Returns:
+            List of (pattern, channel) tuples.
+        """
+        try:
+            return self.cache[topic]
+        except KeyError:
+            pass
+        matches = []
+        self._match(self.root, topic.split('/'), 0, [], matches)
+        if len(self.cache) >= self.CACHE_SIZE:
+            self.cache.clear()
+        self.cache[topic] = matches
+        return matches
+
+    def _match(self, node, levels, i, wildcards, matches):
+        # Topics starting with $ (e.g. $SYS) are not matched by
+        # wildcards in the first level.
+        first_wildcard_ok = not (i == 0 and levels[0].startswith('$'))
+        if '#' in node and first_wildcard_ok:
+            channel = '/'.join(wildcards + levels[i:]) or None
+            matches.append((node['#'][None], channel))
+        if i == len(levels):
+            if None in node:
+                channel = '/'.join(wildcards) if wildcards else None
+                matches.append((node[None], channel))
+            return
+        level = levels[i]
+        if level in node:
+            self._match(node[level], levels, i + 1, wildcards, matches)
+        if '+' in node and first_wildcard_ok:
+            self._match(node['+'], levels, i + 1, wildcards + [level],
+                        matches)
+
+
+class Mailbox(object):
+    """Bounded queue between MQTT network thread and message functor.
+
+    Functor is called by a worker thread, so that a slow functor (e.g.
+    inference) does not block receiving, and messages which can not be
+    processed in time are dropped instead of piling up.
+
+    A mailbox serves a subscription pattern, and the size limit applies
+    to each concrete topic, so a wildcard subscription (e.g. one engine
+    serving multiple cameras) keeps frames of every channel while all
+    of them are processed by one worker.
+
+    Policies:
+        keep-latest: Only keep the latest message per topic.
+        drop-oldest: Keep the latest `size` messages per topic.
+        deadline: Like drop-oldest, and messages whose payload timestamp
+                  is older than `deadline_ms` are dropped before they are
+                  processed. Producer and consumer clocks should be
+                  synchronized if they are on different hosts.
+    """
+    def __init__(self, client, pattern, policy='keep-latest', size=1,
+                 deadline_ms=1000):
+        if policy not in MAILBOX_POLICIES:
+            raise ValueError('Illegal mailbox policy {0}, it should be one '
+                             'of {1}'.format(policy, MAILBOX_POLICIES))
+        self.client = client
+        self.pattern = pattern
+        self.policy = policy
+        self.size = 1 if policy == 'keep-latest' else max(int(size), 1)
+        self.deadline = deadline_ms / 1000.0
+        self.queue = deque()
+        self.queued = {}  # number of queued messages per topic
+        self.cond = threading.Condition()
+        self.counters = {
+            'received': 0,
+            'processed': 0,
+            'dropped': 0,   # replaced by newer messages
+            'expired': 0,   # older than deadline
+            'failed': 0     # functor raised exception
+        }
+        self.thread = threading.Thread(target=self._run, daemon=True)
+
+    def start(self):
+        """Start dispatching thread.
+
+        It is not started by constructor, so that services can fork
+        worker processes before any thread is running.
+        """
+        self.thread.start()
+
+    def put(self, topic, channel, pl):
+        with self.cond:
+            self.counters['received'] += 1
+            if self.queued.get(topic, 0) >= self.size:
+                for i, item in enumerate(self.queue):
+                    if item[1] == topic:
+                        del self.queue[i]
+                        break
+                self.counters['dropped'] += 1
+            else:
+                self.queued[topic] = self.queued.get(topic, 0) + 1
+            self.queue.append((time.time(), topic, channel, pl))
+            self.cond.notify()
+
+    def get(self):
+        """Get the next message which does not expire.
+
+        Returns:
+            (topic, channel, payload) tuple.
+        """
+        while True:
+            with self.cond:
+                while not self.queue:
+                    self.cond.wait()
+                t_recv, topic, channel, pl = self.queue.popleft()
+                self.queued[topic] -= 1
+            if self.policy != 'deadline' or not self._expired(t_recv, pl):
+                return topic, channel, pl
+            with self.cond:
+                self.counters['expired'] += 1
+
+    def _expired(self, t_recv, pl):
+        timestamp = payload.peek_timestamp(pl)
+        if timestamp is None:
+            age = time.time() - t_recv
+        else:
+            age = (datetime.now() - timestamp).total_seconds()
+        return age > self.deadline
+
+    def stats(self):
+        with self.cond:
+            stats = dict(self.counters)
+            stats['queued'] = len(self.queue)
+        return stats
+
+    def _run(self):
+        t_stats = time.time()
+        while True:
+            topic, channel, pl = self.get()
+            try:
+                dispatch(self.client, self.pattern, topic, channel, pl)
+                with self.cond:
+                    self.counters['processed'] += 1
+            except Exception as e:
+                logger.exception(e)
+                with self.cond:
+                    self.counters['failed'] += 1
+
+            if time.time() - t_stats > MAILBOX_STATS_INTERVAL:
+                t_stats = time.time()
+                logger.info('Mailbox {0} stats: {1}'.format(self.pattern,
+                                                           self.stats()))
+
+
+def wait_pending(pending, depth, timeout=PUBLISH_TIMEOUT):
+    """Wait for the oldest pending messages until at most depth messages
+    are pending. Caller should hold the lock of pending.
+
+    If a message is not published in timeout, connection is assumed to
+    be stalled or lost, and all the pending messages are forgotten.
+    """
+    while len(pending) > depth:
+        info = pending.popleft()
+        info.wait_for_publish(timeout)
+        if not info.is_published():
+            logger.warning('Message is not published in {} s, drop {} '
+                           'pending messages'.format(timeout,
+                                                     len(pending) + 1))
+            pending.clear()
+
+
+class Publisher(object):
+    """Persistent MQTT connection used for publishing only.
+
+    Publishers are shared per process and per broker, so that all the
+    Communicators which are not connected by run() or start_nb() (e.g.
+    camera client) reuse one connection instead of creating a new one
+    for every message.
+    """
+    def __init__(self, address, port):
+        self.connected = threading.Event()
+        self.pending = deque()
+        self.lock = threading.Lock()
+        self.client = mqtt.Client()
+        self.client.on_connect = lambda client, userdata, flags, rc: \
+            self.connected.set()
+        self.client.on_disconnect = self.on_disconnect
+        self.client.connect(address, port, 60)
+        self.client.loop_start()
+        if not self.connected.wait(CONNECT_TIMEOUT):
+            logger.warning('Publisher is not connected to {0}:{1} '
+                           'after {2} s'.format(address, port,
+                                                CONNECT_TIMEOUT))
+
+    def publish(self, topic, payload, qos=0, pipeline_depth=0):
+        info = self.client.publish(topic, payload, qos=qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.warning('Failed to publish message to {0}: {1}'.format(
+                topic, mqtt.error_string(info.rc)))
+        elif pipeline_depth > 0:
+            with self.lock:
+                self.pending.append(info)
+                wait_pending(self.pending, pipeline_depth)
+        return info
+
+    def on_disconnect(self, client, userdata, rc):
+        self.connected.clear()
+        # Messages not yet written are dropped by paho on reconnect.
+        with self.lock:
+            self.pending.clear()
+
+    def flush(self, timeout=PUBLISH_TIMEOUT):
+        """Wait until all pending messages are written to the broker."""
+        with self.lock:
+            wait_pending(self.pending, 0, timeout)
+
+    def close(self):
+        self.flush()
+        self.client.disconnect()
+        self.client.loop_stop()
+
+
+_publishers = {}
+_publishers_lock = threading.Lock()
+
+
+def get_publisher(address, port):
+    """Get the process-wide publisher connected to the given broker."""
+    with _publishers_lock:
+        key = (address, port)
+        if key not in _publishers:
+            _publishers[key] = Publisher(address, port)
+        return _publishers[key]
 
 
 class Communicator(object):
@@ -28,8 +354,45 @@ class Communicator(object):
         self.client.comm_config = comm_config
         self.client.on_connect = on_connect
         self.client.on_message = on_message
+        self.client.on_disconnect = self.on_disconnect
+        self.client.loop_thread = None
+        # Whether self.client is connected by run() or start_nb(). If it
+        # is, messages are never published over another connection.
+        self.started = False
+        self.client.dispatcher = TopicDispatcher(comm_config['subscribe'])
+
+        # Subscriptions with mailboxes, e.g.
+        #     comm_config['mailbox'] = {
+        #         'berrynet/data/+/rgbimage': {'policy': 'keep-latest'}
+        #     }
+        # Mailbox config can be None to dispatch messages directly.
+        self.client.mailboxes = {
+            topic: Mailbox(self.client, topic, **config)
+            for topic, config in comm_config.get('mailbox', {}).items()
+            if config is not None
+        }
+
+        self.publish_config = dict(DEFAULT_PUBLISH_CONFIG)
+        self.publish_config.update(comm_config.get('publish', {}))
+        # Messages published by self.client, used for pipelining. It is
+        # shared by mailbox threads.
+        self.pending = deque()
+        self.pending_lock = threading.Lock()
+
+    def on_disconnect(self, client, userdata, rc):
+        logger.debug('Disconnected with result code ' + str(rc))
+        # Messages not yet written are dropped by paho on reconnect.
+        with self.pending_lock:
+            self.pending.clear()
+
+    def start_mailboxes(self):
+        for mailbox in self.client.mailboxes.values():
+            if not mailbox.thread.is_alive():
+                mailbox.start()
 
     def run(self):
+        self.started = True
+        self.start_mailboxes()
         self.client.connect(
             self.client.comm_config['broker']['address'],
             self.client.comm_config['broker']['port'],
@@ -37,6 +400,8 @@ class Communicator(object):
         self.client.loop_forever()
 
     def start_nb(self):
+        self.started = True
+        self.start_mailboxes()
         self.client.connect(
             self.client.comm_config['broker']['address'],
             self.client.comm_config['broker']['port'],
@@ -46,11 +411,76 @@ class Communicator(object):
     def stop_nb(self):
         self.client.loop_stop()
 
-    def send(self, topic, payload):
+    def send(self, topic, payload, qos=None):
+        """Publish payload to topic.
+
+        Messages are published over self.client if it has been connected
+        by run() or start_nb(). Otherwise, they are published over the
+        persistent publisher shared by the process.
+
+        While self.client is reconnecting, QoS 0 messages are dropped,
+        and QoS > 0 messages are queued by self.client and published
+        after reconnection, so that callers are never blocked.
+
+        Args:
+            topic: MQTT topic.
+            payload: Message content, string or bytes.
+            qos: MQTT QoS level. Use comm_config['publish']['qos']
+                 if it is not given.
+        """
         logger.debug('Send message to topic {}'.format(topic))
         #logger.debug('Message payload {}'.format(payload))
+        if qos is None:
+            qos = self.publish_config['qos']
+        depth = self.publish_config['pipeline_depth']
+
+        if self.started:
+            connected = self.client.is_connected()
+            info = self.client.publish(topic, payload, qos=qos)
+            if not connected:
+                if qos == 0:
+                    logger.warning('Client is not connected, drop message '
+                                   'to {}'.format(topic))
+                return
+            # In run() mode, send is called from the network thread, so
+            # we can not wait for publish here, or it will be deadlocked.
+            if info.rc != mqtt.MQTT_ERR_SUCCESS:
+                logger.warning('Failed to publish message to {0}: {1}'.format(
+                    topic, mqtt.error_string(info.rc)))
+            elif depth > 0 and \
+                    self.client.loop_thread != threading.current_thread():
+                with self.pending_lock:
+                    self.pending.append(info)
+                    wait_pending(self.pending, depth)
+        else:
+            get_publisher(
+                self.client.comm_config['broker']['address'],
+                self.client.comm_config['broker']['port']
+            ).publish(topic, payload, qos=qos, pipeline_depth=depth)
+
+    def send_single(self, topic, payload):
+        """Publish payload with a new connection per message.
+
+        This is the legacy behavior of send(), and it is kept for
+        one-shot scripts and benchmarking.
+        """
         publish.single(topic, payload,
-                       hostname=self.client.comm_config['broker']['address'])
+                       hostname=self.client.comm_config['broker']['address'],
+                       port=self.client.comm_config['broker']['port'])
+
+    def flush(self, timeout=PUBLISH_TIMEOUT):
+        """Wait until all the sent messages are written to the broker."""
+        with self.pending_lock:
+            wait_pending(self.pending, 0, timeout)
+        key = (self.client.comm_config['broker']['address'],
+               self.client.comm_config['broker']['port'])
+        if key in _publishers:
+            _publishers[key].flush(timeout)
+
+    def mailbox_stats(self):
+        """Get message counters of all the mailboxes."""
+        return {topic: mailbox.stats()
+                for topic, mailbox in self.client.mailboxes.items()}
 
     def disconnect(self):
         self.client.disconnect()
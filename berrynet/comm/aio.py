@@ -0,0 +1,199 @@
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Asyncio Communicator.
+
+Paho client is driven by the asyncio event loop through its external
+socket callbacks instead of loop_forever(), so receiving, publishing and
+coroutine functors share one thread without blocking each other.
+"""
+
+import asyncio
+import socket
+import threading
+
+import paho.mqtt.client as mqtt
+
+from berrynet import logger
+from berrynet.comm import DEFAULT_PUBLISH_CONFIG
+from berrynet.comm import TopicDispatcher
+from berrynet.comm import accepts_topic
+
+
+# Seconds between reconnection attempts, doubled after each failure.
+RECONNECT_MIN_DELAY = 1
+RECONNECT_MAX_DELAY = 60
+
+
+class AsyncCommunicator(object):
+    def __init__(self, comm_config, loop=None):
+        self.comm_config = comm_config
+        self.loop = loop
+        self.client = mqtt.Client()
+        self.client.on_connect = self._on_connect
+        self.client.on_message = self._on_message
+        self.client.on_disconnect = self._on_disconnect
+        self.client.on_socket_open = self._on_socket_open
+        self.client.on_socket_close = self._on_socket_close
+        self.client.on_socket_register_write = self._on_socket_register_write
+        self.client.on_socket_unregister_write = \
+            self._on_socket_unregister_write
+        self.dispatcher = TopicDispatcher(comm_config['subscribe'])
+        self.publish_config = dict(DEFAULT_PUBLISH_CONFIG)
+        self.publish_config.update(comm_config.get('publish', {}))
+        self.misc_task = None
+        self.loop_thread = None
+        self.disconnected = None
+        self.stopping = False
+        self.reconnect_delay = RECONNECT_MIN_DELAY
+        # Running functor tasks. Event loop only keeps weak references to
+        # tasks, so they are kept here until they are done.
+        self.tasks = set()
+
+    # Paho callbacks, all of them are called in the event loop except
+    # socket callbacks, which are also called in the executor thread
+    # running connect().
+
+    def _on_connect(self, client, userdata, flags, rc):
+        logger.debug('Connected with result code ' + str(rc))
+        self.reconnect_delay = RECONNECT_MIN_DELAY
+        self.dispatcher = TopicDispatcher(self.comm_config['subscribe'])
+        for topic in self.comm_config['subscribe'].keys():
+            logger.debug('Subscribe topic {}'.format(topic))
+            client.subscribe(topic)
+
+    def _on_disconnect(self, client, userdata, rc):
+        logger.debug('Disconnected with result code ' + str(rc))
+        if not self.disconnected.done():
+            self.disconnected.set_result(rc)
+
+    def _on_message(self, client, userdata, msg):
+        """Dispatch received message to its bound functor(s).
+
+        Coroutine functors are scheduled as tasks, so the event loop can
+        keep receiving messages while they are running.
+        """
+        logger.debug('Receive message from topic {}'.format(msg.topic))
+        for pattern, channel in self.dispatcher.match(msg.topic):
+            functor = self.comm_config['subscribe'][pattern]
+            if accepts_topic(functor):
+                ret = functor(msg.payload, topic=msg.topic, channel=channel)
+            else:
+                ret = functor(msg.payload)
+            if asyncio.iscoroutine(ret):
+                task = self.loop.create_task(ret)
+                self.tasks.add(task)
+                task.add_done_callback(self._on_task_done)
+
+    def _on_task_done(self, task):
+        self.tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error('Functor failed: {}'.format(task.exception()))
+
+    def _call_in_loop(self, callback, *args):
+        """Call callback in the event loop, which is not thread-safe."""
+        if threading.current_thread() is self.loop_thread:
+            callback(*args)
+        else:
+            self.loop.call_soon_threadsafe(callback, *args)
+
+    def _on_socket_open(self, client, userdata, sock):
+        self._call_in_loop(self._open_socket, sock)
+
+    def _open_socket(self, sock):
+        self.loop.add_reader(sock, self.client.loop_read)
+        self.misc_task = self.loop.create_task(self._misc_loop())
+
+    def _on_socket_close(self, client, userdata, sock):
+        self._call_in_loop(self._close_socket, sock)
+
+    def _close_socket(self, sock):
+        self.loop.remove_reader(sock)
+        if self.misc_task is not None:
+            self.misc_task.cancel()
+
+    def _on_socket_register_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.add_writer, sock, client.loop_write)
+
+    def _on_socket_unregister_write(self, client, userdata, sock):
+        self._call_in_loop(self.loop.remove_writer, sock)
+
+    async def _misc_loop(self):
+        # Keepalive and retry of QoS > 0 messages.
+        while self.client.loop_misc() == mqtt.MQTT_ERR_SUCCESS:
+            try:
+                await asyncio.sleep(1)
+            except asyncio.CancelledError:
+                break
+
+    async def connect(self):
+        """Connect to broker.
+
+        Name resolution and TCP handshake block, so they run in the
+        default executor instead of the event loop.
+        """
+        if self.loop is None:
+            self.loop = asyncio.get_event_loop()
+        self.loop_thread = threading.current_thread()
+        self.disconnected = self.loop.create_future()
+        await self.loop.run_in_executor(
+            None, self.client.connect,
+            self.comm_config['broker']['address'],
+            self.comm_config['broker']['port'],
+            60)
+        self.client.socket().setsockopt(socket.SOL_SOCKET,
+                                        socket.SO_SNDBUF, 2048 * 1024)
+
+    async def run(self):
+        """Serve messages until disconnect() is called.
+
+        Connection lost or failed is retried with exponential backoff.
+        """
+        self.stopping = False
+        while True:
+            try:
+                await self.connect()
+                rc = await self.disconnected
+            except OSError as e:
+                rc = None
+                logger.warning('Failed to connect to broker: {}'.format(e))
+            if self.stopping:
+                return rc
+            logger.warning('Connection lost, reconnect in {} s'.format(
+                self.reconnect_delay))
+            await asyncio.sleep(self.reconnect_delay)
+            self.reconnect_delay = min(self.reconnect_delay * 2,
+                                       RECONNECT_MAX_DELAY)
+
+    def send(self, topic, payload, qos=None):
+        """Publish payload to topic.
+
+        It does not block. Message is written by the event loop when
+        socket is writable.
+        """
+        logger.debug('Send message to topic {}'.format(topic))
+        if qos is None:
+            qos = self.publish_config['qos']
+        info = self.client.publish(topic, payload, qos=qos)
+        if info.rc != mqtt.MQTT_ERR_SUCCESS:
+            logger.warning('Failed to publish message to {0}: {1}'.format(
+                topic, mqtt.error_string(info.rc)))
+        return info
+
+    def disconnect(self):
+        self.stopping = True
+        self.client.disconnect()
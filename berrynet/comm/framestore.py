@@ -0,0 +1,198 @@
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Local frame store for result-by-reference mode.
+
+Engine service puts the JPEG of a result into the store, and sends the
+result with a frame reference instead of the image. Dashboards and
+collectors on the same host fetch the JPEG from the store only when they
+need it, so the image does not cross the broker again.
+
+Frames are files in /dev/shm/<store name>, so they can be fetched by any
+process on the host. The process putting frames evicts them in FIFO
+order when capacity is reached, and frames older than TTL are expired.
+TTL of the producer is carried by frame references, so consumers expire
+frames by the same TTL.
+"""
+
+import os
+import re
+import socket
+import threading
+import time
+
+from collections import OrderedDict
+
+from berrynet import logger
+
+
+SHM_DIRPATH = '/dev/shm'
+DEFAULT_STORE_NAME = 'berrynet-frames'
+# Store names and frame ids come from MQTT messages, so they are limited
+# to plain file names, and frames can never be read or removed outside
+# of SHM_DIRPATH.
+NAME_PATTERN = re.compile(r'[A-Za-z0-9_-]+\Z')
+
+
+def is_legal_name(name):
+    return isinstance(name, str) and NAME_PATTERN.match(name) is not None
+
+
+def store_dirpath(name):
+    if not is_legal_name(name):
+        raise ValueError('Illegal frame store name {}'.format(name))
+    return os.path.join(SHM_DIRPATH, name)
+
+
+class FrameStore(object):
+    def __init__(self, name=DEFAULT_STORE_NAME, capacity=128, ttl=30,
+                 create=True):
+        """
+        Args:
+            name: Store name, the directory name in /dev/shm.
+            capacity: Max number of frames put by this process.
+            ttl: Frames older than ttl seconds are expired.
+            create: Open the store as producer, which creates the store
+                    and removes expired frames. Consumers only read
+                    frames.
+        """
+        self.name = name
+        self.dirpath = store_dirpath(name)
+        self.capacity = capacity
+        self.ttl = ttl
+        self.host = socket.gethostname()
+        self.frames = OrderedDict()   # frame id: put time
+        self.lock = threading.Lock()
+        if create:
+            os.makedirs(self.dirpath, exist_ok=True)
+            self.sweep()
+
+    def _filepath(self, frame_id):
+        if not is_legal_name(frame_id):
+            raise ValueError('Illegal frame id {}'.format(frame_id))
+        return os.path.join(self.dirpath, frame_id + '.jpg')
+
+    def put(self, frame_id, jpg_bytes):
+        """Put JPEG bytes into store.
+
+        Returns:
+            Frame reference, a small dict which can be sent by MQTT.
+        """
+        filepath = self._filepath(frame_id)
+        tmp_filepath = '{0}.{1}.tmp'.format(filepath, os.getpid())
+        with open(tmp_filepath, 'wb') as f:
+            f.write(jpg_bytes)
+        # Readers never see a half-written frame.
+        os.replace(tmp_filepath, filepath)
+        with self.lock:
+            self.frames.pop(frame_id, None)
+            self.frames[frame_id] = time.time()
+            self.evict()
+        return {
+            'id': frame_id,
+            'store': self.name,
+            'host': self.host,
+            'ttl': self.ttl
+        }
+
+    def get(self, frame_id, ttl=None):
+        """Get JPEG bytes, or None if the frame is evicted or expired.
+
+        Args:
+            ttl: TTL of the frame, TTL of this store by default.
+        """
+        if ttl is None:
+            ttl = self.ttl
+        filepath = self._filepath(frame_id)
+        try:
+            if time.time() - os.path.getmtime(filepath) > ttl:
+                return None
+            with open(filepath, 'rb') as f:
+                return f.read()
+        except (IOError, OSError):
+            return None
+
+    def evict(self):
+        """Remove frames exceeding capacity or TTL, lock is held."""
+        now = time.time()
+        while self.frames:
+            frame_id, t = next(iter(self.frames.items()))
+            if len(self.frames) <= self.capacity and now - t <= self.ttl:
+                break
+            del self.frames[frame_id]
+            self._remove(frame_id)
+
+    def sweep(self):
+        """Remove expired frames left by any process, e.g. crashed ones."""
+        now = time.time()
+        for filename in os.listdir(self.dirpath):
+            filepath = os.path.join(self.dirpath, filename)
+            try:
+                if now - os.path.getmtime(filepath) > self.ttl:
+                    os.remove(filepath)
+            except OSError:
+                pass
+
+    def _remove(self, frame_id):
+        try:
+            os.remove(self._filepath(frame_id))
+        except OSError:
+            pass
+
+    def clear(self):
+        with self.lock:
+            for frame_id in self.frames:
+                self._remove(frame_id)
+            self.frames.clear()
+
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+
+def fetch(frame_ref, ttl=30):
+    """Fetch JPEG bytes referenced by a frame reference.
+
+    Args:
+        ttl: TTL of frames if frame reference does not carry the TTL of
+             its producer.
+
+    Returns:
+        JPEG bytes, or None if the frame is not available on this host.
+    """
+    if frame_ref.get('host') != socket.gethostname():
+        logger.warning('Frame {0} is stored on host {1}, not on this '
+                       'host'.format(frame_ref['id'], frame_ref.get('host')))
+        return None
+    if not (is_legal_name(frame_ref.get('store')) and
+            is_legal_name(frame_ref.get('id'))):
+        logger.warning('Illegal frame reference {}'.format(frame_ref))
+        return None
+    try:
+        ttl = float(frame_ref.get('ttl', ttl))
+    except (TypeError, ValueError):
+        pass
+    with _stores_lock:
+        if frame_ref['store'] not in _stores:
+            if not os.path.isdir(store_dirpath(frame_ref['store'])):
+                return None
+            # Consumer never removes frames.
+            _stores[frame_ref['store']] = FrameStore(frame_ref['store'],
+                                                     ttl=ttl,
+                                                     create=False)
+        store = _stores[frame_ref['store']]
+    return store.get(frame_ref['id'], ttl)
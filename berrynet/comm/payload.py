@@ -16,14 +16,66 @@
 # along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
 
 import base64
+import copy
 import hashlib
 import json
+import re
+import struct
 
+from collections.abc import Mapping
 from datetime import datetime
 
 import cv2
 import numpy as np
 
+from berrynet import logger
+from berrynet.comm import framestore
+from berrynet.comm import shm
+
+try:
+    import xxhash
+except ImportError:
+    xxhash = None
+
+
+# Binary frame envelope
+#
+#     +-------+---------+------------+-------------+------------+-----------+
+#     | magic | version | image type | meta length | meta       | image     |
+#     | 2 B   | 1 B     | 1 B        | 4 B (BE)    | UTF-8 JSON | raw bytes |
+#     +-------+---------+------------+-------------+------------+-----------+
+#
+# Meta is the payload object without the image field, and image is carried
+# as raw bytes instead of a base64 string, so envelope is ~25% smaller than
+# the JSON payload, and consumers do not need to decode base64 anymore.
+#
+# JSON payload always starts with "{" or "[", so it never collides
+# with the magic bytes, and deserialize() can detect the payload type.
+#
+# Batch envelope carries multiple frames. Its meta is
+#
+#     {"batch": [frame meta, ...], "image_sizes": [JPEG size, ...]}
+#
+# and its image part is the concatenated JPEG bytes of the frames.
+ENVELOPE_MAGIC = b'BN'
+ENVELOPE_VERSION = 1
+ENVELOPE_HEADER = struct.Struct('!2sBBI')
+IMAGE_TYPE_NONE = 0
+IMAGE_TYPE_JPEG = 1
+IMAGE_TYPE_BATCH = 2
+
+
+class Payload(dict):
+    """Deserialized payload object.
+
+    It is a dict whose image field contains raw image bytes, and it
+    remembers whether it came from a binary envelope, so that a result
+    generalized from it will be serialized in the same format.
+    """
+    def __init__(self, *args, binary=False, **kwargs):
+        super(Payload, self).__init__(*args, **kwargs)
+        self.binary = binary
+
 
 def stringify_jpg(jpg_bytes):
     return base64.b64encode(jpg_bytes).decode('utf-8')
@@ -37,21 +89,126 @@ def destringify_jpg(stringified_jpg):
     return base64.b64decode(stringified_jpg.encode('utf-8'))
 
 
-def jpg2bgr(jpg_bytes):
+# Scale factors and imdecode flags of reduced-scale JPEG decoding, libjpeg
+# scales DCT blocks while decoding, so it is much cheaper than decoding
+# full image and resizing it.
+JPEG_REDUCED_FLAGS = (
+    (8, cv2.IMREAD_REDUCED_COLOR_8),
+    (4, cv2.IMREAD_REDUCED_COLOR_4),
+    (2, cv2.IMREAD_REDUCED_COLOR_2),
+    (1, cv2.IMREAD_COLOR),
+)
+# JPEG start of frame markers, which carry image size
+JPEG_SOF_MARKERS = frozenset(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def jpg_size(jpg_bytes):
+    """Read image size from JPEG header without decoding.
+
+    Returns:
+        (width, height), or None if it is not a valid JPEG.
     """
+    data = memoryview(jpg_bytes)
+    if bytes(data[:2]) != b'\xff\xd8':
+        return None
+    i = 2
+    while i + 4 <= len(data):
+        if data[i] != 0xFF:
+            return None
+        marker = data[i + 1]
+        if marker == 0xFF:
+            # Fill byte
+            i += 1
+            continue
+        if marker == 0x01 or 0xD0 <= marker <= 0xD9:
+            # Standalone markers without length
+            i += 2
+            continue
+        length = struct.unpack('!H', data[i + 2:i + 4])[0]
+        if marker in JPEG_SOF_MARKERS:
+            if i + 9 > len(data):
+                return None
+            height, width = struct.unpack('!HH', data[i + 5:i + 9])
+            return (width, height)
+        i += 2 + length
+    return None
+
+
+def jpg_scale(size, min_size):
+    """Get the largest JPEG decoding scale factor keeping image not
+    smaller than min_size.
+
+    Args:
+        size: (width, height) of JPEG image.
+        min_size: Min (width, height) of decoded image, e.g. network
+                  input size.
+
+    Returns:
+        Scale factor, 1, 2, 4 or 8.
+    """
+    width, height = size
+    min_w, min_h = min_size
+    for factor, _ in JPEG_REDUCED_FLAGS:
+        # libjpeg rounds up scaled size
+        if (-(-width // factor) >= min_w and
+                -(-height // factor) >= min_h):
+            return factor
+    return 1
+
+
+def decode_jpg(jpg_bytes, rgb=False, min_size=None):
+    """Decode JPEG in one step, at reduced scale if possible.
+
+    Args:
+        jpg_bytes: JPEG bytes.
+        rgb: Decode into RGB instead of BGR.
+        min_size: Min (width, height) of decoded image. JPEG is decoded
+                  at 1/2, 1/4 or 1/8 scale if the result is not smaller
+                  than it, otherwise at full scale.
+
+    Returns:
+        Tuple of image nparray and (width, height) of JPEG image.
+    """
+    size = jpg_size(jpg_bytes)
+    factor = 1
+    if min_size is not None and size is not None:
+        factor = jpg_scale(size, min_size)
+    flags = dict(JPEG_REDUCED_FLAGS)[factor]
+    convert = False
+    if rgb:
+        if hasattr(cv2, 'IMREAD_COLOR_RGB'):
+            flags = (flags & ~cv2.IMREAD_COLOR) | cv2.IMREAD_COLOR_RGB
+        else:
+            # OpenCV < 4.10 decodes into BGR only
+            convert = True
+    array = np.frombuffer(jpg_bytes, dtype=np.uint8)
+    image = cv2.imdecode(array, flags=flags)
+    if image is not None:
+        if convert:
+            cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=image)
+        if size is None:
+            size = (image.shape[1], image.shape[0])
+    return image, size
+
+
+def jpg2bgr(jpg_bytes, min_size=None):
+    """
+    :param min_size: Min (width, height) of reduced-scale decoding, see
+                     decode_jpg()
     :return: BGR bytes
     :rtype: numpy array
     """
-    array = np.frombuffer(jpg_bytes, dtype=np.uint8)
-    return cv2.imdecode(array, flags=1)
+    return decode_jpg(jpg_bytes, min_size=min_size)[0]
 
 
-def jpg2rgb(jpg_bytes):
+def jpg2rgb(jpg_bytes, min_size=None):
     """
+    :param min_size: Min (width, height) of reduced-scale decoding, see
+                     decode_jpg()
     :return: RGB bytes
     :rtype: numpy array
     """
-    return cv2.cvtColor(jpg2bgr(jpg_bytes), cv2.COLOR_BGR2RGB)
+    return decode_jpg(jpg_bytes, rgb=True, min_size=min_size)[0]
 
 
 def bgr2rgb(bgr_nparray):
@@ -79,35 +236,586 @@ def rgb2bgr(rgb_nparray):
 
 
 def generate_bytes_md5sum(content_bytes):
+    """Legacy md5sum of base64 string of the content.
+
+    Use generate_frame_id() instead for new code, it hashes raw bytes
+    in one pass.
+    """
     content_b64 = base64.b64encode(content_bytes)
     return hashlib.md5(content_b64).hexdigest()
 
 
+FRAME_ID_ALGORITHMS = ('blake2b', 'xxh64')
+FRAME_ID_DIGEST_SIZE = 8
+
+
+def generate_frame_id(content_bytes, algorithm='blake2b'):
+    """Generate content hash of raw bytes as frame id.
+
+    Frame id is a short hex string for caching and deduplication, e.g.
+    detecting repeated frames of a static scene, so a fast hash with a
+    small digest is used instead of a cryptographic one.
+
+    Args:
+        content_bytes: Bytes-like object, e.g. JPEG bytes or raw frame.
+        algorithm: blake2b (built-in) or xxh64 (faster, needs xxhash).
+                   Services comparing frame ids have to use the same
+                   algorithm.
+
+    Returns:
+        Hex string of 8-byte digest.
+    """
+    if algorithm == 'blake2b':
+        return hashlib.blake2b(
+            content_bytes, digest_size=FRAME_ID_DIGEST_SIZE).hexdigest()
+    elif algorithm == 'xxh64':
+        if xxhash is None:
+            raise Exception('xxh64 frame id needs xxhash, '
+                            'install it by pip3 install xxhash')
+        return xxhash.xxh64(content_bytes).hexdigest()
+    else:
+        raise Exception('Illegal frame id algorithm {0}, it should be one '
+                        'of {1}'.format(algorithm, FRAME_ID_ALGORITHMS))
+
+
+def get_frame_id(obj, img_key='bytes', algorithm='blake2b'):
+    """Get frame id of a deserialized payload object.
+
+    Frame id created by producer is used if there is, otherwise it is
+    generated from the image bytes.
+
+    Returns:
+        Frame id, or None if payload does not contain image.
+    """
+    if obj.get('frame_id') is not None:
+        return obj['frame_id']
+    if obj.get(img_key) is None:
+        return None
+    return generate_frame_id(obj[img_key], algorithm)
+
+
 def serialize_payload(json_object):
     return json.dumps(json_object)
 
 
-def serialize_jpg(jpg_bytes, md5sum=False, meta={}):
-    """Create Serialized JSON object consisting of image bytes and meta
+def create_jpg_object(jpg_bytes, md5sum=False, meta={}, frame_id=None):
+    """Create payload object consisting of image bytes and meta
 
-    :param imarray: JPEG bytes
-    :type imarray: bytes
-    :return: serialized image JSON
-    :rtype: string
+    :param jpg_bytes: JPEG bytes
+    :type jpg_bytes: bytes
+    :param md5sum: Add legacy md5sum field
+    :type md5sum: bool
+    :param frame_id: Frame id created by generate_frame_id
+    :type frame_id: string
+    :return: payload object with raw JPEG bytes
+    :rtype: dict
     """
     obj = {}
     obj['timestamp'] = datetime.now().isoformat()
-    obj['bytes'] = stringify_jpg(jpg_bytes)
+    obj['bytes'] = bytes(jpg_bytes)
     obj['meta'] = meta
     if md5sum:
         obj['md5sum'] = generate_bytes_md5sum(jpg_bytes)
-    return json.dumps(obj)
+    if frame_id is not None:
+        obj['frame_id'] = frame_id
+    return obj
+
+
+def serialize_jpg(jpg_bytes, md5sum=False, meta={}, binary=False,
+                  frame_id=None):
+    """Create Serialized JSON object consisting of image bytes and meta
+
+    :param imarray: JPEG bytes
+    :type imarray: bytes
+    :param md5sum: Add legacy md5sum field
+    :type md5sum: bool
+    :param binary: Create binary envelope instead of JSON
+    :type binary: bool
+    :param frame_id: Frame id created by generate_frame_id
+    :type frame_id: string
+    :return: serialized image JSON, or binary envelope
+    :rtype: string or bytes
+    """
+    return serialize(create_jpg_object(jpg_bytes, md5sum, meta, frame_id),
+                     binary=binary)
 
 
 def deserialize_payload(payload):
     return json.loads(payload)
 
 
+def create_frame_handle_object(handle, meta={}, frame_id=None):
+    """Create payload object referencing a frame in a frame ring.
+
+    :param handle: Frame handle returned by shm.FrameRing.write
+    :type handle: dict
+    :param frame_id: Frame id created by generate_frame_id
+    :type frame_id: string
+    :return: payload object with frame handle
+    :rtype: dict
+    """
+    obj = {}
+    obj['timestamp'] = datetime.now().isoformat()
+    obj['shm'] = handle
+    obj['meta'] = meta
+    if frame_id is not None:
+        obj['frame_id'] = frame_id
+    return obj
+
+
+def serialize_frame_handle(handle, meta={}, frame_id=None):
+    """Create serialized JSON object referencing a frame in a frame ring.
+
+    :param handle: Frame handle returned by shm.FrameRing.write
+    :type handle: dict
+    :param frame_id: Frame id created by generate_frame_id
+    :type frame_id: string
+    :return: serialized frame handle JSON
+    :rtype: string
+    """
+    return json.dumps(create_frame_handle_object(handle, meta, frame_id))
+
+
+def to_bgr(obj, img_key='bytes'):
+    """Get image of a payload object in BGR color model.
+
+    If payload references a frame in a frame ring, the frame is read
+    from shared memory directly without decoding.
+
+    :return: BGR image, or None if the referenced frame has expired
+    :rtype: numpy array
+    """
+    if 'shm' in obj:
+        return shm.read_frame(obj['shm'])
+    return jpg2bgr(obj[img_key])
+
+
+def attach_frame_jpg(obj, img_key='bytes', frame=None, rgb=False):
+    """Replace frame handle in payload object by JPEG bytes of the frame.
+
+    Payload referencing a frame ring can only be consumed on the same
+    host, so the frame is encoded before payload is sent out.
+
+    Producer may overwrite the slot while the frame is used, so the
+    image is not attached if the slot is overwritten before the JPEG is
+    encoded.
+
+    Args:
+        frame: The referenced frame which has been read, e.g. the frame
+               being inferred. It is read from the ring if it is None.
+        rgb: frame is in RGB color model.
+    """
+    obj = copy.copy(obj)
+    handle = obj.pop('shm')
+    if frame is None:
+        frame = shm.read_frame(handle)
+    if frame is not None:
+        if rgb:
+            frame = rgb2bgr(frame)
+        jpg_bytes = cv2.imencode('.jpg', frame)[1].tobytes()
+        if shm.is_frame_valid(handle):
+            obj[img_key] = jpg_bytes
+            return obj
+    logger.warning('Referenced frame has expired, '
+                   'payload will not contain image')
+    return obj
+
+
+def to_reference(obj, store, img_key='bytes'):
+    """Move image of a payload object into a frame store.
+
+    Args:
+        obj: Payload object, e.g. generalized result.
+        store: framestore.FrameStore.
+        img_key: Key of the image field.
+
+    Returns:
+        Payload object with frame reference instead of image.
+    """
+    if 'shm' in obj and obj.get(img_key) is None:
+        obj = attach_frame_jpg(obj, img_key=img_key)
+    if obj.get(img_key) is None:
+        return obj
+    jpg_bytes = obj[img_key]
+    if isinstance(jpg_bytes, str):
+        jpg_bytes = destringify_jpg(jpg_bytes)
+    ref_obj = Payload({k: v for k, v in obj.items() if k != img_key},
+                      binary=getattr(obj, 'binary', False))
+    # Image may be drawn by engine service, so it is hashed again
+    # instead of using the frame id from camera.
+    ref_obj['frame_ref'] = store.put(generate_frame_id(jpg_bytes),
+                                     jpg_bytes)
+    return ref_obj
+
+
+def pop_image(obj, img_key='bytes'):
+    """Pop image of a payload object.
+
+    Image referenced by frame reference is fetched from frame store.
+
+    Returns:
+        JPEG bytes, or None if payload does not contain image or the
+        referenced frame is not available.
+    """
+    if obj.get(img_key) is not None:
+        return obj.pop(img_key)
+    if 'frame_ref' in obj:
+        return framestore.fetch(obj.pop('frame_ref'))
+    return None
+
+
+def is_envelope(pl):
+    """Check whether the payload is a binary envelope."""
+    return isinstance(pl, (bytes, bytearray, memoryview)) and \
+        bytes(pl[:len(ENVELOPE_MAGIC)]) == ENVELOPE_MAGIC
+
+
+_TIMESTAMP_PATTERN = re.compile(rb'"timestamp":\s*"([^"]+)"')
+
+
+def peek_timestamp(pl, max_size=256):
+    """Get timestamp of a serialized payload without deserializing it.
+
+    Timestamp is the first field of payloads created by serialize_jpg,
+    so only the beginning of JSON payload or envelope meta is searched.
+
+    :return: Payload timestamp, or None if it is not found
+    :rtype: datetime
+    """
+    if is_envelope(pl):
+        meta_len = ENVELOPE_HEADER.unpack_from(pl)[3]
+        head = bytes(pl[ENVELOPE_HEADER.size:
+                        ENVELOPE_HEADER.size + min(meta_len, max_size)])
+    elif isinstance(pl, str):
+        head = pl[:max_size].encode('utf-8')
+    else:
+        head = bytes(pl[:max_size])
+    m = _TIMESTAMP_PATTERN.search(head)
+    if m is None:
+        return None
+    try:
+        return datetime.fromisoformat(m.group(1).decode('utf-8'))
+    except ValueError:
+        return None
+
+
+def pack_envelope(obj, img_key='bytes'):
+    """Create binary envelope from a payload object.
+
+    Args:
+        obj: Payload object, its image field contains raw JPEG bytes.
+        img_key: Key of the image field.
+
+    Returns:
+        Binary envelope in bytes.
+    """
+    meta = {k: v for k, v in obj.items() if k != img_key}
+    meta_bytes = json.dumps(meta).encode('utf-8')
+    if obj.get(img_key) is None:
+        image_type = IMAGE_TYPE_NONE
+        image_bytes = b''
+    else:
+        image_type = IMAGE_TYPE_JPEG
+        image_bytes = bytes(obj[img_key])
+    header = ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION,
+                                  image_type, len(meta_bytes))
+    return b''.join([header, meta_bytes, image_bytes])
+
+
+def pack_batch_envelope(objs, img_key='bytes'):
+    """Create batch envelope from payload objects.
+
+    Args:
+        objs: List of payload objects, their image fields contain raw
+              JPEG bytes, or None (e.g. frame handle payloads).
+        img_key: Key of the image field.
+
+    Returns:
+        Batch envelope in bytes.
+    """
+    metas = []
+    images = []
+    for obj in objs:
+        metas.append({k: v for k, v in obj.items() if k != img_key})
+        images.append(b'' if obj.get(img_key) is None
+                      else bytes(obj[img_key]))
+    meta_bytes = json.dumps({
+        'batch': metas,
+        'image_sizes': [len(image) for image in images]
+    }).encode('utf-8')
+    header = ENVELOPE_HEADER.pack(ENVELOPE_MAGIC, ENVELOPE_VERSION,
+                                  IMAGE_TYPE_BATCH, len(meta_bytes))
+    return b''.join([header, meta_bytes] + images)
+
+
+def unpack_envelope(pl, img_key='bytes'):
+    """Parse binary envelope created by pack_envelope or
+    pack_batch_envelope.
+
+    Args:
+        pl: Binary envelope.
+        img_key: Key of the image field.
+
+    Returns:
+        Payload object (or a list of them for batch envelope), its image
+        field contains raw JPEG bytes.
+    """
+    magic, version, image_type, meta_len = \
+        ENVELOPE_HEADER.unpack_from(pl)
+    if version > ENVELOPE_VERSION:
+        raise ValueError('Unsupported envelope version {}'.format(version))
+    offset = ENVELOPE_HEADER.size
+    meta = json.loads(bytes(pl[offset:offset + meta_len]))
+    offset += meta_len
+    if image_type == IMAGE_TYPE_BATCH:
+        objs = []
+        for frame_meta, size in zip(meta['batch'], meta['image_sizes']):
+            obj = Payload(frame_meta, binary=True)
+            if size > 0:
+                obj[img_key] = bytes(pl[offset:offset + size])
+            offset += size
+            objs.append(obj)
+        return objs
+    obj = Payload(meta, binary=True)
+    if image_type != IMAGE_TYPE_NONE:
+        obj[img_key] = bytes(pl[offset:])
+    return obj
+
+
+def serialize(obj, binary=None, img_key='bytes'):
+    """Serialize payload object into JSON string or binary envelope.
+
+    Args:
+        obj: Payload object, its image field can be raw JPEG bytes or
+             base64 string. Frame handle is replaced by JPEG bytes.
+        binary: Create binary envelope if True, or JSON string if False.
+                If it is None, follow the format of the received payload
+                which obj is deserialized from.
+        img_key: Key of the image field.
+
+    Returns:
+        Serialized payload, string or bytes.
+    """
+    if binary is None:
+        binary = getattr(obj, 'binary', False)
+    if 'shm' in obj and obj.get(img_key) is None:
+        obj = attach_frame_jpg(obj, img_key=img_key)
+    img = obj.get(img_key)
+    if binary:
+        if isinstance(img, str):
+            obj = dict(obj)
+            obj[img_key] = destringify_jpg(img)
+        return pack_envelope(obj, img_key=img_key)
+    if img is not None and not isinstance(img, str):
+        obj = dict(obj)
+        obj[img_key] = stringify_jpg(bytes(img))
+    return json.dumps(obj)
+
+
+def serialize_batch(objs, binary=False, img_key='bytes'):
+    """Serialize multiple payload objects into one batch payload.
+
+    Frame handles are kept as they are, so a batch of frame handles can
+    be sent through MQTT, too.
+
+    Args:
+        objs: List of payload objects, e.g. created by create_jpg_object.
+        binary: Create batch envelope if True, or JSON list if False.
+        img_key: Key of the image field.
+
+    Returns:
+        Serialized batch payload, string or bytes.
+    """
+    if binary:
+        return pack_batch_envelope(objs, img_key=img_key)
+    batch = []
+    for obj in objs:
+        img = obj.get(img_key)
+        if img is not None and not isinstance(img, str):
+            obj = dict(obj)
+            obj[img_key] = stringify_jpg(bytes(img))
+        batch.append(obj)
+    return json.dumps(batch)
+
+
+def deserialize(pl, img_key='bytes'):
+    """Deserialize JSON or binary envelope payload.
+
+    The payload type is detected automatically, so consumers can receive
+    payloads from both legacy JSON and binary envelope producers.
+
+    Args:
+        pl: MQTT payload.
+        img_key: Key of the image field.
+
+    Returns:
+        Payload object (or a list of them if payload is a batch, i.e.
+        JSON list or batch envelope), and its image field contains raw
+        JPEG bytes.
+    """
+    if is_envelope(pl):
+        return unpack_envelope(pl, img_key=img_key)
+
+    if isinstance(pl, (bytes, bytearray)):
+        pl = pl.decode('utf-8')
+    obj = json.loads(pl)
+
+    def to_payload(o):
+        o = Payload(o)
+        if isinstance(o.get(img_key), str):
+            o[img_key] = destringify_jpg(o[img_key])
+        return o
+
+    if isinstance(obj, list):
+        return [to_payload(o) for o in obj]
+    return to_payload(obj)
+
+
+class LazyPayload(Mapping):
+    """Payload object whose image is decoded on first access.
+
+    Consumers filtering results by annotations (e.g. notification
+    clients) usually drop most of the payloads, so only the small
+    meta part is parsed when it is accessed, and the image field is not
+    base64-decoded or copied until it is accessed.
+
+    It is a read-only mapping of the payload object. `meta` is the
+    payload object without the image field, the same as the meta part
+    of a binary envelope.
+    """
+    def __init__(self, pl, img_key='bytes'):
+        self.pl = pl
+        self.img_key = img_key
+        self.binary = is_envelope(pl)
+        self._meta = None
+        self._image_src = None   # base64 string or envelope image offset
+        self._image = None
+
+    def _parse(self):
+        if self._meta is not None:
+            return
+        if self.binary:
+            magic, version, image_type, meta_len = \
+                ENVELOPE_HEADER.unpack_from(self.pl)
+            if version > ENVELOPE_VERSION:
+                raise ValueError(
+                    'Unsupported envelope version {}'.format(version))
+            if image_type == IMAGE_TYPE_BATCH:
+                raise ValueError('Lazy payload can not be a batch')
+            offset = ENVELOPE_HEADER.size
+            self._meta = json.loads(
+                bytes(self.pl[offset:offset + meta_len]))
+            if image_type != IMAGE_TYPE_NONE:
+                self._image_src = offset + meta_len
+        else:
+            self._meta, self._image_src = \
+                _split_json_image(self.pl, self.img_key)
+
+    @property
+    def meta(self):
+        self._parse()
+        return self._meta
+
+    @property
+    def annotations(self):
+        return self.meta.get('annotations', [])
+
+    @property
+    def image(self):
+        """Raw JPEG bytes, or None if payload does not contain image.
+
+        Image referenced by frame reference is fetched from frame store.
+        """
+        self._parse()
+        if self._image is None:
+            if self._image_src is not None:
+                if self.binary:
+                    self._image = bytes(self.pl[self._image_src:])
+                else:
+                    self._image = base64.b64decode(self._image_src)
+            elif 'frame_ref' in self._meta:
+                self._image = framestore.fetch(self._meta['frame_ref'])
+        return self._image
+
+    def has_image(self):
+        self._parse()
+        return self._image_src is not None
+
+    def to_payload(self):
+        """Get the fully decoded Payload object."""
+        obj = Payload(self.meta, binary=self.binary)
+        if self.has_image():
+            obj[self.img_key] = self.image
+        return obj
+
+    def __getitem__(self, key):
+        if key == self.img_key and self.has_image():
+            return self.image
+        return self.meta[key]
+
+    def __iter__(self):
+        for key in self.meta:
+            yield key
+        if self.has_image():
+            yield self.img_key
+
+    def __len__(self):
+        return len(self.meta) + int(self.has_image())
+
+
+_JSON_IMAGE_PATTERNS = {}
+
+
+def _split_json_image(pl, img_key):
+    """Parse JSON payload except its base64 image string.
+
+    Base64 string never contains quote or backslash, so it can be cut
+    out of the JSON text without scanning it by JSON parser.
+
+    Returns:
+        Tuple of payload object without image, and base64 image bytes
+        (None if payload does not contain image).
+    """
+    if isinstance(pl, str):
+        pl = pl.encode('utf-8')
+    pattern = _JSON_IMAGE_PATTERNS.get(img_key)
+    if pattern is None:
+        pattern = re.compile(
+            rb'"' + re.escape(img_key.encode('utf-8')) + rb'"\s*:\s*"')
+        _JSON_IMAGE_PATTERNS[img_key] = pattern
+    m = pattern.search(pl)
+    if m is not None:
+        end = pl.find(b'"', m.end())
+        if end != -1:
+            meta = json.loads(b''.join([pl[:m.end() - 1],
+                                        b'null',
+                                        pl[end + 1:]]))
+            # The key matched may not be the top-level image field,
+            # e.g. in a list payload, then parse the whole payload.
+            if isinstance(meta, dict) and img_key in meta and \
+                    meta[img_key] is None:
+                del meta[img_key]
+                return meta, pl[m.end():end]
+    obj = json.loads(pl)
+    if not isinstance(obj, dict):
+        raise ValueError('Lazy payload must be a JSON object')
+    img = obj.pop(img_key, None)
+    return obj, None if img is None else img.encode('utf-8')
+
+
+def deserialize_lazy(pl, img_key='bytes'):
+    """Deserialize JSON or binary envelope payload lazily.
+
+    Args:
+        pl: MQTT payload.
+        img_key: Key of the image field.
+
+    Returns:
+        LazyPayload object.
+    """
+    return LazyPayload(pl, img_key=img_key)
+
+
 #def deserialize_jpg(jpg_json):
 #    """Deserialized JSON object created by josnify_image.
 #
@@ -128,3 +836,10 @@ if __name__ == '__main__':
     # TODO: Can we write JPEG bytes into file directly to prevent
     #       bytes -> numpy array -> decode RGB -> write encoded JPEG
     cv2.imwrite('/tmp/dog.jpg', jpg2bgr(destringify_jpg(d_jpg['bytes'])))
+
+    # size of binary envelope is close to original
+    b_jpg = serialize_jpg(jpg_bytes, binary=True)
+    print('JPEG: {0}, JSON: {1}, envelope: {2}'.format(
+        len(jpg_bytes), len(s_jpg), len(b_jpg)))
+    with open('/tmp/dog-envelope.jpg', 'wb') as f:
+        f.write(deserialize(b_jpg)['bytes'])
@@ -0,0 +1,196 @@
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Shared-memory frame ring for same-host frame transport.
+
+Producer (e.g. camera client) writes raw BGR frames into a ring buffer
+backed by a file in /dev/shm, and sends only a small handle through MQTT.
+Consumers on the same host map the same file and read the frame without
+any encoding, decoding or copy.
+
+Ring file layout:
+
+    ring header | slot 0 header | slot 0 data | slot 1 header | ...
+
+A slot is overwritten after the producer writes `slots` more frames, so
+the sequence number in the handle is checked to detect expired frames.
+"""
+
+import mmap
+import os
+import socket
+import struct
+import threading
+
+import numpy as np
+
+
+SHM_DIRPATH = '/dev/shm'
+RING_MAGIC = b'BNRING01'
+RING_HEADER = struct.Struct('=8sII')   # magic, slots, slot data size
+SLOT_HEADER = struct.Struct('=QIIII')  # seq, height, width, channels, nbytes
+HEADER_SIZE = 64                       # keep frame data aligned
+
+
+def ring_filepath(name):
+    return os.path.join(SHM_DIRPATH, name)
+
+
+class FrameRing(object):
+    def __init__(self, name, slots=0, slot_size=0, create=False):
+        """
+        Args:
+            name: Ring name, the file name in /dev/shm.
+            slots: Number of frames can be held in the ring.
+                   It is only used when creating a ring.
+            slot_size: Max frame size in bytes.
+                       It is only used when creating a ring.
+            create: Create (or recreate) the ring as producer if True,
+                    or open an existing ring as consumer if False.
+        """
+        self.name = name
+        self.filepath = ring_filepath(name)
+        if create:
+            # Create a new file instead of truncating the existing one,
+            # consumers still mapping the old file will not be crashed
+            # by SIGBUS, and they will reopen the ring by inode change.
+            if os.path.exists(self.filepath):
+                os.remove(self.filepath)
+            with open(self.filepath, 'wb') as f:
+                f.truncate(HEADER_SIZE +
+                           slots * (HEADER_SIZE + slot_size))
+                f.write(RING_HEADER.pack(RING_MAGIC, slots, slot_size))
+        with open(self.filepath, 'r+b') as f:
+            self.mm = mmap.mmap(f.fileno(), 0)
+            self.inode = os.fstat(f.fileno()).st_ino
+        magic, self.slots, self.slot_size = RING_HEADER.unpack_from(self.mm)
+        if magic != RING_MAGIC:
+            raise ValueError('{} is not a frame ring'.format(self.filepath))
+        self.seq = 0
+        self.host = socket.gethostname()
+
+    def _slot_offset(self, slot):
+        return HEADER_SIZE + slot * (HEADER_SIZE + self.slot_size)
+
+    def write(self, frame):
+        """Write a frame into the next slot.
+
+        Args:
+            frame: Image nparray (uint8), e.g. BGR frame from VideoCapture.
+
+        Returns:
+            Frame handle, a small dict which can be sent by MQTT.
+        """
+        if frame.nbytes > self.slot_size:
+            raise ValueError('Frame size {0} exceeds slot size {1}'.format(
+                frame.nbytes, self.slot_size))
+        self.seq += 1
+        slot = self.seq % self.slots
+        offset = self._slot_offset(slot)
+        h, w = frame.shape[:2]
+        c = frame.shape[2] if frame.ndim == 3 else 1
+
+        # Invalidate the slot before overwriting its data, so that
+        # consumers will not read a half-written frame.
+        SLOT_HEADER.pack_into(self.mm, offset, 0, 0, 0, 0, 0)
+        data_offset = offset + HEADER_SIZE
+        self.mm[data_offset:data_offset + frame.nbytes] = \
+            np.ascontiguousarray(frame).data.cast('B')
+        SLOT_HEADER.pack_into(self.mm, offset, self.seq, h, w, c,
+                              frame.nbytes)
+        return {
+            'name': self.name,
+            'host': self.host,
+            'slot': slot,
+            'seq': self.seq,
+            'shape': [h, w, c]
+        }
+
+    def read(self, handle, copy=False):
+        """Read the frame referenced by the handle.
+
+        Args:
+            handle: Frame handle returned by write().
+            copy: Return a copy instead of a view of the shared memory.
+                  A view is only valid until the producer overwrites
+                  the slot.
+
+        Returns:
+            Image nparray, or None if the frame has been overwritten.
+        """
+        offset = self._slot_offset(handle['slot'])
+        seq, h, w, c, nbytes = SLOT_HEADER.unpack_from(self.mm, offset)
+        if seq != handle['seq']:
+            return None
+        frame = np.frombuffer(self.mm, dtype=np.uint8, count=nbytes,
+                              offset=offset + HEADER_SIZE)
+        frame = frame.reshape((h, w, c) if c > 1 else (h, w))
+        if copy:
+            return frame.copy()
+        # Shared frame may be read by other consumers.
+        frame.flags.writeable = False
+        return frame
+
+    def is_valid(self, handle):
+        """Check whether the frame referenced by handle is not overwritten."""
+        offset = self._slot_offset(handle['slot'])
+        return SLOT_HEADER.unpack_from(self.mm, offset)[0] == handle['seq']
+
+    def close(self):
+        self.mm.close()
+
+    def unlink(self):
+        self.close()
+        os.remove(self.filepath)
+
+
+_rings = {}
+_rings_lock = threading.Lock()
+
+
+def is_local(handle):
+    """Check whether the frame ring of the handle is on this host."""
+    return handle.get('host') == socket.gethostname() and \
+        os.path.exists(ring_filepath(handle['name']))
+
+
+def open_ring(name):
+    """Get the frame ring opened by this process as consumer.
+
+    The ring is reopened if producer has recreated it.
+    """
+    inode = os.stat(ring_filepath(name)).st_ino
+    with _rings_lock:
+        # The old mapping is not closed explicitly, because frames
+        # read from it may still be in use.
+        if name not in _rings or _rings[name].inode != inode:
+            _rings[name] = FrameRing(name)
+        return _rings[name]
+
+
+def is_frame_valid(handle):
+    """Check whether the frame referenced by the handle is not overwritten,
+    e.g. after a view returned by read_frame() has been used."""
+    return is_local(handle) and open_ring(handle['name']).is_valid(handle)
+
+
+def read_frame(handle, copy=False):
+    """Read the frame referenced by the handle from its frame ring."""
+    if not is_local(handle):
+        raise IOError('Frame ring {0} is on host {1}, not on this host'.format(
+            handle['name'], handle.get('host')))
+    return open_ring(handle['name']).read(handle, copy=copy)
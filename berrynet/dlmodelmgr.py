@@ -18,28 +18,178 @@
 """
 DL Model Manager, following the DLModelBox model package
 speccification.
+
+Packages are kept in an in-memory index, optionally persisted as a JSON
+file. A lookup only stats the base directory and files of packages, a
+package is parsed again only if its meta.json is changed, and a file is
+hashed again only if it is changed, so the manager can be polled
+cheaply on boxes of many packages.
 """
 
 from __future__ import print_function
 
 import argparse
+import copy
+import hashlib
 import json
 import os
+import tempfile
 
 from berrynet import logger
 
 
+HASH_CHUNK_SIZE = 1 << 20
+
+
+def _stat_key(stat):
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def get_input_size(meta):
+    """Get network input size (width, height) of model meta.
+
+    It is read from input_size ([width, height]) or input_shape
+    ([height, width, channels], NHWC without batch) of meta.json, or
+    None if the package does not tell.
+    """
+    if 'input_size' in meta:
+        return tuple(meta['input_size'][:2])
+    if 'input_shape' in meta:
+        return tuple(meta['input_shape'][1::-1])
+    return None
+
+
 class DLModelManager(object):
-    def __init__(self):
-        self.basedir = '/usr/share/dlmodels'
+    def __init__(self, basedir='/usr/share/dlmodels', index_path=None,
+                 hashes=False):
+        """
+        Args:
+            basedir: Directory of model packages.
+            index_path: JSON file to persist the index, so that a new
+                        manager does not parse and hash unchanged
+                        packages again. The index is kept in memory
+                        only if it is None.
+            hashes: Compute SHA-1 of package files, see get_file_info().
+        """
+        self.basedir = basedir
+        self.index_path = index_path
+        self.hashes = hashes
+        self.basedir_stat = None
+        self.names = []
+        # {package name: entry}, an entry keeps stat of meta.json, parsed
+        # meta, and sizes (and hashes) of files referred by meta.
+        self.packages = {}
+        self._by_task = {}
+        self._by_backend = {}
+        self._by_input_size = {}
+        if index_path is not None:
+            self._load_index()
+
+    def refresh(self):
+        """Update index by mtime of base directory, meta.json files and
+        files referred by meta.json.
+
+        Returns:
+            True if any package is added, removed or changed.
+        """
+        stat = _stat_key(os.stat(self.basedir))
+        changed = False
+        if stat != self.basedir_stat:
+            self.names = os.listdir(self.basedir)
+            self.basedir_stat = stat
+            for name in set(self.packages) - set(self.names):
+                del self.packages[name]
+                changed = True
+        for name in self.names:
+            changed |= self._refresh_package(name)
+        if changed:
+            self._build_lookup()
+            self._save_index()
+        return changed
 
     def get_model_names(self):
-        return os.listdir(self.basedir)
+        self.refresh()
+        return list(self.names)
 
     def get_model_meta(self, modelname):
-        meta_filepath = os.path.join(self.basedir, modelname, 'meta.json')
-        with open(meta_filepath, 'r') as f:
-            meta = json.load(f)
+        if self._refresh_package(modelname):
+            self._build_lookup()
+            self._save_index()
+        if modelname not in self.packages:
+            raise IOError('Model package {} has no meta.json'.format(
+                os.path.join(self.basedir, modelname)))
+        return copy.deepcopy(self.packages[modelname]['resolved'])
+
+    def get_file_info(self, modelname):
+        """Get {path: {'size': bytes, 'sha1': hex digest}} of model,
+        label and config files of a package.
+
+        sha1 is set only if the manager is created with hashes enabled.
+        """
+        self.get_model_meta(modelname)
+        return {path: {k: v for k, v in info.items() if k != 'stat'}
+                for path, info in self.packages[modelname]['files'].items()}
+
+    def find(self, task=None, backend=None, input_size=None):
+        """Find names of packages matching all given conditions.
+
+        Args:
+            task: Task of meta.json, e.g. classification or detection.
+            backend: Framework of meta.json, e.g. tensorflow-lite.
+            input_size: Network input size (width, height), see
+                        get_input_size().
+        """
+        self.refresh()
+        names = set(self.packages)
+        if task is not None:
+            names &= self._by_task.get(task, set())
+        if backend is not None:
+            names &= self._by_backend.get(backend, set())
+        if input_size is not None:
+            names &= self._by_input_size.get(tuple(input_size), set())
+        return sorted(names)
+
+    def _refresh_package(self, name):
+        meta_filepath = os.path.join(self.basedir, name, 'meta.json')
+        entry = self.packages.get(name)
+        try:
+            stat = _stat_key(os.stat(meta_filepath))
+        except OSError:
+            if entry is None:
+                return False
+            del self.packages[name]
+            return True
+        if entry is not None and entry['stat'] == stat:
+            # Model and label files may be replaced without touching
+            # meta.json.
+            files = self._file_info(entry['resolved'], entry['files'])
+            if files == entry['files']:
+                return False
+            entry['files'] = files
+            return True
+        try:
+            with open(meta_filepath, 'r') as f:
+                meta = json.load(f)
+        except (OSError, ValueError) as e:
+            logger.warning('Failed to read {}: {}'.format(meta_filepath, e))
+            return self.packages.pop(name, None) is not None
+        try:
+            resolved = self._resolve_meta(name, meta)
+        except (KeyError, TypeError, AttributeError) as e:
+            # One broken package should not hide the others.
+            logger.warning('Illegal meta {}: {!r}'.format(meta_filepath, e))
+            return self.packages.pop(name, None) is not None
+        old_files = entry['files'] if entry is not None else {}
+        self.packages[name] = {
+            'stat': stat,
+            'meta': meta,
+            'resolved': resolved,
+            'files': self._file_info(resolved, old_files)
+        }
+        return True
+
+    def _resolve_meta(self, modelname, meta):
+        meta = copy.deepcopy(meta)
         meta['model'] = os.path.join(self.basedir, modelname, meta['model'])
         meta['label'] = os.path.join(self.basedir, modelname, meta['label'])
         for k, v in meta['config'].items():
@@ -47,11 +197,88 @@ class DLModelManager(object):
                                              meta['config'][k])
         return meta
 
+    def _file_info(self, meta, old_files):
+        files = {}
+        for path in [meta['model'], meta['label']] + list(
+                meta['config'].values()):
+            try:
+                stat = _stat_key(os.stat(path))
+            except OSError:
+                continue
+            info = old_files.get(path)
+            if info is None or info['stat'] != stat:
+                info = {'stat': stat, 'size': stat[1]}
+            if self.hashes and 'sha1' not in info:
+                info = dict(info, sha1=self._hash(path))
+            files[path] = info
+        return files
+
+    def _hash(self, path):
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha1.update(chunk)
+        return sha1.hexdigest()
+
+    def _build_lookup(self):
+        self._by_task = {}
+        self._by_backend = {}
+        self._by_input_size = {}
+        for name, entry in self.packages.items():
+            meta = entry['meta']
+            for lookup, key in [
+                    (self._by_task, meta.get('task')),
+                    (self._by_backend, meta.get('framework')),
+                    (self._by_input_size, get_input_size(meta))]:
+                if key is not None:
+                    lookup.setdefault(key, set()).add(name)
+
+    def _load_index(self):
+        try:
+            with open(self.index_path, 'r') as f:
+                index = json.load(f)
+        except (OSError, ValueError):
+            return
+        # Index of another base directory is useless.
+        if index.get('basedir') != self.basedir:
+            return
+        self.packages = index['packages']
+        self._build_lookup()
+
+    def _save_index(self):
+        if self.index_path is None:
+            return
+        index = {'basedir': self.basedir, 'packages': self.packages}
+        tmp_path = None
+        try:
+            dirname = os.path.dirname(os.path.abspath(self.index_path))
+            os.makedirs(dirname, exist_ok=True)
+            # Write and rename, so readers never see a partial index.
+            fd, tmp_path = tempfile.mkstemp(dir=dirname, suffix='.tmp')
+            with os.fdopen(fd, 'w') as f:
+                json.dump(index, f)
+            os.replace(tmp_path, self.index_path)
+        except OSError as e:
+            logger.warning('Failed to save model index {}: {}'.format(
+                self.index_path, e))
+        finally:
+            if tmp_path is not None and os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
 
 def parse_args():
     ap = argparse.ArgumentParser()
     ap.add_argument('--modelname',
                     help='Model package name (without version)')
+    ap.add_argument('--task',
+                    help='List packages of the task')
+    ap.add_argument('--backend',
+                    help='List packages of the framework')
+    ap.add_argument('--input-size',
+                    nargs=2,
+                    type=int,
+                    metavar=('WIDTH', 'HEIGHT'),
+                    help='List packages of the network input size')
     return vars(ap.parse_args())
 
 
@@ -60,5 +287,11 @@ if __name__ == '__main__':
     logger.debug('model package name: ', args['modelname'])
 
     dlmm = DLModelManager()
-    for name in dlmm.get_model_names():
+    if args['modelname']:
+        names = [args['modelname']]
+    else:
+        names = dlmm.find(task=args['task'],
+                          backend=args['backend'],
+                          input_size=args['input_size'])
+    for name in names:
         print(dlmm.get_model_meta(name))
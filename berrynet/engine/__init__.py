@@ -21,6 +21,17 @@ different backends (e.g. TensorFlow, Caffe2, etc.)
 """
 
 class DLEngine(object):
+    # Max number of threads which can call the engine at the same time.
+    # Engines keeping per-frame state between process_input and
+    # process_output are not thread-safe.
+    concurrency = 1
+    # (width, height) of network input. If it is set, services may
+    # decode JPEG at reduced scale not smaller than it, and pass sizes of
+    # the original images by image_size of process_input and
+    # image_sizes of process_input_batch, so that boxes are scaled to
+    # the original images.
+    input_size = None
+
     def __init__(self):
         self.model_input_cache = []
         self.model_output_cache = []
@@ -46,9 +57,73 @@ class DLEngine(object):
     def process_output(self, output):
         return output
 
+    # Batch interfaces
+    #
+    # Engines supporting batched inference override the three methods
+    # below together, so that a batch of frames is processed by one
+    # inference call. The default implementation processes frames one by
+    # one, because engines may keep per-frame state between process_input
+    # and process_output, e.g. input image size.
+
+    def process_input_batch(self, tensors, image_sizes=None):
+        """Preprocess a batch of input tensors.
+
+        Args:
+            tensors: List of input tensors, e.g. image nparrays.
+            image_sizes: List of (width, height) of original images, used
+                         by engines with input_size. None items or None
+                         mean the sizes of tensors.
+
+        Returns:
+            Batch input of inference_batch. By default it is the list of
+            input tensors, and each of them is processed in
+            inference_batch.
+        """
+        return list(tensors)
+
+    def inference_batch(self, batch):
+        """Run inference on a batch created by process_input_batch.
+
+        Returns:
+            Batch output of process_output_batch. By default it is the
+            list of processed outputs.
+        """
+        return [self.process_output(self.inference(self.process_input(t)))
+                for t in batch]
+
+    def process_output_batch(self, output):
+        """Split batch output into processed outputs of each frame.
+
+        Returns:
+            List of processed outputs, the same as process_output.
+        """
+        return output
+
+    def infer_batch(self, tensors, image_sizes=None):
+        """Run the whole engine on a batch of input tensors.
+
+        Returns:
+            List of processed outputs in the order of input tensors.
+        """
+        batch = self.process_input_batch(tensors, image_sizes)
+        return self.process_output_batch(self.inference_batch(batch))
+
     def cache_data(self, key, value):
         self.cache[key] = value
 
     def save_cache(self):
         with open(self.cache['model_output_filepath'], 'w') as f:
             f.write(str(self.cache['model_output']))
+
+
+def original_sizes(tensors, sizes=None):
+    """Get (width, height) of original images of input tensors.
+
+    Args:
+        tensors: List of image nparrays.
+        sizes: List of original image sizes, None items or None mean the
+               sizes of tensors.
+    """
+    sizes = sizes or [None] * len(tensors)
+    return [tuple(size) if size is not None else (t.shape[1], t.shape[0])
+            for t, size in zip(tensors, sizes)]
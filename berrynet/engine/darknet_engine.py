@@ -31,6 +31,8 @@ import numpy as np
 from berrynet import logger
 #from berrynet.dlmodelmgr import DLModelManager
 from berrynet.engine import DLEngine
+from berrynet.engine import postprocess
+from berrynet.engine import preprocess
 from ctypes import *
 
 
@@ -119,53 +121,82 @@ def c_array(ctype, values):
     return arr
 
 
-def nparray_to_image(arr):
+class DetectionBuffers(object):
+    """Buffers of Darknet image and detections, reused by every frame.
+
+    They are NumPy arrays handed to Darknet by pointers, so an image is
+    written by vectorized NumPy instead of element by element, and boxes
+    and probabilities are read back as NumPy views without copying.
+    """
+    def __init__(self, net, classes):
+        self.num = num_boxes(net)
+        self.classes = classes
+        # BOX is 4 floats (x, y, w, h).
+        self.boxes = np.zeros((self.num, 4), dtype=np.float32)
+        self.boxes_ptr = self.boxes.ctypes.data_as(POINTER(BOX))
+        # Like make_probs, a row has a slot after class probabilities,
+        # and probs is an array of row pointers.
+        self.probs = np.zeros((self.num, classes + 1), dtype=np.float32)
+        self.probs_ptr = (POINTER(c_float) * self.num)(
+            *[row.ctypes.data_as(POINTER(c_float)) for row in self.probs])
+        self.image = None
+
+    def to_image(self, arr):
+        """Write nparray into the image buffer, see nparray_to_image()."""
+        if self.image is None or self.image.shape[1:] != arr.shape[:2]:
+            self.image = np.empty((arr.shape[2],) + arr.shape[:2],
+                                  dtype=np.float32)
+        return nparray_to_image(arr, self.image)
+
+    def class_probs(self):
+        """View of class probabilities, shape (num, classes)."""
+        return self.probs[:, :self.classes]
+
+
+def nparray_to_image(arr, out=None):
     """Convert nparray to Darknet image struct.
     Args:
         arr: nparray containing source image in BGR color model.
+        out: float32 CHW buffer of image data. It is allocated if it is
+             None, and it must be kept alive while the image is used.
 
     Returns:
-        Darknet image struct, whose data is a C array
-        containing flatten image in BGR color model.
+        Darknet image struct, whose data is out containing image in RGB
+        color model scaled to [0, 1].
+    """
+    h, w, c = arr.shape
+    if out is None:
+        out = np.empty((c, h, w), dtype=np.float32)
+    # BGR to RGB (rgbgr_image), HWC to CHW, and scaling in one pass
+    preprocess.write_nchw(arr, out, swap_rb=True, std=255.0)
+    return IMAGE(w, h, c, out.ctypes.data_as(POINTER(c_float)))
+
+
+def detect_np(net, meta, np_img, thresh=.3, hier_thresh=.5, nms=.45,
+              buffers=None):
+    """Detect objects in nparray.
+
+    Args:
+        buffers: DetectionBuffers of net. They are allocated per call if
+                 it is None.
     """
-    arr = arr.transpose(2,0,1)
-    c = arr.shape[0]
-    h = arr.shape[1]
-    w = arr.shape[2]
-    arr = (arr/255.0).flatten()
-    data = c_array(c_float, arr)
-    im = IMAGE(w, h, c, data)
-    rgbgr_image(im)
-    return im
-
-
-def detect_np(net, meta, np_img, thresh=.3, hier_thresh=.5, nms=.45):
-    im = nparray_to_image(np_img)
-    boxes = make_boxes(net)
-    probs = make_probs(net)
-    num = num_boxes(net)
+    if buffers is None:
+        buffers = DetectionBuffers(net, meta.classes)
+    im = buffers.to_image(np_img)
     t_start = time.time()
-    network_detect(net, im, thresh, hier_thresh, nms, boxes, probs)
+    network_detect(net, im, thresh, hier_thresh, nms,
+                   buffers.boxes_ptr, buffers.probs_ptr)
     t_end = time.time()
     logger.debug('inference time: {} s'.format(t_end - t_start))
-    res = []
-    for j in range(num):
-        for i in range(meta.classes):
-            if probs[j][i] > 0:
-                res.append(
-                    {
-                        'type': 'detection',
-                        'label': meta.names[i].decode('utf-8'),
-                        'confidence': probs[j][i],
-                        'left': boxes[j].x - (boxes[j].w / 2),
-                        'top': boxes[j].y - (boxes[j].h / 2),
-                        'right': boxes[j].x + (boxes[j].w / 2),
-                        'bottom': boxes[j].y + (boxes[j].h / 2),
-                        'id': -1
-                    }
-                )
-    free_ptrs(cast(probs, POINTER(c_void_p)), num)
-    return res
+    prob_array = buffers.class_probs()
+    box_ids, class_ids = np.nonzero(prob_array > 0)
+    return postprocess.annotate_detections(
+        buffers.boxes[box_ids],
+        prob_array[box_ids, class_ids],
+        class_ids,
+        [meta.names[i].decode('utf-8') for i in range(meta.classes)],
+        box_format='cxcywh',
+        extra={'type': 'detection', 'id': -1})
 
 
 class DarknetEngine(DLEngine):
@@ -173,21 +204,24 @@ class DarknetEngine(DLEngine):
     def __init__(self, config, model, meta=''):
         super(DarknetEngine, self).__init__()
 
+        t = time.time()
         self.net = load_net(config, model, 0)
         self.meta = load_meta(meta)
         self.classes = self.meta.classes
         self.labels = [self.meta.names[i].decode('utf-8')
                        for i in range(self.classes)]
+        self.buffers = DetectionBuffers(self.net, self.classes)
 
         # Warmup
         zero_image = np.zeros(shape=(416, 416, 3), dtype=np.uint8)
-        detect_np(self.net, self.meta, zero_image)
+        detect_np(self.net, self.meta, zero_image, buffers=self.buffers)
+        logger.info('Model loaded in {:.3f} s'.format(time.time() - t))
 
     def process_input(self, rgb_array):
         return rgb_array
 
     def inference(self, tensor):
-        return detect_np(self.net, self.meta, tensor)
+        return detect_np(self.net, self.meta, tensor, buffers=self.buffers)
 
     def process_output(self, output):
         return {'annotations': output}
@@ -0,0 +1,145 @@
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Persistent cache of compiled models.
+
+Engines save what is expensive to rebuild at startup, e.g. a compiled
+network blob or the result of a layer support check, so that a service
+restarted by supervisor does not compile the model again.
+
+Entries of a model are kept in a directory named by a key of model file
+hashes, backend name and backend version, so a changed model or an
+upgraded backend never hits stale entries. Hashes are indexed by path,
+size and mtime, so model files are only hashed again after they change.
+"""
+
+import contextlib
+import hashlib
+import json
+import os
+import tempfile
+
+from berrynet import logger
+
+
+# Keep cache at a persistent place, the same owner rule as log file.
+if os.geteuid() == 0:  # root
+    DEFAULT_CACHE_DIR = '/var/cache/berrynet/models'
+else:
+    DEFAULT_CACHE_DIR = '{}/.cache/berrynet/models'.format(os.getenv('HOME'))
+
+HASH_CHUNK_SIZE = 1 << 20
+
+
+class ModelCache(object):
+    def __init__(self, cache_dir=None):
+        self.cache_dir = cache_dir or DEFAULT_CACHE_DIR
+        self.index_path = os.path.join(self.cache_dir, 'hashes.json')
+
+    def file_hash(self, path):
+        """Get SHA-1 of a file, reusing the indexed hash if the file is
+        not changed."""
+        stat = os.stat(path)
+        path = os.path.abspath(path)
+        index = self._read_json(self.index_path) or {}
+        entry = index.get(path)
+        if (entry is not None and entry['size'] == stat.st_size and
+                entry['mtime'] == stat.st_mtime):
+            return entry['sha1']
+
+        sha1 = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(HASH_CHUNK_SIZE), b''):
+                sha1.update(chunk)
+        index[path] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime,
+            'sha1': sha1.hexdigest()
+        }
+        self._write_json(self.index_path, index)
+        return index[path]['sha1']
+
+    def key(self, files, backend, version=''):
+        """Get cache key of model files built by a backend.
+
+        Args:
+            files: Model file paths, e.g. OpenVINO IR xml and bin.
+            backend: Backend and options the entries depend on, e.g.
+                     openvino-MYRIAD-b1.
+            version: Backend version.
+        """
+        h = hashlib.sha1()
+        for path in files:
+            h.update(self.file_hash(path).encode('utf-8'))
+        h.update(backend.encode('utf-8'))
+        h.update(str(version).encode('utf-8'))
+        return '{}-{}'.format(backend, h.hexdigest()[:16])
+
+    def path(self, key, name):
+        """Get file path of an entry."""
+        return os.path.join(self.cache_dir, key, name)
+
+    def has(self, key, name):
+        return os.path.exists(self.path(key, name))
+
+    def read_json(self, key, name):
+        """Read a JSON entry, or None if it does not exist."""
+        return self._read_json(self.path(key, name))
+
+    def write_json(self, key, name, obj):
+        self._write_json(self.path(key, name), obj)
+
+    def writing(self, key, name):
+        """Context of writing an entry by a backend API which takes a file
+        path, e.g. exporting compiled network.
+
+        The temporary path it gives is renamed to the entry when the
+        context exits without error, so readers never see a partial
+        entry.
+        """
+        return self._writing(self.path(key, name))
+
+    @contextlib.contextmanager
+    def _writing(self, path):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path),
+                                        suffix='.tmp')
+        os.close(fd)
+        try:
+            yield tmp_path
+            os.replace(tmp_path, path)
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def _read_json(self, path):
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_json(self, path, obj):
+        # A service should start without cache, e.g. cache directory is
+        # not writable.
+        try:
+            with self._writing(path) as tmp_path:
+                with open(tmp_path, 'w') as f:
+                    json.dump(obj, f)
+        except OSError as e:
+            logger.warning('Failed to write model cache {}: {}'.format(
+                path, e))
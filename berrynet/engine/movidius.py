@@ -24,6 +24,8 @@ import numpy as np
 
 from mvnc import mvncapi as mvnc
 
+from berrynet.engine import postprocess
+
 
 class MovidiusNeuralGraph(object):
     def __init__(self, graph_filepath, label_filepath):
@@ -156,24 +158,20 @@ def process_mobilenetssd_output(output, img_w, img_h, labels, threshold=0.1):
     result_index = 7
     result_size = 7
     num_valid_boxes = int(output[boxnum_index])
-    annotations = []
-
-    for i in range(num_valid_boxes):
-        base_index = result_index + result_size * i
-        result_objinfo = output[base_index:(base_index + result_size)]
-
-        anno = {}
-        anno['label'] = labels[int(result_objinfo[1])]
-        anno['confidence'] = float(result_objinfo[2])
-        anno['left'] = int(result_objinfo[3] * img_w)
-        anno['top'] = int(result_objinfo[4] * img_h)
-        anno['right'] = int(result_objinfo[5] * img_w)
-        anno['bottom'] = int(result_objinfo[6] * img_h)
-
-        if anno['confidence'] >= threshold:
-            annotations.append(anno)
-
-    return {'annotations': annotations}
+    results = np.asarray(output[result_index:
+                                result_index + result_size * num_valid_boxes])
+    results = results.reshape(-1, result_size)
+
+    return {
+        'annotations': postprocess.annotate_detections(
+            results[:, 3:7],
+            results[:, 2],
+            results[:, 1],
+            labels,
+            img_size=(img_w, img_h),
+            threshold=threshold,
+            box_format='xyxy')
+    }
 
 
 if __name__ == '__main__':
@@ -20,21 +20,226 @@
 
 import logging
 import os
+import queue
 import sys
 
 from argparse import ArgumentParser
+from collections import deque
 from time import time
 
 from berrynet.engine import DLEngine
+from berrynet.engine import original_sizes
+from berrynet.engine import postprocess
+from berrynet.engine import preprocess
 import cv2
 import numpy as np
 
 from berrynet import logger
 from openvino.inference_engine import IENetwork, IEPlugin
+try:
+    from openvino.inference_engine import IECore
+except ImportError:
+    # Compiled network can not be imported before IECore API.
+    IECore = None
 
 
-class OpenVINOClassifierEngine(DLEngine):
-    def __init__(self, model, labels=None, top_k=3, device='CPU'):
+class InferRequestPool(object):
+    """Pool of asynchronous infer requests of an executable network.
+
+    Blobs are submitted as soon as an infer request is idle, so the
+    device keeps working on in-flight requests while callers preprocess
+    and postprocess other frames. A caller holding in-flight requests
+    never blocks on acquiring another one, it waits for its oldest
+    request instead, so concurrent callers can not deadlock.
+
+    Frames are resized into a preallocated buffer of the request and
+    transposed straight into its input blob, so no blob is allocated and
+    copied per inference.
+    """
+    def __init__(self, exec_net, input_blob, out_blob):
+        self.exec_net = exec_net
+        self.input_blob = input_blob
+        self.out_blob = out_blob
+        self.size = len(exec_net.requests)
+        self.idle = queue.Queue()
+        self.buffers = []
+        for request_id in range(self.size):
+            n, c, h, w = exec_net.requests[request_id].inputs[
+                input_blob].shape
+            self.buffers.append(preprocess.resize_buffer((h, w, c)))
+            self.idle.put(request_id)
+
+    def _acquire(self, block):
+        try:
+            return self.idle.get(block)
+        except queue.Empty:
+            return None
+
+    def submit(self, request_id, frames):
+        """Write BGR frames into input blob of an infer request and start
+        it. Slots of the blob without frame are zero padded."""
+        try:
+            request = self.exec_net.requests[request_id]
+            blob = request.inputs[self.input_blob]
+            for i, frame in enumerate(frames):
+                preprocess.write_nchw(frame, blob[i],
+                                      self.buffers[request_id])
+            blob[len(frames):] = 0
+            request.async_infer()
+        except Exception:
+            self.idle.put(request_id)
+            raise
+
+    def wait(self, request_id):
+        """Wait for an infer request and release it.
+
+        Returns:
+            Copy of output blob, the request buffer is reused by the next
+            submission.
+        """
+        try:
+            request = self.exec_net.requests[request_id]
+            status = request.wait(-1)
+            if status != 0:
+                raise Exception('Infer request {} failed, status {}'.format(
+                    request_id, status))
+            return np.copy(request.outputs[self.out_blob])
+        finally:
+            self.idle.put(request_id)
+
+    def infer(self, batches):
+        """Infer batches of frames with as many in-flight requests as
+        possible.
+
+        Args:
+            batches: List of frame lists, a list is at most network batch
+                     size.
+
+        Returns:
+            List of output blobs in the order of batches.
+        """
+        pending = deque()
+        outputs = []
+        for frames in batches:
+            request_id = self._acquire(block=not pending)
+            while request_id is None:
+                outputs.append(self.wait(pending.popleft()))
+                request_id = self._acquire(block=not pending)
+            self.submit(request_id, frames)
+            pending.append(request_id)
+        while pending:
+            outputs.append(self.wait(pending.popleft()))
+        return outputs
+
+
+class OpenVINOEngine(DLEngine):
+    """Common infer request management of OpenVINO engines.
+
+    Per-frame state (e.g. image size) travels with the blobs, and infer
+    requests are borrowed from a pool, so an engine with N requests can
+    be called by N threads at the same time to keep the device busy.
+
+    With a model cache, the compiled network is exported after it is
+    loaded, if the plugin supports it (e.g. MYRIAD), and the next start
+    imports it without reading IR, checking layers and compiling.
+    Otherwise, the passed layer check is cached and skipped next time.
+    """
+    def _init_cache(self, model_cache, model_xml, model_bin, device,
+                    batch_size):
+        self.plugin = None
+        self.model_cache = model_cache
+        self.cache_meta = None
+        if model_cache is None:
+            self.cache_state = 'disabled'
+            return
+        self.cache_key = model_cache.key(
+            [model_xml, model_bin],
+            'openvino-{}-b{}'.format(device, batch_size),
+            get_openvino_version())
+        self.cache_meta = model_cache.read_json(self.cache_key,
+                                                'network.json')
+        self.cache_state = 'miss' if self.cache_meta is None else 'hit'
+
+    def _import_network(self, device, num_requests):
+        """Import compiled network from model cache.
+
+        Returns:
+            True if network is imported.
+        """
+        meta = self.cache_meta
+        if meta is None or not meta['exported'] or IECore is None:
+            return False
+        try:
+            self.exec_net = IECore().import_network(
+                model_file=self.model_cache.path(self.cache_key,
+                                                 'network.blob'),
+                device_name=device,
+                num_requests=num_requests)
+        except Exception as e:
+            logger.warning('Failed to import cached network: {}'.format(e))
+            return False
+        self.input_blob = meta['input_blob']
+        self.out_blob = meta['out_blob']
+        self.n, self.c, self.h, self.w = meta['shape']
+        self._init_pool(num_requests)
+        return True
+
+    def _save_network(self):
+        """Save network info, and compiled network if plugin can export
+        it, into model cache."""
+        if self.model_cache is None or self.cache_meta is not None:
+            return
+        meta = {
+            'input_blob': self.input_blob,
+            'out_blob': self.out_blob,
+            'shape': [self.n, self.c, self.h, self.w],
+            'exported': False
+        }
+        if hasattr(self.exec_net, 'export'):
+            try:
+                with self.model_cache.writing(self.cache_key,
+                                              'network.blob') as path:
+                    self.exec_net.export(path)
+                meta['exported'] = True
+            except Exception as e:
+                logger.info('Compiled network is not cached: {}'.format(e))
+        self.model_cache.write_json(self.cache_key, 'network.json', meta)
+
+    def _log_load_time(self, t):
+        logger.info('Model loaded in {:.3f} s (cache {})'.format(
+            time() - t, self.cache_state))
+
+    def _init_requests(self, net, num_requests):
+        # Loading model to the plugin
+        logger.debug("Loading model to the plugin")
+        self.exec_net = self.plugin.load(network=net,
+                                         num_requests=num_requests)
+        self._init_pool(num_requests)
+
+    def _init_pool(self, num_requests):
+        self.requests = InferRequestPool(self.exec_net,
+                                         self.input_blob,
+                                         self.out_blob)
+        self.concurrency = num_requests
+        self.input_size = (self.w, self.h)
+
+    def __delete__(self, instance):
+        del self.exec_net
+        del self.plugin
+
+    def process_input(self, tensor, image_size=None):
+        return self.process_input_batch([tensor], [image_size])
+
+    def inference(self, tensor):
+        return self.inference_batch(tensor)
+
+    def process_output(self, output):
+        return self.process_output_batch(output)[0]
+
+
+class OpenVINOClassifierEngine(OpenVINOEngine):
+    def __init__(self, model, labels=None, top_k=3, device='CPU',
+                 batch_size=1, num_requests=2, model_cache=None):
         """
         Args:
             model: Path to an .xml file with a trained model.
@@ -46,6 +251,15 @@ class OpenVINOClassifierEngine(DLEngine):
             labels: Labels mapping file
 
             top_k: Number of top results
+
+            batch_size: Batch size of the loaded network. Batch size is
+                        static in OpenVINO, smaller batches are padded.
+
+            num_requests: Number of asynchronous infer requests, which is
+                          the max number of concurrent inferences.
+
+            model_cache: ModelCache of compiled network, or None to
+                         disable caching.
         """
         super(OpenVINOClassifierEngine, self).__init__()
 
@@ -62,6 +276,13 @@ class OpenVINOClassifierEngine(DLEngine):
             self.labels_map = None
         self.top_k = top_k
 
+        t = time()
+        self._init_cache(model_cache, model_xml, model_bin, device,
+                         batch_size)
+        if self._import_network(device, num_requests):
+            self._log_load_time(t)
+            return
+
         # Plugin initialization for specified device and
         # load extensions library if specified
         #
@@ -74,7 +295,8 @@ class OpenVINOClassifierEngine(DLEngine):
                      '\n\txml: {0}\n\tbin: {1}'.format(model_xml, model_bin))
         net = IENetwork.from_ir(model=model_xml, weights=model_bin)
 
-        if self.plugin.device == "CPU":
+        # Layers are checked already if the model is cached.
+        if self.plugin.device == "CPU" and self.cache_meta is None:
             supported_layers = self.plugin.get_supported_layers(net)
             not_supported_layers = [l for l in net.layers.keys() if l not in supported_layers]
             if len(not_supported_layers) != 0:
@@ -88,63 +310,66 @@ class OpenVINOClassifierEngine(DLEngine):
         logger.debug("Preparing input blobs")
         self.input_blob = next(iter(net.inputs))
         self.out_blob = next(iter(net.outputs))
-        net.batch_size = 1
+        net.batch_size = batch_size
 
         self.n, self.c, self.h, self.w = net.inputs[self.input_blob].shape
 
-        # Loading model to the plugin
-        logger.debug("Loading model to the plugin")
-        self.exec_net = self.plugin.load(network=net)
+        self._init_requests(net, num_requests)
+        self._save_network()
 
         del net
+        self._log_load_time(t)
 
-    def __delete__(self, instance):
-        del self.exec_net
-        del self.plugin
-
-    def process_input(self, tensor):
-        """Resize tensor (if needed) and change layout from HWC to CHW.
+    def process_input_batch(self, tensors, image_sizes=None):
+        """Split tensors into batches of network batch size. Tensors are
+        resized (if needed) and changed from HWC to CHW layout into input
+        blobs by inference.
 
         Args:
-            tensor: Input BGR tensor (OpenCV convention)
+            tensors: Input BGR tensors (OpenCV convention)
 
         Returns:
-            Resized and transposed tensor
+            Batches and the number of frames.
         """
-        if tensor.shape[:-1] != (self.h, self.w):
-            logger.warning("Input tensor is resized from {} to {}".format(
-                tensor.shape[:-1], (self.h, self.w)))
-            tensor = cv2.resize(tensor, (self.w, self.h))
-        tensor = tensor.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-        return tensor
-
-    def inference(self, tensor):
+        for tensor in tensors:
+            if tensor.shape[:-1] != (self.h, self.w):
+                logger.warning("Input tensor is resized from {} to {}".format(
+                    tensor.shape[:-1], (self.h, self.w)))
+        return {
+            'batches': split_batches(tensors, self.n),
+            'count': len(tensors)
+        }
+
+    def inference_batch(self, batch):
         logger.debug("Starting inference")
-        res = self.exec_net.infer(inputs={self.input_blob: tensor})
-        return res[self.out_blob]
+        output = np.concatenate(self.requests.infer(batch['batches']))
+        # Drop outputs of padding frames
+        return output[:batch['count']]
 
-    def process_output(self, output):
+    def process_output_batch(self, output):
         logger.debug("Processing output blob")
         logger.debug("Top {} results: ".format(self.top_k))
+        return [{'annotations': self._annotate(probs)} for probs in output]
 
+    def _annotate(self, probs):
         annotations = []
-        for i, probs in enumerate(output):
-            probs = np.squeeze(probs)
-            top_ind = np.argsort(probs)[-self.top_k:][::-1]
-            for id in top_ind:
-                det_label = self.labels_map[id] if self.labels_map else "#{}".format(id)
-                logger.debug("\t{:.7f} label {}".format(probs[id], det_label))
-
-                annotations.append({
-                    'type': 'classification',
-                    'label': det_label,
-                    'confidence': float(probs[id])
-                })
-        return {'annotations': annotations}
-
-
-class OpenVINODetectorEngine(DLEngine):
-    def __init__(self, model, labels=None, threshold=0.3, device='CPU'):
+        probs = np.squeeze(probs)
+        top_ind = postprocess.top_k_indices(probs, self.top_k)
+        for id in top_ind:
+            det_label = self.labels_map[id] if self.labels_map else "#{}".format(id)
+            logger.debug("\t{:.7f} label {}".format(probs[id], det_label))
+
+            annotations.append({
+                'type': 'classification',
+                'label': det_label,
+                'confidence': float(probs[id])
+            })
+        return annotations
+
+
+class OpenVINODetectorEngine(OpenVINOEngine):
+    def __init__(self, model, labels=None, threshold=0.3, device='CPU',
+                 batch_size=1, num_requests=2, model_cache=None):
         super(OpenVINODetectorEngine, self).__init__()
 
         # Prepare model and labels
@@ -157,6 +382,13 @@ class OpenVINODetectorEngine(DLEngine):
             self.labels_map = None
         self.threshold = threshold
 
+        t = time()
+        self._init_cache(model_cache, model_xml, model_bin, device,
+                         batch_size)
+        if self._import_network(device, num_requests):
+            self._log_load_time(t)
+            return
+
         # Plugin initialization for specified device and
         # load extensions library if specified
         #
@@ -182,7 +414,8 @@ class OpenVINODetectorEngine(DLEngine):
                      '\n\txml: {0}\n\tbin: {1}'.format(model_xml, model_bin))
         net = IENetwork(model=model_xml, weights=model_bin)
 
-        if self.plugin.device == "CPU":
+        # Layers are checked already if the model is cached.
+        if self.plugin.device == "CPU" and self.cache_meta is None:
             supported_layers = self.plugin.get_supported_layers(net)
             not_supported_layers = [l for l in net.layers.keys() if l not in supported_layers]
             if len(not_supported_layers) != 0:
@@ -199,98 +432,83 @@ class OpenVINODetectorEngine(DLEngine):
         logger.debug("Preparing input blobs")
         self.input_blob = next(iter(net.inputs))
         self.out_blob = next(iter(net.outputs))
+        # Batch size is static, smaller batches are padded.
+        net.batch_size = batch_size
 
         self.n, self.c, self.h, self.w = net.inputs[self.input_blob].shape
 
-        # Loading model to the plugin
-        self.exec_net = self.plugin.load(network=net, num_requests=2)
+        self._init_requests(net, num_requests)
+        self._save_network()
 
         del net
+        self._log_load_time(t)
 
-        # Initialize engine mode: sync or async
-        #
-        # FIXME: async mode does not work currently.
-        #        process_input needs to provide two input tensors for async.
-        self.is_async_mode = False
-        self.cur_request_id = 0
-        self.next_request_id = 1
-
-    def __delete__(self, instance):
-        del self.exec_net
-        del self.plugin
+    def process_input_batch(self, tensors, image_sizes=None):
+        """Split tensors into batches of network batch size. Tensors are
+        resized into input blobs by inference.
 
-    def process_input(self, tensor, next_tensor=None):
-        frame = tensor
-        next_frame = next_tensor
-
-        # original input shape will be used in process_output
-        self.img_w = tensor.shape[1]
-        self.img_h = tensor.shape[0]
-
-        # Main sync point:
-        # in the truly Async mode we start the NEXT infer request, while waiting for the CURRENT to complete
-        # in the regular mode we start the CURRENT request and immediately wait for it's completion
-        if self.is_async_mode:
-            in_frame = cv2.resize(next_frame, (self.w, self.h))
-            in_frame = in_frame.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-            in_frame = in_frame.reshape((self.n, self.c, self.h, self.w))
-        else:
-            in_frame = cv2.resize(frame, (self.w, self.h))
-            in_frame = in_frame.transpose((2, 0, 1))  # Change data layout from HWC to CHW
-            in_frame = in_frame.reshape((self.n, self.c, self.h, self.w))
-        return in_frame
+        Returns:
+            Batches and original image sizes.
+        """
+        return {
+            'batches': split_batches(tensors, self.n),
+            'sizes': original_sizes(tensors, image_sizes)
+        }
 
-    def inference(self, tensor):
+    def inference_batch(self, batch):
         inf_start = time()
-        if self.is_async_mode:
-            self.exec_net.start_async(request_id=self.next_request_id, inputs={self.input_blob: tensor})
-        else:
-            self.exec_net.start_async(request_id=self.cur_request_id, inputs={self.input_blob: tensor})
-
-        if self.exec_net.requests[self.cur_request_id].wait(-1) == 0:
-            inf_end = time()
-            det_time = inf_end - inf_start
-            if self.is_async_mode:
-                logger.debug('Inference time: N\A for async mode')
-            else:
-                logger.debug("Inference time: {:.3f} ms".format(det_time * 1000))
-
-            # Parse detection results of the current request
-            res = self.exec_net.requests[self.cur_request_id].outputs[self.out_blob]
-        else:
-            res = None
-
-        return res
-
-        # FIXME: async mode does not work currently.
-        #        process_input needs to provide two input tensors for async.
-        if self.is_async_mode:
-            self.cur_request_id, self.next_request_id = self.next_request_id, self.cur_request_id
-            frame = next_frame
-
-    def process_output(self, output):
+        outputs = self.requests.infer(batch['batches'])
+        logger.debug("Inference time: {:.3f} ms".format(
+            (time() - inf_start) * 1000))
+        return {
+            'outputs': outputs,
+            'sizes': batch['sizes']
+        }
+
+    def process_output_batch(self, output):
         logger.debug("Processing output blob")
         logger.debug("Threshold: {}".format(self.threshold))
-
-        annotations = []
-        for obj in output[0][0]:
-            # Collect objects when probability more than specified threshold
-            if obj[2] > self.threshold:
-                xmin = int(obj[3] * self.img_w)
-                ymin = int(obj[4] * self.img_h)
-                xmax = int(obj[5] * self.img_w)
-                ymax = int(obj[6] * self.img_h)
-                class_id = int(obj[1])
-                det_label = self.labels_map[class_id] if self.labels_map else str(class_id)
-                annotations.append({
-                    'label': det_label,
-                    'confidence': float(obj[2]),
-                    'left': xmin,
-                    'top': ymin,
-                    'right': xmax,
-                    'bottom': ymax
-                })
-        return {'annotations': annotations}
+        results = []
+        for i, (img_w, img_h) in enumerate(output['sizes']):
+            # DetectionOutput of a blob is [1, 1, N, 7], and the first
+            # value of each detection is image id in the blob.
+            detections = output['outputs'][i // self.n][0][0]
+            results.append({
+                'annotations': self._annotate(detections, i % self.n,
+                                              img_w, img_h)
+            })
+        return results
+
+    def _annotate(self, detections, image_id, img_w, img_h):
+        # Image id -1 marks the end of detections
+        end = np.flatnonzero(detections[:, 0] < 0)
+        if end.size:
+            detections = detections[:end[0]]
+        # Collect objects when probability more than specified threshold
+        detections = detections[
+            (detections[:, 0].astype(np.int64) == image_id) &
+            (detections[:, 2] > self.threshold)]
+        return postprocess.annotate_detections(
+            detections[:, 3:7],
+            detections[:, 2],
+            detections[:, 1],
+            self.labels_map,
+            img_size=(img_w, img_h),
+            box_format='xyxy')
+
+
+def split_batches(frames, batch_size):
+    """Split frames into lists of at most batch size."""
+    return [frames[i:i + batch_size]
+            for i in range(0, len(frames), batch_size)]
+
+
+def get_openvino_version():
+    """Get Inference Engine version for model cache key."""
+    import openvino.inference_engine as ie
+    if hasattr(ie, 'get_version'):
+        return ie.get_version()
+    return getattr(ie, '__version__', 'unknown')
 
 
 def get_distribution_info():
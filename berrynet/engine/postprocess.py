@@ -0,0 +1,259 @@
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Vectorized post-processing shared by inference engines.
+
+Candidate boxes are thresholded, scaled and converted to Python types in
+bulk by NumPy, and annotations are built in one pass, instead of
+converting box by box.
+
+YOLO box filtering and class-aware non-max suppression are implemented
+in NumPy as well, so that TFLite engines do not depend on TensorFlow.
+"""
+
+import numpy as np
+
+
+BOX_FORMATS = ('yxyx', 'xyxy', 'cxcywh')
+
+
+def top_k_indices(scores, k):
+    """Get indices of the top k scores in descending order.
+
+    Args:
+        scores: 1-D array of scores.
+        k: Number of indices.
+
+    Returns:
+        Array of indices.
+    """
+    scores = np.asarray(scores).reshape(-1)
+    k = min(int(k), scores.size)
+    if k <= 0:
+        return np.empty(0, dtype=np.intp)
+    if k < scores.size:
+        indices = np.argpartition(scores, -k)[-k:]
+    else:
+        indices = np.arange(scores.size)
+    return indices[np.argsort(scores[indices])[::-1]]
+
+
+def annotate_detections(boxes, scores, classes, labels, img_size=None,
+                        threshold=None, top_k=None, box_format='yxyx',
+                        extra=None):
+    """Convert detection outputs into annotations.
+
+    Args:
+        boxes: Array of boxes, shape (N, 4).
+        scores: Array of confidences, shape (N,).
+        classes: Array of class indices, shape (N,).
+        labels: List of labels indexed by class, or None to use class
+                indices as labels.
+        img_size: (width, height) of image. Normalized boxes are scaled
+                  to pixel coordinates (int). If it is None, boxes are
+                  already in pixel coordinates and are kept as float.
+        threshold: Boxes with confidence less than threshold are
+                   dropped. No filtering if it is None.
+        top_k: Keep at most top_k boxes of the highest confidences. Boxes
+               are in the original order if it is None.
+        box_format: yxyx (SSD), xyxy or cxcywh (YOLO).
+        extra: Dict of additional keys of each annotation.
+
+    Returns:
+        List of annotations.
+    """
+    if box_format not in BOX_FORMATS:
+        raise ValueError('Illegal box format {0}, it should be one of '
+                         '{1}'.format(box_format, BOX_FORMATS))
+    boxes = np.asarray(boxes).reshape(-1, 4)
+    scores = np.asarray(scores).reshape(-1)
+    classes = np.asarray(classes).reshape(-1)
+
+    if threshold is None:
+        keep = np.arange(scores.size)
+    else:
+        keep = np.flatnonzero(scores >= threshold)
+    if top_k is not None and keep.size > top_k:
+        keep = keep[top_k_indices(scores[keep], top_k)]
+    if keep.size == 0:
+        return []
+
+    # Compute in float64, the same as Python float arithmetic.
+    b = boxes[keep].astype(np.float64)
+    if box_format == 'yxyx':
+        left, top, right, bottom = b[:, 1], b[:, 0], b[:, 3], b[:, 2]
+    elif box_format == 'xyxy':
+        left, top, right, bottom = b[:, 0], b[:, 1], b[:, 2], b[:, 3]
+    else:
+        half_w = b[:, 2] / 2
+        half_h = b[:, 3] / 2
+        left, top = b[:, 0] - half_w, b[:, 1] - half_h
+        right, bottom = b[:, 0] + half_w, b[:, 1] + half_h
+    coords = np.stack([left, top, right, bottom], axis=1)
+    if img_size is not None:
+        img_w, img_h = img_size
+        coords = (coords * [img_w, img_h, img_w, img_h]).astype(np.int64)
+
+    class_ids = classes[keep].astype(np.int64).tolist()
+    if labels is None:
+        names = [str(c) for c in class_ids]
+    else:
+        names = [labels[c] for c in class_ids]
+    extra = extra or {}
+    return [
+        dict({
+            'label': name,
+            'confidence': confidence,
+            'left': left,
+            'top': top,
+            'right': right,
+            'bottom': bottom
+        }, **extra)
+        for name, confidence, (left, top, right, bottom)
+        in zip(names, scores[keep].tolist(), coords.tolist())
+    ]
+
+
+def yolo_filter_boxes(box_xywh, scores, score_threshold=0.4,
+                      input_shape=(416, 416)):
+    """Drop YOLO candidates whose best class score is under threshold.
+
+    Args:
+        box_xywh: Array of (center x, center y, width, height) boxes in
+                  pixels of network input, shape (batch, N, 4).
+        scores: Array of class scores, shape (batch, N, classes).
+        score_threshold: Min best class score of kept candidates.
+        input_shape: (height, width) of network input.
+
+    Returns:
+        Tuple of normalized (ymin, xmin, ymax, xmax) boxes, shape
+        (batch, M, 4), and their class scores, shape (batch, M, classes).
+        Like the TensorFlow implementation, the number of kept boxes
+        must be the same for all the images in a batch.
+    """
+    box_xywh = np.asarray(box_xywh, dtype=np.float32)
+    scores = np.asarray(scores, dtype=np.float32)
+    mask = scores.max(axis=-1) >= score_threshold
+    batch = scores.shape[0]
+    class_boxes = box_xywh[mask].reshape(batch, -1, box_xywh.shape[-1])
+    pred_conf = scores[mask].reshape(batch, -1, scores.shape[-1])
+
+    input_shape = np.asarray(input_shape, dtype=np.float32)
+    box_yx = class_boxes[..., 1::-1]
+    box_hw = class_boxes[..., 3:1:-1]
+    box_mins = (box_yx - (box_hw / np.float32(2.))) / input_shape
+    box_maxes = (box_yx + (box_hw / np.float32(2.))) / input_shape
+    boxes = np.concatenate([box_mins, box_maxes], axis=-1)
+    return boxes, pred_conf
+
+
+def box_iou(box, boxes):
+    """IoU of a (ymin, xmin, ymax, xmax) box and an array of boxes.
+
+    Corners may be in any order, and IoU of empty boxes is 0, the same as
+    TensorFlow non-max suppression.
+    """
+    box = np.asarray(box, dtype=np.float32)
+    boxes = np.asarray(boxes, dtype=np.float32).reshape(-1, 4)
+    y1, x1 = min(box[0], box[2]), min(box[1], box[3])
+    y2, x2 = max(box[0], box[2]), max(box[1], box[3])
+    ys1 = np.minimum(boxes[:, 0], boxes[:, 2])
+    xs1 = np.minimum(boxes[:, 1], boxes[:, 3])
+    ys2 = np.maximum(boxes[:, 0], boxes[:, 2])
+    xs2 = np.maximum(boxes[:, 1], boxes[:, 3])
+    area = (y2 - y1) * (x2 - x1)
+    areas = (ys2 - ys1) * (xs2 - xs1)
+    inter = (np.maximum(np.minimum(y2, ys2) - np.maximum(y1, ys1), 0) *
+             np.maximum(np.minimum(x2, xs2) - np.maximum(x1, xs1), 0))
+    union = area + areas - inter
+    iou = np.zeros(len(boxes), dtype=np.float32)
+    valid = (area > 0) & (areas > 0)
+    iou[valid] = inter[valid] / union[valid]
+    return iou
+
+
+def non_max_suppression(boxes, scores, max_output_size, iou_threshold=0.5,
+                        score_threshold=float('-inf')):
+    """Greedy non-max suppression of boxes of one class.
+
+    Candidates with score greater than score_threshold are visited by
+    descending score (lower index first for ties), and a candidate is
+    dropped if its IoU with a selected box is greater than iou_threshold.
+
+    Returns:
+        Array of indices of selected boxes.
+    """
+    scores = np.asarray(scores, dtype=np.float32).reshape(-1)
+    candidates = np.flatnonzero(scores > score_threshold)
+    order = candidates[np.argsort(-scores[candidates], kind='stable')]
+    selected = []
+    while order.size and len(selected) < max_output_size:
+        i = order[0]
+        selected.append(i)
+        order = order[1:]
+        if order.size:
+            order = order[box_iou(boxes[i], boxes[order]) <= iou_threshold]
+    return np.asarray(selected, dtype=np.intp)
+
+
+def combined_non_max_suppression(boxes, scores, max_output_size_per_class,
+                                 max_total_size, iou_threshold=0.5,
+                                 score_threshold=float('-inf'),
+                                 clip_boxes=True):
+    """Class-aware non-max suppression, a NumPy implementation of
+    tf.image.combined_non_max_suppression (pad_per_class=False).
+
+    Args:
+        boxes: Array of boxes, shape (batch, N, q, 4), q is 1 (boxes
+               shared by all the classes) or the number of classes.
+        scores: Array of class scores, shape (batch, N, classes).
+
+    Returns:
+        Tuple of boxes (batch, max_total_size, 4), scores and classes
+        (batch, max_total_size), and the numbers of valid detections
+        (batch,). Invalid detections are zero padded.
+    """
+    boxes = np.asarray(boxes, dtype=np.float32)
+    scores = np.asarray(scores, dtype=np.float32)
+    batch, num_boxes, num_classes = scores.shape
+    boxes = boxes.reshape(batch, num_boxes, -1, 4)
+    nmsed_boxes = np.zeros((batch, max_total_size, 4), dtype=np.float32)
+    nmsed_scores = np.zeros((batch, max_total_size), dtype=np.float32)
+    nmsed_classes = np.zeros((batch, max_total_size), dtype=np.float32)
+    valid_detections = np.zeros(batch, dtype=np.int32)
+
+    for b in range(batch):
+        results = []  # (score, class, box index)
+        for c in range(num_classes):
+            class_boxes = boxes[b, :, c if boxes.shape[2] > 1 else 0]
+            selected = non_max_suppression(class_boxes,
+                                           scores[b, :, c],
+                                           max_output_size_per_class,
+                                           iou_threshold,
+                                           score_threshold)
+            results.extend((scores[b, i, c], c, i) for i in selected)
+        results.sort(key=lambda r: (-r[0], r[1], r[2]))
+        results = results[:max_total_size]
+        for k, (score, c, i) in enumerate(results):
+            nmsed_boxes[b, k] = boxes[b, i, c if boxes.shape[2] > 1 else 0]
+            nmsed_scores[b, k] = score
+            nmsed_classes[b, k] = c
+        valid_detections[b] = len(results)
+
+    if clip_boxes:
+        nmsed_boxes = np.clip(nmsed_boxes, 0.0, 1.0)
+    return nmsed_boxes, nmsed_scores, nmsed_classes, valid_detections
@@ -0,0 +1,109 @@
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""In-place pre-processing shared by inference engines.
+
+A frame is resized into a preallocated buffer, then converted and
+normalized straight into its slot of the network input (e.g. a view of
+TFLite input tensor or OpenVINO input blob), so no full-frame temporary
+is allocated per frame.
+"""
+
+import cv2
+import numpy as np
+
+
+def resize_buffer(shape):
+    """Allocate a buffer for resizing frames to a (height, width, channels)
+    network input."""
+    return np.empty(shape, dtype=np.uint8)
+
+
+def resize(frame, size, buf):
+    """Resize frame to size (width, height) into buf.
+
+    Returns:
+        buf, or frame itself if it is in size already.
+    """
+    if frame.shape[1] == size[0] and frame.shape[0] == size[1]:
+        return frame
+    return cv2.resize(frame, size, dst=buf)
+
+
+def normalize(src, dst, mean=None, std=None):
+    """Write (src - mean) / std into dst in place, computing in float32.
+
+    Subtraction or division is skipped if mean or std is None. Dividing
+    by std gives the same result as float64 division, unlike multiplying
+    by its reciprocal.
+    """
+    if mean:
+        np.subtract(src, np.float32(mean), out=dst, casting='unsafe')
+        src = dst
+    if std is not None:
+        np.divide(src, np.float32(std), out=dst, casting='unsafe')
+    elif src is not dst:
+        np.copyto(dst, src, casting='unsafe')
+    return dst
+
+
+def write_nhwc(frame, dst, buf, swap_rb=True, mean=None, std=None):
+    """Write a BGR frame into a (height, width, channels) input slot.
+
+    Args:
+        frame: BGR image (OpenCV convention).
+        dst: uint8 or float32 slot of network input, it is written in
+             place.
+        buf: Resize buffer of the same shape as dst.
+        swap_rb: Convert BGR to RGB.
+        mean, std: Float input is normalized as (x - mean) / std, see
+                   normalize().
+    """
+    frame = resize(frame, (dst.shape[1], dst.shape[0]), buf)
+    if dst.dtype == np.uint8:
+        if swap_rb:
+            cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=dst)
+        else:
+            np.copyto(dst, frame)
+        return dst
+    if swap_rb:
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB, dst=buf)
+    return normalize(frame, dst, mean, std)
+
+
+def write_nchw(frame, dst, buf=None, swap_rb=False, mean=None, std=None):
+    """Write a BGR frame into a (channels, height, width) input slot.
+
+    Layout change, channel swap and normalization are done in one pass.
+
+    Args:
+        frame: BGR image (OpenCV convention).
+        dst: Slot of network input, it is written in place.
+        buf: Resize buffer of shape (height, width, channels). It is not
+             needed if frame is in network input size.
+        swap_rb: Convert BGR to RGB.
+        mean, std: Float input is normalized as (x - mean) / std, see
+                   normalize().
+    """
+    frame = resize(frame, (dst.shape[2], dst.shape[1]), buf)
+    chw = frame.transpose((2, 0, 1))
+    if swap_rb:
+        chw = chw[::-1]
+    if dst.dtype == np.uint8:
+        np.copyto(dst, chw)
+        return dst
+    return normalize(chw, dst, mean, std)
@@ -30,52 +30,121 @@ import tensorflow as tf
 from berrynet import logger
 #from berrynet.dlmodelmgr import DLModelManager
 from berrynet.engine import DLEngine
+from berrynet.engine import postprocess
 
 
 class TensorFlowEngine(DLEngine):
+    """TensorFlow classifier engine.
+
+    By default, preprocessing (resizing and normalization) and inference
+    are two session runs, and the normalized float tensor goes through
+    NumPy between them. In fused mode, the preprocessing subgraph is
+    wired into the model input by input_map, so one session run goes
+    from uint8 RGB frames of shape (batch, height, width, 3) to
+    predictions.
+    """
     # FIXME: Get model information by model manager
-    def __init__(self, model, label, input_layer, output_layer, top_k=3):
+    def __init__(self, model, label, input_layer, output_layer, top_k=3,
+                 fused=False):
         super(TensorFlowEngine, self).__init__()
 
+        # Load other configs
+        self.input_layer = input_layer
+        self.output_layer = output_layer
+        self.top_k = top_k
+        self.fused = fused
+
         # Load model
         with tf.gfile.FastGFile(model, 'rb') as f:
             graph_def = tf.GraphDef()
             graph_def.ParseFromString(f.read())
-            _ = tf.import_graph_def(graph_def, name='')
+        self.input_height, self.input_width = get_input_size(graph_def,
+                                                             input_layer)
+        logger.debug('Model input size: {}x{}'.format(self.input_width,
+                                                      self.input_height))
+
+        # Each engine has its own graph, so that engines of the same
+        # model do not collide.
+        self.graph = tf.Graph()
+        with self.graph.as_default():
+            if fused:
+                self.frames_op = tf.placeholder(
+                    tf.uint8, shape=[None, None, None, 3], name='inframes')
+                normalized = self.normalize(self.frames_op,
+                                            self.input_height,
+                                            self.input_width,
+                                            input_mean=0,
+                                            input_std=255)
+                tf.import_graph_def(graph_def,
+                                    input_map={input_layer: normalized},
+                                    name='')
+            else:
+                tf.import_graph_def(graph_def, name='')
+                # NOTE: Do NOT call read_tensor_from_nparray twice to
+                #       prevent from recreating unexpected placeholders.
+                self.tensor_op = self.read_tensor_from_nparray(
+                    input_height=self.input_height,
+                    input_width=self.input_width,
+                    input_mean=0,
+                    input_std=255)
 
         # Load labels
         self.labels = [line.rstrip() for line in tf.gfile.FastGFile(label)]
 
-        # Load other configs
-        self.input_layer = input_layer
-        self.output_layer = output_layer
-        self.top_k = top_k
-
-        # NOTE: Do NOT call read_tensor_from_nparray twice to prevent from
-        #       recreating unexpected placeholders.
-        self.tensor_op = self.read_tensor_from_nparray(
-            input_height=299,
-            input_width=299,
-            input_mean=0,
-            input_std=255)
-
     def create(self):
         # Create session
-        self.sess = tf.Session()
+        self.sess = tf.Session(graph=self.graph)
 
     def process_input(self, rgb_array):
+        if self.fused:
+            # Frames are resized and normalized in the inference run.
+            return rgb_array[np.newaxis]
         return self.sess.run(self.tensor_op,
                              feed_dict={'inarray:0': rgb_array})
 
+    def process_input_batch(self, rgb_arrays, image_sizes=None):
+        if self.fused:
+            # Frames of the same size are stacked into one run, e.g.
+            # frames of one camera.
+            if len(set(a.shape for a in rgb_arrays)) == 1:
+                return np.stack(rgb_arrays)
+            return [self.process_input(a) for a in rgb_arrays]
+        # tensor_op resizes one image at a time, images in a batch may
+        # have different sizes.
+        return np.concatenate([self.process_input(rgb_array)
+                               for rgb_array in rgb_arrays])
+
     def inference(self, tensor):
-        return self.sess.run(self.output_layer,
-                             {self.input_layer: tensor})
+        if self.fused:
+            feed_dict = {self.frames_op: tensor}
+        else:
+            feed_dict = {self.input_layer: tensor}
+        return self.sess.run(self.output_layer, feed_dict)
+
+    def inference_batch(self, batch):
+        if isinstance(batch, list):
+            return np.concatenate([self.inference(tensor)
+                                   for tensor in batch])
+        try:
+            return self.inference(batch)
+        except tf.errors.InvalidArgumentError as e:
+            # Graph is frozen with a fixed batch dimension.
+            logger.warning('Batch inference failed, fall back to '
+                           'per-frame inference: {}'.format(e))
+            return np.concatenate([self.inference(tensor[np.newaxis])
+                                   for tensor in batch])
 
     def process_output(self, output):
-        processed_output = {'annotations': []}
+        return {'annotations': self._annotate(np.squeeze(output))}
+
+    def process_output_batch(self, output):
+        return [{'annotations': self._annotate(predictions)}
+                for predictions in output]
+
+    def _annotate(self, predictions):
+        annotations = []
         decimal_digits = 2
-        predictions = np.squeeze(output)
-        top_k_index = predictions.argsort()[-self.top_k:][::-1]
+        top_k_index = postprocess.top_k_indices(predictions, self.top_k)
 
         for node_id in top_k_index:
             human_string = self.labels[node_id]
@@ -85,9 +154,9 @@ class TensorFlowEngine(DLEngine):
                 'label': human_string,
                 'confidence': score
             }
-            processed_output['annotations'].append(anno)
+            annotations.append(anno)
             logger.debug('%s (score = %.5f)' % (human_string, score))
-        return processed_output
+        return annotations
 
     def save_cache(self):
         pass
@@ -97,9 +166,37 @@ class TensorFlowEngine(DLEngine):
                                  input_mean=0, input_std=255):
         """ Create normalized tensor based on input numpy array """
         image_reader = tf.placeholder(tf.uint8, name='inarray')
-        float_caster = tf.cast(image_reader, tf.float32)
-        dims_expander = tf.expand_dims(float_caster, 0)
-        resized = tf.image.resize_bilinear(dims_expander,
+        dims_expander = tf.expand_dims(image_reader, 0)
+        return self.normalize(dims_expander, input_height, input_width,
+                              input_mean, input_std)
+
+    def normalize(self, images, input_height, input_width, input_mean=0,
+                  input_std=255):
+        """Create resized and normalized float tensor of uint8 images of
+        shape (batch, height, width, channels)"""
+        float_caster = tf.cast(images, tf.float32)
+        resized = tf.image.resize_bilinear(float_caster,
                                            [input_height, input_width])
         normalized = tf.divide(tf.subtract(resized, [input_mean]), [input_std])
         return normalized
+
+
+def get_input_size(graph_def, input_layer, default=(299, 299)):
+    """Get (height, width) of model input from its placeholder.
+
+    Args:
+        graph_def: GraphDef of model.
+        input_layer: Name of input tensor, e.g. input:0.
+        default: Size used if the placeholder does not define it.
+    """
+    node_name = input_layer.split(':')[0]
+    for node in graph_def.node:
+        if node.name != node_name or 'shape' not in node.attr:
+            continue
+        dims = [d.size for d in node.attr['shape'].shape.dim]
+        # NHWC, unknown dimensions are -1
+        if len(dims) == 4 and dims[1] > 0 and dims[2] > 0:
+            return dims[1], dims[2]
+    logger.warning('Input size of {} is unknown, use {}'.format(
+        input_layer, default))
+    return default
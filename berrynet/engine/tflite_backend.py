@@ -0,0 +1,75 @@
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""TFLite interpreter backend selection.
+
+tflite_runtime is much lighter than TensorFlow to import, so it is
+preferred, and tensorflow.lite is the fallback. The backend is imported
+lazily when the first interpreter is created, so importing engine or
+service modules does not import TensorFlow.
+"""
+
+import importlib
+
+from berrynet import logger
+
+
+# Backend name, module name and attribute path of Interpreter in
+# preference order. Interpreter of TensorFlow is resolved by attribute,
+# because tensorflow.lite is not an importable module in every version,
+# and it is tf.contrib.lite in TensorFlow < 1.14.
+BACKENDS = (
+    ('tflite_runtime', 'tflite_runtime.interpreter', 'Interpreter'),
+    ('tensorflow', 'tensorflow', 'lite.Interpreter'),
+    ('tensorflow', 'tensorflow', 'contrib.lite.Interpreter'),
+)
+
+_backend = None
+
+
+def get_backend():
+    """Import the preferred available backend.
+
+    Returns:
+        Tuple of backend name and Interpreter class.
+    """
+    global _backend
+    if _backend is not None:
+        return _backend
+    for name, module_name, attr_path in BACKENDS:
+        try:
+            interpreter_class = importlib.import_module(module_name)
+            for attr in attr_path.split('.'):
+                interpreter_class = getattr(interpreter_class, attr)
+        except (ImportError, AttributeError):
+            continue
+        _backend = (name, interpreter_class)
+        logger.info('TFLite backend: {}'.format(name))
+        return _backend
+    raise ImportError('No TFLite backend found, install tflite_runtime '
+                      'or tensorflow')
+
+
+def create_interpreter(**kwargs):
+    """Create an interpreter of the selected backend.
+
+    Args:
+        kwargs: Arguments of Interpreter, e.g. model_path, model_content
+                and num_threads.
+    """
+    interpreter_class = get_backend()[1]
+    return interpreter_class(**kwargs)
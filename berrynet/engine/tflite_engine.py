@@ -1,4 +1,5 @@
 import logging
+import queue
 import time
 
 from argparse import ArgumentParser
@@ -6,28 +7,166 @@ from os import path
 
 import cv2
 import numpy as np
-import tensorflow as tf
 
 from berrynet.engine import DLEngine
+from berrynet.engine import original_sizes
+from berrynet.engine import postprocess
+from berrynet.engine import preprocess
+from berrynet.engine import tflite_backend
 from berrynet import logger
 
 
-class TFLiteDetectorEngine(DLEngine):
-    def __init__(self, model, labels, threshold=0.5, num_threads=1):
+class TFLiteEngine(DLEngine):
+    """Common interpreter management of TFLite engines.
+
+    An engine owns a pool of interpreters. Per-frame state (e.g. image
+    size) travels with the tensors instead of living on the engine, so
+    an engine with K interpreters can be called by K threads at the same
+    time, and interpreters release GIL while invoking. All the
+    interpreters are built from one model buffer, so model weights are
+    loaded once.
+
+    Batch dimension of model input is resized by resize_tensor_input
+    when batch size changes. Some models (e.g. with custom ops) can not
+    be resized, then frames of a batch are invoked one by one.
+
+    Frames are resized into a preallocated buffer of the interpreter and
+    written into the input tensor through its tensor() view, instead of
+    building a batch array and copying it by set_tensor.
+    """
+    def _init_interpreters(self, model, num_threads=1, num_interpreters=1):
+        t = time.time()
+        self.backend = tflite_backend.get_backend()[0]
+        if num_interpreters > 1:
+            with open(model, 'rb') as f:
+                self.model_content = f.read()
+            interpreters = [
+                tflite_backend.create_interpreter(
+                    model_content=self.model_content,
+                    num_threads=num_threads)
+                for i in range(num_interpreters)]
+        else:
+            interpreters = [tflite_backend.create_interpreter(
+                model_path=model,
+                num_threads=num_threads)]
+        self.interpreter = interpreters[0]
+        self.input_details = self.interpreter.get_input_details()
+        self.output_details = self.interpreter.get_output_details()
+        self.input_shape = tuple(self.input_details[0]['shape'][1:])
+        self.input_size = (self.input_shape[1], self.input_shape[0])
+        # Idle interpreters and their resize buffers
+        self.interpreters = queue.Queue()
+        for interpreter in interpreters:
+            interpreter.allocate_tensors()
+            self.interpreters.put(
+                (interpreter, preprocess.resize_buffer(self.input_shape)))
+        self.concurrency = num_interpreters
+        # Flatbuffer is used by interpreters as is, there is no compiled
+        # model to cache.
+        logger.info('Model loaded in {:.3f} s ({})'.format(
+            time.time() - t, self.backend))
+        self.batch_invoke = True
+
+    def _set_batch_size(self, interpreter, batch_size):
+        details = interpreter.get_input_details()[0]
+        if details['shape'][0] == batch_size:
+            return
+        shape = list(details['shape'])
+        shape[0] = batch_size
+        interpreter.resize_tensor_input(details['index'], shape)
+        interpreter.allocate_tensors()
+
+    def _invoke(self, frames):
+        """Invoke model on a batch of frames with an idle interpreter.
+
+        Returns:
+            Dict of output name and output tensor with batch dimension.
+        """
+        interpreter, buf = self.interpreters.get()
+        try:
+            self._set_batch_size(interpreter, len(frames))
+            input_index = self.input_details[0]['index']
+            input_tensor = interpreter.tensor(input_index)()
+            for i, frame in enumerate(frames):
+                self._write_input(frame, input_tensor[i], buf)
+            # Interpreter refuses to invoke while its buffers are referred.
+            del input_tensor
+            interpreter.invoke()
+            return self._get_output(interpreter)
+        finally:
+            self.interpreters.put((interpreter, buf))
+
+    def _write_input(self, frame, dst, buf):
+        """Resize and normalize a frame into its slot of input tensor"""
+        raise NotImplementedError
+
+    def _get_output(self, interpreter):
+        """Get output tensors (copied) from interpreter.
+
+        Returns:
+            Dict of output name and output tensor with batch dimension.
+        """
+        raise NotImplementedError
+
+    def process_input(self, tensor, image_size=None):
+        return self.process_input_batch([tensor], [image_size])
+
+    def process_input_batch(self, tensors, image_sizes=None):
+        """Collect frames of a batch. Frames are resized and normalized
+        into input tensor by inference, when an interpreter is acquired.
+        """
+        return {
+            'frames': list(tensors),
+            'sizes': original_sizes(tensors, image_sizes)
+        }
+
+    def inference(self, tensor):
+        return self.inference_batch(tensor)
+
+    def inference_batch(self, batch):
+        frames = batch['frames']
+        output = None
+        if self.batch_invoke and len(frames) > 1:
+            try:
+                output = self._invoke(frames)
+            except (RuntimeError, ValueError) as e:
+                logger.warning('Model does not support batch inference, '
+                               'invoke frames one by one: {}'.format(e))
+                self.batch_invoke = False
+        if output is None:
+            outputs = [self._invoke(frames[i:i + 1])
+                       for i in range(len(frames))]
+            output = {k: np.concatenate([o[k] for o in outputs])
+                      for k in outputs[0]}
+        output['sizes'] = batch['sizes']
+        return output
+
+    def process_output(self, output):
+        return self.process_output_batch(output)[0]
+
+    def _load_label(self, path):
+        with open(path, 'r') as f:
+            labels = list(map(str.strip, f.readlines()))
+        return labels
+
+
+class TFLiteDetectorEngine(TFLiteEngine):
+    def __init__(self, model, labels, threshold=0.5, num_threads=1,
+                 num_interpreters=1):
         """
         Builds Tensorflow graph, load model and labels
+
+        Args:
+            num_interpreters: Number of interpreters, which is the max
+                              number of concurrent inferences.
         """
+        super(TFLiteDetectorEngine, self).__init__()
         # Load labels
         self.labels = self._load_label(labels)
         self.classes = len(self.labels)
 
         # Define lite graph and Load Tensorflow Lite model into memory
-        self.interpreter = tf.lite.Interpreter(
-            model_path=model,
-            num_threads=num_threads)
-        self.interpreter.allocate_tensors()
-        self.input_details = self.interpreter.get_input_details()
-        self.output_details = self.interpreter.get_output_details()
+        self._init_interpreters(model, num_threads, num_interpreters)
         self.input_dtype = self.input_details[0]['dtype']
         self.threshold = threshold
 
@@ -36,35 +175,20 @@ class TFLiteDetectorEngine(DLEngine):
         #self.sess = tf.InteractiveSession()
         del self.interpreter
 
-    def process_input(self, tensor):
-        """Resize and normalize image for network input"""
-
-        self.img_w = tensor.shape[1]
-        self.img_h = tensor.shape[0]
-
-        frame = cv2.cvtColor(tensor, cv2.COLOR_BGR2RGB)
-        frame = cv2.resize(frame, (300, 300))
-        frame = np.expand_dims(frame, axis=0)
-        if self.input_dtype == np.float32:
-            frame = (2.0 / 255.0) * frame - 1.0
-            frame = frame.astype('float32')
-        else:
-            # default data type returned by cv2.imread is np.unit8
-            pass
-        return frame
-
-    def inference(self, tensor):
-        self.interpreter.set_tensor(self.input_details[0]['index'], tensor)
-        self.interpreter.invoke()
+    def _write_input(self, frame, dst, buf):
+        # Float input is normalized to [-1, 1], and uint8 input is the
+        # same as cv2.imread.
+        preprocess.write_nhwc(frame, dst, buf, mean=127.5, std=127.5)
 
+    def _get_output(self, interpreter):
         # get results
-        boxes = self.interpreter.get_tensor(
+        boxes = interpreter.get_tensor(
             self.output_details[0]['index'])
-        classes = self.interpreter.get_tensor(
+        classes = interpreter.get_tensor(
             self.output_details[1]['index'])
-        scores = self.interpreter.get_tensor(
+        scores = interpreter.get_tensor(
             self.output_details[2]['index'])
-        num = self.interpreter.get_tensor(
+        num = interpreter.get_tensor(
             self.output_details[3]['index'])
         return {
             'boxes': boxes,
@@ -73,54 +197,40 @@ class TFLiteDetectorEngine(DLEngine):
             'num': num
         }
 
-    def process_output(self, output):
-        # get results
-        boxes = np.squeeze(output['boxes'][0])
-        classes = np.squeeze(output['classes'][0] + 1).astype(np.int32)
-        scores = np.squeeze(output['scores'][0])
-        num = output['num'][0]
-
-        annotations = []
-        number_boxes = boxes.shape[0]
-        for i in range(number_boxes):
-            box = tuple(boxes[i].tolist())
-            ymin, xmin, ymax, xmax = box
-
-            if scores[i] < self.threshold:
-                continue
-            annotations.append({
-                'label': self.labels[classes[i]],
-                'confidence': float(scores[i]),
-                'left': int(xmin * self.img_w),
-                'top': int(ymin * self.img_h),
-                'right': int(xmax * self.img_w),
-                'bottom': int(ymax * self.img_h)
-            })
-        return {'annotations': annotations}
+    def process_output_batch(self, output):
+        return [self._annotate(output, i, img_w, img_h)
+                for i, (img_w, img_h) in enumerate(output['sizes'])]
 
-    def _load_label(self, path):
-        with open(path, 'r') as f:
-            labels = list(map(str.strip, f.readlines()))
-        return labels
+    def _annotate(self, output, i, img_w, img_h):
+        # get results of the i-th frame
+        return {
+            'annotations': postprocess.annotate_detections(
+                output['boxes'][i],
+                output['scores'][i],
+                output['classes'][i] + 1,
+                self.labels,
+                img_size=(img_w, img_h),
+                threshold=self.threshold)
+        }
 
 
-class TFLiteClassifierEngine(DLEngine):
+class TFLiteClassifierEngine(TFLiteEngine):
     def __init__(self, model, labels, top_k=3, num_threads=1,
-                 input_mean=127.5, input_std=127.5):
+                 input_mean=127.5, input_std=127.5, num_interpreters=1):
         """
         Builds Tensorflow graph, load model and labels
+
+        Args:
+            num_interpreters: Number of interpreters, which is the max
+                              number of concurrent inferences.
         """
+        super(TFLiteClassifierEngine, self).__init__()
         # Load labels
         self.labels = self._load_label(labels)
         self.classes = len(self.labels)
 
         # Define lite graph and Load Tensorflow Lite model into memory
-        self.interpreter = tf.lite.Interpreter(
-            model_path=model,
-            num_threads=num_threads)
-        self.interpreter.allocate_tensors()
-        self.input_details = self.interpreter.get_input_details()
-        self.output_details = self.interpreter.get_output_details()
+        self._init_interpreters(model, num_threads, num_interpreters)
         self.floating_model = False
         if self.input_details[0]['dtype'] == np.float32:
             self.floating_model = True
@@ -133,33 +243,23 @@ class TFLiteClassifierEngine(DLEngine):
         #self.sess = tf.InteractiveSession()
         del self.interpreter
 
-    def process_input(self, tensor):
-        """Resize and normalize image for network input"""
-
-        self.img_w = tensor.shape[1]
-        self.img_h = tensor.shape[0]
+    def _write_input(self, frame, dst, buf):
+        preprocess.write_nhwc(frame, dst, buf, mean=self.input_mean,
+                              std=self.input_std)
 
-        frame = cv2.cvtColor(tensor, cv2.COLOR_BGR2RGB)
-        frame = cv2.resize(frame, (self.input_details[0]['shape'][2],
-                                   self.input_details[0]['shape'][1]))
-        frame = np.expand_dims(frame, axis=0)
-        if self.floating_model:
-            frame = (np.float32(frame) - self.input_mean) / self.input_std
-        return frame
-
-    def inference(self, tensor):
-        self.interpreter.set_tensor(self.input_details[0]['index'], tensor)
-        self.interpreter.invoke()
-        output_data = self.interpreter.get_tensor(self.output_details[0]['index'])
-        results = np.squeeze(output_data)
+    def _get_output(self, interpreter):
+        output_data = interpreter.get_tensor(self.output_details[0]['index'])
         return {
-            'scores': results,
+            'scores': output_data
         }
 
-    def process_output(self, output):
+    def process_output_batch(self, output):
+        return [self._annotate(np.squeeze(scores))
+                for scores in output['scores']]
+
+    def _annotate(self, scores):
         # get results
-        scores = output['scores']
-        top_k_results = scores.argsort()[-self.top_k:][::-1]
+        top_k_results = postprocess.top_k_indices(scores, self.top_k)
 
         processed_output = {'annotations': []}
 
@@ -178,11 +278,6 @@ class TFLiteClassifierEngine(DLEngine):
 
         return processed_output
 
-    def _load_label(self, path):
-        with open(path, 'r') as f:
-            labels = list(map(str.strip, f.readlines()))
-        return labels
-
 
 def parse_argsr():
     parser = ArgumentParser()
@@ -5,10 +5,11 @@ from argparse import ArgumentParser
 from os import path
 
 import cv2
-import numpy as np
-import tensorflow as tf
 
 from berrynet.engine import DLEngine
+from berrynet.engine import postprocess
+from berrynet.engine import preprocess
+from berrynet.engine import tflite_backend
 from berrynet import logger
 
 
@@ -22,12 +23,16 @@ class TFLiteYoloV4DetectorEngine(DLEngine):
         self.classes = len(self.labels)
 
         # Define lite graph and Load Tensorflow Lite model into memory
-        self.interpreter = tf.lite.Interpreter(
+        self.backend = tflite_backend.get_backend()[0]
+        self.interpreter = tflite_backend.create_interpreter(
             model_path=model)
         self.interpreter.allocate_tensors()
         self.input_details = self.interpreter.get_input_details()
         self.output_details = self.interpreter.get_output_details()
         self.input_dtype = self.input_details[0]['dtype']
+        input_shape = tuple(self.input_details[0]['shape'][1:])
+        self.input_size = (input_shape[1], input_shape[0])
+        self.input_buffer = preprocess.resize_buffer(input_shape)
         self.num_threads = num_threads
         self.threshold = threshold
 
@@ -36,71 +41,53 @@ class TFLiteYoloV4DetectorEngine(DLEngine):
         #self.sess = tf.InteractiveSession()
         del self.interpreter
 
-    def process_input(self, tensor):
-        """Resize and normalize image for network input"""
-
-        self.img_w = tensor.shape[1]
-        self.img_h = tensor.shape[0]
-
-        frame = cv2.cvtColor(tensor, cv2.COLOR_BGR2RGB)
-        frame = cv2.resize(frame, (416, 416))
-        frame = np.expand_dims(frame, axis=0)
-        if self.input_dtype == np.float32:
-            frame = (1.0 / 255.0) * frame
-            frame = frame.astype('float32')
-        else:
-            # default data type returned by cv2.imread is np.unit8
-            pass
-        return frame
-
-    def filter_boxes(self, box_xywh, scores, score_threshold=0.4, input_shape = tf.constant([416,416])):
-        scores_max = tf.math.reduce_max(scores, axis=-1)
-
-        mask = scores_max >= score_threshold
-        class_boxes = tf.boolean_mask(box_xywh, mask)
-        pred_conf = tf.boolean_mask(scores, mask)
-        class_boxes = tf.reshape(class_boxes, [tf.shape(scores)[0], -1, tf.shape(class_boxes)[-1]])
-        pred_conf = tf.reshape(pred_conf, [tf.shape(scores)[0], -1, tf.shape(pred_conf)[-1]])
-
-        box_xy, box_wh = tf.split(class_boxes, (2, 2), axis=-1)
-
-        input_shape = tf.cast(input_shape, dtype=tf.float32)
-
-        box_yx = box_xy[..., ::-1]
-        box_hw = box_wh[..., ::-1]
-
-        box_mins = (box_yx - (box_hw / 2.)) / input_shape
-        box_maxes = (box_yx + (box_hw / 2.)) / input_shape
-        boxes = tf.concat([
-            box_mins[..., 0:1],  # y_min
-            box_mins[..., 1:2],  # x_min
-            box_maxes[..., 0:1],  # y_max
-            box_maxes[..., 1:2]  # x_max
-        ], axis=-1)
-        # return tf.concat([boxes, pred_conf], axis=-1)
-        return (boxes, pred_conf)
-    
+    def process_input(self, tensor, image_size=None):
+        """Keep image for network input. It is resized and normalized
+        into input tensor by inference.
+
+        Args:
+            image_size: (width, height) of original image if tensor is
+                        decoded at reduced scale.
+        """
+
+        if image_size is None:
+            image_size = (tensor.shape[1], tensor.shape[0])
+        self.img_w, self.img_h = image_size
+        return tensor
+
+    def filter_boxes(self, box_xywh, scores, score_threshold=0.4, input_shape=(416, 416)):
+        return postprocess.yolo_filter_boxes(box_xywh, scores,
+                                             score_threshold, input_shape)
+
     def inference(self, tensor):
         #self.interpreter.set_num_threads(int(self.num_threads));
-        self.interpreter.set_tensor(self.input_details[0]['index'], tensor)
+        # Write the frame through tensor() view instead of set_tensor,
+        # and release the view before invoking.
+        input_tensor = self.interpreter.tensor(
+            self.input_details[0]['index'])()
+        preprocess.write_nhwc(tensor, input_tensor[0], self.input_buffer,
+                              mean=0.0, std=255.0)
+        del input_tensor
         self.interpreter.invoke()
 
         # get results
         pred = [self.interpreter.get_tensor(self.output_details[i]['index']) for i in range(len(self.output_details))]
 
-        boxes, pred_conf = self.filter_boxes(pred[0], pred[1], score_threshold=0.25, input_shape=tf.constant([416, 416]))
-        
-        boxes, scores, classes, valid_detections = tf.image.combined_non_max_suppression(
-            boxes=tf.reshape(boxes, (tf.shape(boxes)[0], -1, 1, 4)),
-            scores=tf.reshape(
-                pred_conf, (tf.shape(pred_conf)[0], -1, tf.shape(pred_conf)[-1])),
+        # Boxes are in pixels of network input, whose size depends on
+        # model. input_shape of filter_boxes is (height, width).
+        boxes, pred_conf = self.filter_boxes(
+            pred[0], pred[1], score_threshold=0.25,
+            input_shape=self.input_size[::-1])
+
+        boxes, scores, classes, valid_detections = postprocess.combined_non_max_suppression(
+            boxes=boxes.reshape(boxes.shape[0], -1, 1, 4),
+            scores=pred_conf,
             max_output_size_per_class=50,
             max_total_size=50,
             iou_threshold=0.45,
             score_threshold=0.25
         )
 
-
         return {
             'boxes': boxes,
             'classes': classes,
@@ -110,28 +97,15 @@ class TFLiteYoloV4DetectorEngine(DLEngine):
 
     def process_output(self, output):
         # get results
-        boxes = np.squeeze(output['boxes'][0])
-        classes = np.squeeze(output['classes'][0]).astype(np.int32)
-        scores = np.squeeze(output['scores'][0])
-        num = output['num'][0]
-
-        annotations = []
-        number_boxes = boxes.shape[0]
-        for i in range(number_boxes):
-            box = tuple(boxes[i].tolist())
-            ymin, xmin, ymax, xmax = box
-
-            if scores[i] < self.threshold:
-                continue
-            annotations.append({
-                'label': self.labels[classes[i]],
-                'confidence': float(scores[i]),
-                'left': int(xmin * self.img_w),
-                'top': int(ymin * self.img_h),
-                'right': int(xmax * self.img_w),
-                'bottom': int(ymax * self.img_h)
-            })
-        return {'annotations': annotations}
+        return {
+            'annotations': postprocess.annotate_detections(
+                output['boxes'][0],
+                output['scores'][0],
+                output['classes'][0],
+                self.labels,
+                img_size=(self.img_w, self.img_h),
+                threshold=self.threshold)
+        }
 
     def _load_label(self, path):
         with open(path, 'r') as f:
@@ -18,61 +18,726 @@
 """Engine service is a bridge between incoming data and inference engine.
 """
 
+import asyncio
+import json
 import os
+import threading
 import time
 
+from collections import OrderedDict
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 
+import numpy as np
+
 from berrynet import logger
+from berrynet.dlmodelmgr import DLModelManager
 from berrynet.comm import Communicator
 from berrynet.comm import payload
+from berrynet.comm.aio import AsyncCommunicator
+from berrynet.comm.framestore import FrameStore
+from berrynet.service.workerpool import EngineWorkerPool
+
+
+# Seconds between batch scheduler stats logs
+BATCH_STATS_INTERVAL = 10
+# (width, height) of warmup image for engines without input_size
+WARMUP_SIZE = (640, 480)
+
+
+def create_frame_store(comm_config):
+    """Create frame store if result-by-reference mode is enabled."""
+    if comm_config.get('frame_store') is None:
+        return None
+    return FrameStore(**comm_config['frame_store'])
+
+
+def serialize_result(generalized_result, frame_store=None):
+    if frame_store is not None:
+        generalized_result = payload.to_reference(generalized_result,
+                                                  frame_store)
+    return payload.serialize(generalized_result)
+
+
+def model_paths(spec):
+    """Get model and label paths of a model spec.
+
+    Args:
+        spec: {'model': path, 'label': path}, or {'model_package': name}
+              of a DLModelBox package.
+    """
+    if spec.get('model_package'):
+        meta = DLModelManager().get_model_meta(spec['model_package'])
+        return {'model': meta['model'], 'label': meta['label']}
+    return {'model': spec['model'], 'label': spec.get('label')}
+
+
+class BatchScheduler(object):
+    """Collect frames of all channels into batches for batched inference.
+
+    A batch is dispatched to the handler when it has `max_batch` frames,
+    or when its first frame has waited for `max_wait_ms`, whichever comes
+    first. The handler runs in the scheduler thread, and put() blocks
+    while the next batch is full, so that the mailbox of the caller drops
+    frames if inference is slower than cameras.
+    """
+    def __init__(self, handler, max_batch=4, max_wait_ms=20):
+        """
+        Args:
+            handler: Functor called with a list of queued items.
+            max_batch: Max number of frames in a batch.
+            max_wait_ms: Max time in milliseconds a frame waits for
+                         other frames to fill its batch.
+        """
+        self.handler = handler
+        self.max_batch = max(int(max_batch), 1)
+        self.max_wait = max_wait_ms / 1000.0
+        self.queue = deque()
+        self.cond = threading.Condition()
+        self.counters = {
+            'batches': 0,
+            'frames': 0,
+            'delay_ms': 0.0,      # total queueing delay of frames
+            'max_delay_ms': 0.0
+        }
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+
+    def put(self, item):
+        with self.cond:
+            while len(self.queue) >= self.max_batch:
+                self.cond.wait()
+            self.queue.append((time.time(), item))
+            self.cond.notify_all()
+
+    def get(self):
+        """Wait for the next batch.
+
+        Returns:
+            List of queued items.
+        """
+        with self.cond:
+            while not self.queue:
+                self.cond.wait()
+            deadline = self.queue[0][0] + self.max_wait
+            while len(self.queue) < self.max_batch:
+                timeout = deadline - time.time()
+                if timeout <= 0:
+                    break
+                self.cond.wait(timeout)
+            batch = [self.queue.popleft()
+                     for _ in range(min(len(self.queue), self.max_batch))]
+            self.cond.notify_all()
+
+            t = time.time()
+            delays = [(t - t_put) * 1000 for t_put, _ in batch]
+            self.counters['batches'] += 1
+            self.counters['frames'] += len(batch)
+            self.counters['delay_ms'] += sum(delays)
+            self.counters['max_delay_ms'] = max(
+                self.counters['max_delay_ms'], max(delays))
+        logger.debug('batch size: {}, queueing delay: {:.1f} ms'.format(
+            len(batch), max(delays)))
+        return [item for _, item in batch]
+
+    def stats(self):
+        """Get achieved batch size and queueing delay."""
+        with self.cond:
+            stats = dict(self.counters)
+            stats['queued'] = len(self.queue)
+        batches = max(stats['batches'], 1)
+        frames = max(stats['frames'], 1)
+        stats['avg_batch_size'] = stats['frames'] / batches
+        stats['avg_delay_ms'] = stats.pop('delay_ms') / frames
+        return stats
+
+    def _run(self):
+        t_stats = time.time()
+        while True:
+            batch = self.get()
+            try:
+                self.handler(batch)
+            except Exception as e:
+                logger.exception(e)
+
+            if time.time() - t_stats > BATCH_STATS_INTERVAL:
+                t_stats = time.time()
+                logger.info('Batch scheduler stats: {}'.format(self.stats()))
+
+
+class EngineSwapper(object):
+    """Replace engine of a running service without dropping frames.
+
+    A new engine is created, loaded and warmed up in a background thread
+    while the current engine keeps serving. Then it replaces the current
+    engine by a single assignment, so every frame is inferred by either
+    the old or the new engine from start to end (see EngineService.infer)
+    and frames being inferred by the old engine are not interrupted. The
+    current engine keeps serving if any step fails.
+    """
+    def __init__(self, service, engine_factory):
+        """
+        Args:
+            service: EngineService whose engine is replaced.
+            engine_factory: Functor creating an engine from a model spec,
+                            e.g. {'model': path, 'label': path}.
+        """
+        self.service = service
+        self.engine_factory = engine_factory
+        self.lock = threading.Lock()
+        self.thread = None
+        self.counters = {
+            'swaps': 0,
+            'failures': 0,
+            'rejected': 0     # requests while a swap is in progress
+        }
+        self.last_swap = None
+
+    def swap(self, spec):
+        """Start swapping engine to the model spec in background.
+
+        Returns:
+            False if another swap is in progress and the request is
+            rejected.
+        """
+        with self.lock:
+            if self.thread is not None:
+                self.counters['rejected'] += 1
+                logger.warning('Engine swap is in progress, reject model '
+                               '{}'.format(spec))
+                return False
+            self.thread = threading.Thread(target=self._run, args=(spec,),
+                                           daemon=True)
+            self.thread.start()
+        return True
+
+    def join(self, timeout=None):
+        """Wait for the swap in progress."""
+        thread = self.thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self):
+        with self.lock:
+            stats = dict(self.counters)
+            stats['swapping'] = self.thread is not None
+            stats['last_swap'] = self.last_swap
+        return stats
+
+    def _run(self, spec):
+        status = {'model': spec, 'status': 'failed'}
+        t_start = time.time()
+        try:
+            engine = self.engine_factory(spec)
+            engine.create()
+            t = time.time()
+            status['load_ms'] = (t - t_start) * 1000
+            self.service.warmup_engine(engine)
+            status['warmup_ms'] = (time.time() - t) * 1000
+
+            t = time.time()
+            self.service.engine = engine
+            status['swap_ms'] = (time.time() - t) * 1000
+            status['status'] = 'swapped'
+        except Exception as e:
+            # Roll back: the new engine is dropped and the current engine
+            # is untouched.
+            logger.exception('Failed to swap engine to {}'.format(spec))
+            status['error'] = str(e)
+        status['total_ms'] = (time.time() - t_start) * 1000
+        logger.info('Engine swap: {}'.format(status))
+
+        with self.lock:
+            if status['status'] == 'swapped':
+                self.counters['swaps'] += 1
+            else:
+                self.counters['failures'] += 1
+            self.last_swap = status
+            self.thread = None
+        try:
+            self.service.swap_hook(status)
+        except Exception as e:
+            logger.exception(e)
 
 
 class EngineService(object):
+    # Engines used by EngineService take RGB input, set False for engines
+    # taking BGR input, e.g. TFLite engines.
+    input_rgb = True
+    # JPEG is decoded at reduced scale not smaller than network input if
+    # engine has input_size. Services drawing results on the image
+    # disable it.
+    reduced_decode = True
+
     def __init__(self, service_name, engine, comm_config):
         self.service_name = service_name
         self.engine = engine
         self.comm_config = comm_config
         for topic, functor in self.comm_config['subscribe'].items():
             self.comm_config['subscribe'][topic] = eval(functor)
-        self.comm_config['subscribe']['berrynet/data/rgbimage'] = self.inference
-        self.comm = Communicator(self.comm_config, debug=True)
+        # Data topic can contain wildcards, e.g. berrynet/data/+/rgbimage,
+        # so that a service can serve multiple cameras (channels).
+        self.data_topic = self.comm_config.get('data_topic',
+                                               'berrynet/data/rgbimage')
+        self.comm_config['subscribe'][self.data_topic] = self.inference
+        # Frames are dispatched directly unless a mailbox is configured,
+        # e.g.
+        #     comm_config['mailbox'] = {
+        #         self.data_topic: {'policy': 'keep-latest'}
+        #     }
+        self.frame_store = create_frame_store(self.comm_config)
+        # Frames of all channels are inferred in batches if batching is
+        # enabled, e.g.
+        #     comm_config['batch'] = {'max_batch': 4, 'max_wait_ms': 20}
+        self.batch_scheduler = None
+        if self.comm_config.get('batch') is not None:
+            self.batch_scheduler = BatchScheduler(self.process_batch,
+                                                  **self.comm_config['batch'])
+        # Frames are decoded and inferred by forked worker processes if
+        # worker pool is enabled, e.g.
+        #     comm_config['workers'] = {'num_workers': 4,
+        #                               'dispatch': 'least-loaded'}
+        self.worker_pool = None
+        if self.comm_config.get('workers') is not None:
+            if self.batch_scheduler is not None:
+                raise Exception('Illegal config, batching and worker pool '
+                                'can not be enabled together')
+            self.worker_pool = EngineWorkerPool(self,
+                                                **self.comm_config['workers'])
+        # Engine is replaced by a new model without restarting service if
+        # model swap is enabled, e.g.
+        #     comm_config['model_swap'] = {
+        #         'engine_factory': functor creating engine of a spec,
+        #         'topic': 'berrynet/engine/tflitedetector/model',
+        #         'status_topic': 'berrynet/engine/tflitedetector/status'
+        #     }
+        # A message of topic is a JSON model spec passed to the factory.
+        self.swapper = None
+        self.status_topic = None
+        swap_config = self.comm_config.get('model_swap')
+        if swap_config is not None:
+            if (self.worker_pool is not None and
+                    self.worker_pool.backend == 'process'):
+                raise Exception('Illegal config, engine of process workers '
+                                'can not be swapped')
+            self.swapper = EngineSwapper(self, swap_config['engine_factory'])
+            self.status_topic = swap_config.get('status_topic')
+            if swap_config.get('topic') is not None:
+                self.comm_config['subscribe'][swap_config['topic']] = \
+                    self.load_model
+        self.comm = self.create_communicator(self.comm_config)
+
+    def create_communicator(self, comm_config):
+        return Communicator(comm_config, debug=True)
 
-    def inference(self, pl):
+    def inference(self, pl, topic=None, channel=None):
         duration = lambda t: (datetime.now() - t).microseconds / 1000
 
         t = datetime.now()
         logger.debug('payload size: {}'.format(len(pl)))
         logger.debug('payload type: {}'.format(type(pl)))
-        jpg_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes = payload.destringify_jpg(jpg_json['bytes'])
-        logger.debug('destringify_jpg: {} ms'.format(duration(t)))
+        frames = self.deserialize(pl, channel)
+        logger.debug('deserialize: {} ms'.format(duration(t)))
 
-        t = datetime.now()
-        rgb_array = payload.jpg2rgb(jpg_bytes)
-        logger.debug('jpg2rgb: {} ms'.format(duration(t)))
+        if self.worker_pool is not None:
+            for jpg_json in frames:
+                self.worker_pool.submit(jpg_json)
+            return
 
-        t = datetime.now()
-        image_data = self.engine.process_input(rgb_array)
-        output = self.engine.inference(image_data)
-        model_outputs = self.engine.process_output(output)
+        for jpg_json in frames:
+            t = datetime.now()
+            image = self.decode(jpg_json)
+            if image is None:
+                logger.warning('Referenced frame has expired, skip it')
+                continue
+            logger.debug('decode: {} ms'.format(duration(t)))
+
+            if self.batch_scheduler is not None:
+                self.batch_scheduler.put((jpg_json, image))
+                continue
+
+            t = datetime.now()
+            result = self.infer(jpg_json, image)
+            logger.debug('Inference takes {} ms'.format(duration(t)))
+            if result is None:
+                continue
+
+            #self.engine.cache_data('model_output', model_outputs)
+            #self.engine.cache_data('model_output_filepath', output_name)
+            #self.engine.save_cache()
+
+            self.result_hook(result)
+
+    def process_batch(self, frames):
+        """Infer a batch collected by batch scheduler and send results.
+
+        Args:
+            frames: List of tuples of payload object and image nparray.
+        """
+        t = time.time()
+        results = self.infer_batch(frames)
+        logger.debug('Batch inference of {} frames takes {} ms'.format(
+            len(frames), (time.time() - t) * 1000))
+        for result in results:
+            if result is not None:
+                self.result_hook(result)
+
+    def deserialize(self, pl, channel=None):
+        """Deserialize payload into frames.
+
+        Returns:
+            List of payload objects. Batch payload contains multiple
+            frames, and each of them gets its own result.
+        """
+        frames = payload.deserialize(pl)
+        if not isinstance(frames, list):
+            frames = [frames]
+        if channel is not None:
+            for jpg_json in frames:
+                jpg_json['channel'] = channel
+        return frames
+
+    def decode(self, jpg_json):
+        """Decode image of a frame.
+
+        JPEG is decoded in the color model of engine input in one step.
+        If it is decoded at reduced scale, the original image size is
+        recorded as image_size of the payload object.
+
+        Returns:
+            Image nparray in the color model of engine input, or None if
+            the referenced frame has expired.
+        """
+        if 'shm' in jpg_json:
+            image = payload.to_bgr(jpg_json)
+            if image is not None and self.input_rgb:
+                image = payload.bgr2rgb(image)
+            return image
+        min_size = None
+        if self.reduced_decode:
+            min_size = getattr(self.engine, 'input_size', None)
+        image, size = payload.decode_jpg(jpg_json['bytes'],
+                                         rgb=self.input_rgb,
+                                         min_size=min_size)
+        if image is not None and size != (image.shape[1], image.shape[0]):
+            jpg_json['image_size'] = list(size)
+        return image
+
+    def original_size(self, jpg_json, engine=None):
+        """Get original image size recorded by decode, or None if image
+        is decoded at full scale or engine does not take image sizes."""
+        if engine is None:
+            engine = self.engine
+        if getattr(engine, 'input_size', None) is None:
+            return None
+        size = jpg_json.get('image_size')
+        return tuple(size) if size is not None else None
+
+    def infer(self, jpg_json, image):
+        """Run engine on an image and generalize the result.
+
+        Returns:
+            Generalized result, or None if the frame is dropped.
+        """
+        # The whole frame is inferred by the same engine even if engine
+        # is swapped meanwhile.
+        engine = self.engine
+        image_size = self.original_size(jpg_json, engine)
+        if image_size is None:
+            image_data = engine.process_input(image)
+        else:
+            image_data = engine.process_input(image, image_size=image_size)
+        output = engine.inference(image_data)
+        # Engines may infer the image itself without copying it.
+        jpg_json = self.attach_frame(jpg_json, image)
+        if jpg_json is None:
+            return None
+        model_outputs = engine.process_output(output)
         logger.debug('Result: {}'.format(model_outputs))
-        logger.debug('Classification takes {} ms'.format(duration(t)))
+        return self.draw_result(image,
+                                self.generalize_result(jpg_json,
+                                                       model_outputs),
+                                engine)
 
-        #self.engine.cache_data('model_output', model_outputs)
-        #self.engine.cache_data('model_output_filepath', output_name)
-        #self.engine.save_cache()
+    def infer_batch(self, frames):
+        """Run engine on a batch of images by one batched inference.
 
-        self.result_hook(self.generalize_result(jpg_json, model_outputs))
+        Args:
+            frames: List of tuples of payload object and image nparray.
+
+        Returns:
+            List of generalized results in the order of frames. Result
+            is None if the frame is dropped.
+        """
+        engine = self.engine
+        images = [image for _, image in frames]
+        sizes = [self.original_size(jpg_json, engine)
+                 for jpg_json, _ in frames]
+        if any(size is not None for size in sizes):
+            outputs = engine.infer_batch(images, sizes)
+        else:
+            outputs = engine.infer_batch(images)
+        results = []
+        for (jpg_json, image), model_outputs in zip(frames, outputs):
+            jpg_json = self.attach_frame(jpg_json, image)
+            if jpg_json is None:
+                results.append(None)
+                continue
+            results.append(self.draw_result(
+                image, self.generalize_result(jpg_json, model_outputs),
+                engine))
+        return results
+
+    def attach_frame(self, jpg_json, image):
+        """Attach JPEG of a frame ring frame after its image is inferred.
+
+        Image of a frame ring frame is a view of shared memory, which
+        producer may overwrite at any time. Result image is encoded from
+        the image being inferred instead of reading the ring again, and
+        the frame is dropped if the slot is overwritten meanwhile.
+
+        Returns:
+            Payload object, or None if the frame is dropped.
+        """
+        if 'shm' not in jpg_json:
+            return jpg_json
+        jpg_json = payload.attach_frame_jpg(jpg_json, frame=image,
+                                            rgb=self.input_rgb)
+        if jpg_json.get('bytes') is None:
+            return None
+        return jpg_json
 
     def generalize_result(self, eng_input, eng_output):
         eng_input.update(eng_output)
         return eng_input
 
+    def load_model(self, pl):
+        """Swap engine to the model spec in payload, see EngineSwapper."""
+        try:
+            spec = json.loads(pl)
+        except ValueError as e:
+            logger.warning('Illegal model spec {}: {}'.format(pl, e))
+            return
+        self.swapper.swap(spec)
+
+    def warmup_engine(self, engine):
+        """Run a new engine on a black image before it serves frames.
+
+        It raises if the engine fails, so that the engine is not swapped
+        in.
+        """
+        w, h = getattr(engine, 'input_size', None) or WARMUP_SIZE
+        image = np.zeros((h, w, 3), dtype=np.uint8)
+        engine.process_output(engine.inference(engine.process_input(image)))
+
+    def swap_hook(self, status):
+        """Report engine swap status, including time taken by each step.
+
+        Status is published to status topic if it is set.
+        """
+        if self.status_topic is not None:
+            self.comm.send(self.status_topic, json.dumps(status))
+
+    def draw_result(self, image, generalized_result, engine):
+        """Draw result on image.
+
+        Services drawing results on image override it. Labels are taken
+        from engine, the engine inferring the image, instead of
+        self.engine which may have been swapped meanwhile.
+        """
+        return generalized_result
+
+    def batch_stats(self):
+        """Get batch scheduler stats, or None if batching is disabled."""
+        if self.batch_scheduler is None:
+            return None
+        return self.batch_scheduler.stats()
+
+    def serialize_result(self, generalized_result):
+        """Serialize result, image is sent by reference if frame store
+        is enabled."""
+        return serialize_result(generalized_result, self.frame_store)
+
     def result_hook(self, generalized_result):
         logger.debug('base result_hook')
 
+    def channel_topic(self, topic, generalized_result):
+        """Get result topic of the channel of a frame.
+
+        Results of frames received from a channel, i.e. a data topic
+        with wildcards, are published to <topic>/<channel>.
+        """
+        channel = generalized_result.get('channel')
+        if channel is None:
+            return topic
+        return '{}/{}'.format(topic, channel)
+
+    def swap_stats(self):
+        """Get engine swap stats, or None if model swap is disabled."""
+        if self.swapper is None:
+            return None
+        return self.swapper.stats()
+
     def run(self, args):
         """Infinite loop serving inference requests"""
-        self.engine.create()
+        if self.worker_pool is not None:
+            # Engine is created by each worker after fork.
+            self.worker_pool.start()
+        else:
+            self.engine.create()
         self.comm.run()
+
+
+class AsyncEngineService(EngineService):
+    """Asyncio variant of EngineService.
+
+    Receiving, JPEG decoding, inference and result publishing of
+    different frames are overlapped. Decoding and serialization run in a
+    thread pool, inference runs in an executor with engine.concurrency
+    threads (a single thread for engines which are not thread-safe), and
+    MQTT I/O runs in the event loop.
+    """
+    def __init__(self, service_name, engine, comm_config,
+                 result_topic=None, max_inflight=None, decode_workers=2):
+        """
+        Args:
+            service_name: Human-readable service name.
+            engine: Inference engine, e.g. TFLiteDetectorEngine.
+            comm_config: Communicator config, the same as EngineService.
+            result_topic: Topic to publish results. Results are not
+                          published if it is None.
+            max_inflight: Max number of payloads being processed at the
+                          same time. Only the latest payload of each
+                          topic is kept waiting when it is reached.
+                          (engine concurrency + 1 by default)
+            decode_workers: Number of threads for decoding and
+                            serialization.
+        """
+        for key in ('batch', 'workers'):
+            if comm_config.pop(key, None) is not None:
+                logger.warning('{} config is not supported by '
+                               'AsyncEngineService, ignore it'.format(key))
+        # Only the latest waiting payload of each topic is kept (see
+        # inference()), which is the same as keep-latest mailbox.
+        mailboxes = comm_config.pop('mailbox', None) or {}
+        if any(config is not None and
+               config.get('policy', 'keep-latest') != 'keep-latest'
+               for config in mailboxes.values()):
+            logger.warning('Only keep-latest mailbox policy is supported '
+                           'by AsyncEngineService, ignore mailbox config')
+        super(AsyncEngineService, self).__init__(service_name,
+                                                 engine,
+                                                 comm_config)
+        self.result_topic = result_topic
+        # Engines are not thread-safe unless they support concurrency,
+        # e.g. TFLite engines with multiple interpreters.
+        concurrency = getattr(engine, 'concurrency', 1)
+        if max_inflight is None:
+            max_inflight = concurrency + 1
+        self.max_inflight = max_inflight
+        self.concurrency = concurrency
+        self.inflight = 0
+        self.pending = OrderedDict()
+        self.decode_executor = ThreadPoolExecutor(max_workers=decode_workers)
+        self.engine_executor = ThreadPoolExecutor(max_workers=concurrency)
+
+    def create_communicator(self, comm_config):
+        return AsyncCommunicator(comm_config)
+
+    def warmup_engine(self, engine):
+        # Engine executor is sized by concurrency of the first engine.
+        if getattr(engine, 'concurrency', 1) < self.concurrency:
+            raise Exception('Illegal engine, it supports {} concurrent '
+                            'inferences, but service runs {}'.format(
+                                getattr(engine, 'concurrency', 1),
+                                self.concurrency))
+        super(AsyncEngineService, self).warmup_engine(engine)
+
+    async def inference(self, pl, topic=None, channel=None):
+        if self.inflight >= self.max_inflight:
+            self.pending.pop(topic, None)
+            self.pending[topic] = (pl, channel)
+            return
+        self.inflight += 1
+        try:
+            while True:
+                try:
+                    await self.process(pl, channel)
+                except Exception:
+                    logger.exception('Failed to process payload')
+                if not self.pending:
+                    break
+                topic, (pl, channel) = self.pending.popitem(last=False)
+        finally:
+            self.inflight -= 1
+
+    async def process(self, pl, channel=None):
+        loop = self.comm.loop
+        t = time.time()
+        decoded = await loop.run_in_executor(
+            self.decode_executor, self.decode_frames, pl, channel)
+        logger.debug('decode: {} ms'.format((time.time() - t) * 1000))
+
+        for jpg_json, image in decoded:
+            if image is None:
+                logger.warning('Referenced frame has expired, skip it')
+                continue
+            t = time.time()
+            result = await loop.run_in_executor(
+                self.engine_executor, self.infer, jpg_json, image)
+            logger.debug('inference: {} ms'.format((time.time() - t) * 1000))
+            if result is not None:
+                await self.result_hook(result)
+
+    def decode_frames(self, pl, channel=None):
+        """Deserialize payload and decode images, run in decode executor.
+
+        Returns:
+            List of tuples of payload object and image nparray. Image is
+            None if the referenced frame has expired.
+        """
+        return [(jpg_json, self.decode(jpg_json))
+                for jpg_json in self.deserialize(pl, channel)]
+
+    async def result_hook(self, generalized_result):
+        if self.result_topic is None:
+            logger.debug('base result_hook')
+            return
+        await self.publish(self.channel_topic(self.result_topic,
+                                              generalized_result),
+                           generalized_result)
+
+    async def publish(self, topic, obj):
+        """Serialize obj in decode executor and publish it."""
+        pl = await self.comm.loop.run_in_executor(
+            self.decode_executor, serialize_result, obj, self.frame_store)
+        self.comm.send(topic, pl)
+
+    def swap_hook(self, status):
+        """Report engine swap status.
+
+        It is called in the swapper thread, and AsyncCommunicator is not
+        thread-safe, so status is sent in the event loop.
+        """
+        if self.status_topic is None:
+            return
+        if self.comm.loop is None:
+            logger.warning('Event loop is not running, drop swap status')
+            return
+        self.comm.loop.call_soon_threadsafe(self.comm.send,
+                                            self.status_topic,
+                                            json.dumps(status))
+
+    def run(self, args):
+        """Infinite loop serving inference requests"""
+        self.engine.create()
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        self.comm.loop = loop
+        try:
+            loop.run_until_complete(self.comm.run())
+        finally:
+            self.decode_executor.shutdown()
+            self.engine_executor.shutdown()
+            loop.close()
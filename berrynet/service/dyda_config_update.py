@@ -66,8 +66,14 @@ class DydaConfigUpdateService(object):
             configfile.write(payload.serialize_payload(payload_json))
             configfile.close()
 
-        # restart service
-        subprocess.run(["supervisorctl", "restart", "bnpipeline-bndyda"])
+        if self.comm_config['restart']:
+            # restart service
+            subprocess.run(["supervisorctl", "restart", "bnpipeline-bndyda"])
+        else:
+            # Pipeline service loads the new config in background and
+            # keeps serving meanwhile.
+            self.comm.send(self.comm_config['deploy'],
+                           self.comm_config['configfile'])
             
     def run(self, args):
         """Infinite loop serving inference requests"""
@@ -110,6 +116,16 @@ def parse_args():
         required=True,
         help='list of id and config file'
     )
+    ap.add_argument(
+        '--deploy',
+        default='berrynet/data/deploy',
+        help='topic to deploy config file to pipeline service'
+    )
+    ap.add_argument(
+        '--restart',
+        action='store_true',
+        help='Restart pipeline service instead of deploying config file'
+    )
     return vars(ap.parse_args())
 
 
@@ -130,7 +146,9 @@ def main():
             'port': args['broker_port']
         },
         'configfile': args['configfile'],
-        'idlist': args['idlist']
+        'idlist': args['idlist'],
+        'deploy': args['deploy'],
+        'restart': args['restart']
     }
     config_service = DydaConfigUpdateService(comm_config,
                                         args['debug'])
@@ -24,7 +24,6 @@ import logging
 import os
 
 from berrynet import logger
-from berrynet.comm import payload
 from berrynet.engine import DLEngine
 from berrynet.service import EngineService
 
@@ -54,10 +53,12 @@ class MockupService(EngineService):
 
     def result_hook(self, generalized_result):
         gr = generalized_result
-        jpg_bytes = payload.destringify_jpg(gr.pop('bytes'))
+        jpg_bytes = gr.pop('bytes', None)
         logger.debug('generalized result (readable only): {}'.format(gr))
-        with open('/tmp/mockup/{}.jpg'.format(gr['timestamp']), 'wb') as f:
-            f.write(jpg_bytes)
+        if jpg_bytes is not None:
+            with open('/tmp/mockup/{}.jpg'.format(gr['timestamp']),
+                      'wb') as f:
+                f.write(jpg_bytes)
         with open('/tmp/mockup/{}.json'.format(gr['timestamp']), 'w') as f:
             f.write(json.dumps(gr, indent=4))
 
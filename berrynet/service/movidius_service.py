@@ -21,10 +21,7 @@
 import argparse
 import logging
 
-from datetime import datetime
-
 from berrynet import logger
-from berrynet.comm import payload
 from berrynet.dlmodelmgr import DLModelManager
 from berrynet.engine.movidius_engine import MovidiusEngine
 from berrynet.engine.movidius_engine import MovidiusMobileNetSSDEngine
@@ -42,54 +39,33 @@ class MovidiusClassificationService(EngineService):
     def result_hook(self, generalized_result):
         logger.debug('result_hook, annotations: {}'.format(generalized_result['annotations']))
         self.comm.send('berrynet/engine/mvclassification/result',
-                       payload.serialize_payload(generalized_result))
+                       self.serialize_result(generalized_result))
 
 
 class MovidiusMobileNetSSDService(EngineService):
+    # Engine takes BGR input.
+    input_rgb = False
+
     def __init__(self, service_name, engine, comm_config, draw=False):
         super(MovidiusMobileNetSSDService, self).__init__(service_name,
                                                           engine,
                                                           comm_config)
         self.draw = draw
 
-    def inference(self, pl):
-        duration = lambda t: (datetime.now() - t).microseconds / 1000
-
-        t = datetime.now()
-        logger.debug('payload size: {}'.format(len(pl)))
-        logger.debug('payload type: {}'.format(type(pl)))
-        jpg_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes = payload.destringify_jpg(jpg_json['bytes'])
-        logger.debug('destringify_jpg: {} ms'.format(duration(t)))
-
-        t = datetime.now()
-        bgr_array = payload.jpg2bgr(jpg_bytes)
-        logger.debug('jpg2bgr: {} ms'.format(duration(t)))
-
-        t = datetime.now()
-        image_data = self.engine.process_input(bgr_array)
-        output = self.engine.inference(image_data)
-        model_outputs = self.engine.process_output(output)
-        logger.debug('Result: {}'.format(model_outputs))
-        logger.debug('Detection takes {} ms'.format(duration(t)))
-
-        classes = self.engine.classes
-        labels = self.engine.labels
-
+    def draw_result(self, bgr_array, result, engine):
         logger.debug('draw = {}'.format(self.draw))
-        if self.draw is False:
-            self.result_hook(self.generalize_result(jpg_json, model_outputs))
-        else:
-            self.result_hook(
-                draw_bb(bgr_array,
-                        self.generalize_result(jpg_json, model_outputs),
-                        generate_class_color(class_num=classes),
-                        labels))
+        if self.draw:
+            result = draw_bb(bgr_array,
+                             result,
+                             generate_class_color(
+                                 class_num=engine.classes),
+                             engine.labels)
+        return result
 
     def result_hook(self, generalized_result):
         logger.debug('result_hook, annotations: {}'.format(generalized_result['annotations']))
         self.comm.send('berrynet/engine/mvmobilenetssd/result',
-                       payload.serialize_payload(generalized_result))
+                       self.serialize_result(generalized_result))
 
 
 def parse_args():
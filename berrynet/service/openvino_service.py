@@ -21,111 +21,61 @@
 import argparse
 import logging
 
-from datetime import datetime
-
 from berrynet import logger
-from berrynet.comm import payload
 from berrynet.dlmodelmgr import DLModelManager
+from berrynet.engine.modelcache import ModelCache
 from berrynet.engine.openvino_engine import OpenVINOClassifierEngine
 from berrynet.engine.openvino_engine import OpenVINODetectorEngine
 from berrynet.service import EngineService
+from berrynet.service import model_paths
 from berrynet.utils import draw_bb
 from berrynet.utils import generate_class_color
 
 
 class OpenVINOClassifierService(EngineService):
+    # Engine takes BGR input.
+    input_rgb = False
+
     def __init__(self, service_name, engine, comm_config, draw=False):
         super(OpenVINOClassifierService, self).__init__(service_name,
                                                         engine,
                                                         comm_config)
         self.draw = draw
-
-    def inference(self, pl):
-        duration = lambda t: (datetime.now() - t).microseconds / 1000
-
-        t = datetime.now()
-        logger.debug('payload size: {}'.format(len(pl)))
-        logger.debug('payload type: {}'.format(type(pl)))
-        jpg_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes = payload.destringify_jpg(jpg_json['bytes'])
-        logger.debug('destringify_jpg: {} ms'.format(duration(t)))
-
-        t = datetime.now()
-        bgr_array = payload.jpg2bgr(jpg_bytes)
-        logger.debug('jpg2bgr: {} ms'.format(duration(t)))
-
-        t = datetime.now()
-        image_data = self.engine.process_input(bgr_array)
-        output = self.engine.inference(image_data)
-        model_outputs = self.engine.process_output(output)
-        logger.debug('Result: {}'.format(model_outputs))
-        logger.debug('Detection takes {} ms'.format(duration(t)))
-
-        #classes = self.engine.classes
-        #labels = self.engine.labels
-
-        logger.debug('draw = {}'.format(self.draw))
-        if self.draw is False:
-            self.result_hook(self.generalize_result(jpg_json, model_outputs))
-        else:
-            #self.result_hook(
-            #    draw_bb(bgr_array,
-            #            self.generalize_result(jpg_json, model_outputs),
-            #            generate_class_color(class_num=classes),
-            #            labels))
-            self.result_hook(self.generalize_result(jpg_json, model_outputs))
+        self.reduced_decode = not draw
 
     def result_hook(self, generalized_result):
         logger.debug('result_hook, annotations: {}'.format(generalized_result['annotations']))
-        self.comm.send('berrynet/engine/ovclassifier/result',
-                       payload.serialize_payload(generalized_result))
+        topic = self.channel_topic('berrynet/engine/ovclassifier/result',
+                                   generalized_result)
+        self.comm.send(topic, self.serialize_result(generalized_result))
 
 
 class OpenVINODetectorService(EngineService):
+    # Engine takes BGR input.
+    input_rgb = False
+
     def __init__(self, service_name, engine, comm_config, draw=False):
         super(OpenVINODetectorService, self).__init__(service_name,
                                                       engine,
                                                       comm_config)
         self.draw = draw
+        self.reduced_decode = not draw
 
-    def inference(self, pl):
-        duration = lambda t: (datetime.now() - t).microseconds / 1000
-
-        t = datetime.now()
-        logger.debug('payload size: {}'.format(len(pl)))
-        logger.debug('payload type: {}'.format(type(pl)))
-        jpg_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes = payload.destringify_jpg(jpg_json['bytes'])
-        logger.debug('destringify_jpg: {} ms'.format(duration(t)))
-
-        t = datetime.now()
-        bgr_array = payload.jpg2bgr(jpg_bytes)
-        logger.debug('jpg2bgr: {} ms'.format(duration(t)))
-
-        t = datetime.now()
-        image_data = self.engine.process_input(bgr_array)
-        output = self.engine.inference(image_data)
-        model_outputs = self.engine.process_output(output)
-        logger.debug('Result: {}'.format(model_outputs))
-        logger.debug('Detection takes {} ms'.format(duration(t)))
-
-        classes = len(self.engine.labels_map)
-        labels = self.engine.labels_map
-
+    def draw_result(self, bgr_array, result, engine):
         logger.debug('draw = {}'.format(self.draw))
-        if self.draw is False:
-            self.result_hook(self.generalize_result(jpg_json, model_outputs))
-        else:
-            self.result_hook(
-                draw_bb(bgr_array,
-                        self.generalize_result(jpg_json, model_outputs),
-                        generate_class_color(class_num=classes),
-                        labels))
+        if self.draw:
+            result = draw_bb(bgr_array,
+                             result,
+                             generate_class_color(
+                                 class_num=len(engine.labels_map)),
+                             engine.labels_map)
+        return result
 
     def result_hook(self, generalized_result):
         logger.debug('result_hook, annotations: {}'.format(generalized_result['annotations']))
-        self.comm.send('berrynet/engine/ovdetector/result',
-                       payload.serialize_payload(generalized_result))
+        topic = self.channel_topic('berrynet/engine/ovdetector/result',
+                                   generalized_result)
+        self.comm.send(topic, self.serialize_result(generalized_result))
 
 
 def parse_args():
@@ -161,6 +111,86 @@ def parse_args():
         help='Specify the target device to infer on; CPU, GPU, FPGA or MYRIAD is acceptable. Sample will look for a suitable plugin for device specified (CPU by default)',
         default='CPU',
         type=str)
+    ap.add_argument(
+        '--batch-size',
+        default=1,
+        type=int,
+        help=('Batch size of the loaded network. Batch size is static in '
+              'OpenVINO, smaller batches are padded. (1 by default)'))
+    ap.add_argument(
+        '--num-requests',
+        default=2,
+        type=int,
+        help=('Number of asynchronous infer requests. Frames are '
+              'preprocessed, inferred and postprocessed by the same number '
+              'of threads, so the device is kept busy. (2 by default)'))
+    ap.add_argument(
+        '--data-topic',
+        default='berrynet/data/rgbimage',
+        help=('Topic of input frames. It can contain MQTT wildcards, e.g. '
+              'berrynet/data/+/rgbimage serves multiple cameras, and '
+              'results of a camera are published to <result topic>/'
+              '<channel>, where channel is the topic level matched by the '
+              'wildcard.'))
+    ap.add_argument(
+        '--mailbox-policy',
+        default='keep-latest',
+        choices=['none', 'keep-latest', 'drop-oldest', 'deadline'],
+        help=('How to drop frames when inference is slower than camera. '
+              'none means frames are never dropped. (keep-latest by default)'))
+    ap.add_argument(
+        '--mailbox-size',
+        default=1,
+        type=int,
+        help='Max number of queued frames for drop-oldest and deadline.')
+    ap.add_argument(
+        '--mailbox-deadline-ms',
+        default=1000,
+        type=int,
+        help='Frames older than the deadline are dropped in deadline policy.')
+    ap.add_argument(
+        '--max-batch',
+        default=1,
+        type=int,
+        help=('Collect frames of all channels into batches of at most '
+              'this size for batched inference. (1 disables batching)'))
+    ap.add_argument(
+        '--max-wait-ms',
+        default=20,
+        type=int,
+        help=('Max time a frame waits for other frames to fill its '
+              'batch. (20 by default)'))
+    ap.add_argument(
+        '--result-by-reference',
+        action='store_true',
+        help=('Send results with a frame reference instead of the image. '
+              'Image is kept in a local frame store for clients on the '
+              'same host.'))
+    ap.add_argument(
+        '--frame-store-capacity',
+        default=128,
+        type=int,
+        help='Max number of images kept in the frame store.')
+    ap.add_argument(
+        '--frame-store-ttl',
+        default=30,
+        type=int,
+        help='Images older than TTL seconds are removed from frame store.')
+    ap.add_argument(
+        '--model-cache-dir',
+        default=None,
+        help=('Directory of compiled model cache. (~/.cache/berrynet/models '
+              'or /var/cache/berrynet/models for root by default)'))
+    ap.add_argument(
+        '--no-model-cache',
+        action='store_true',
+        help='Always compile model at startup')
+    ap.add_argument(
+        '--model-topic',
+        default=None,
+        help=('Topic of model specs, e.g. {"model_package": name}. Engine '
+              'is swapped to the model without restarting service, and '
+              'swap status is published to <model-topic>/status.'))
     ap.add_argument(
         '--draw',
         action='store_true',
@@ -172,6 +202,29 @@ def parse_args():
     return vars(ap.parse_args())
 
 
+def create_engine(args, model_cache=None):
+    if args['service'] == 'classifier':
+        return OpenVINOClassifierEngine(
+                   model = args['model'],
+                   labels = args['label'],
+                   top_k = args['top_k'],
+                   device = args['device'],
+                   batch_size = args['batch_size'],
+                   num_requests = args['num_requests'],
+                   model_cache = model_cache)
+    elif args['service'] == 'detector':
+        return OpenVINODetectorEngine(
+                   model = args['model'],
+                   labels = args['label'],
+                   device = args['device'],
+                   batch_size = args['batch_size'],
+                   num_requests = args['num_requests'],
+                   model_cache = model_cache)
+    else:
+        raise Exception('Illegal service {}, it should be '
+                        'classifier or detector'.format(args['service']))
+
+
 def main():
     # Test OpenVINO classifier engine
     args = parse_args()
@@ -192,25 +245,50 @@ def main():
         'broker': {
             'address': 'localhost',
             'port': 1883
-        }
+        },
+        'mailbox': {
+            args['data_topic']: None
+        },
+        'data_topic': args['data_topic']
     }
+    if args['mailbox_policy'] != 'none':
+        comm_config['mailbox'][args['data_topic']] = {
+            'policy': args['mailbox_policy'],
+            'size': args['mailbox_size'],
+            'deadline_ms': args['mailbox_deadline_ms']
+        }
+    if args['result_by_reference']:
+        comm_config['frame_store'] = {
+            'capacity': args['frame_store_capacity'],
+            'ttl': args['frame_store_ttl']
+        }
+    if args['num_requests'] > 1 and args['max_batch'] <= 1:
+        comm_config['workers'] = {
+            'num_workers': args['num_requests'],
+            'backend': 'thread'
+        }
+    if args['max_batch'] > 1:
+        comm_config['batch'] = {
+            'max_batch': args['max_batch'],
+            'max_wait_ms': args['max_wait_ms']
+        }
+    if args['no_model_cache']:
+        model_cache = None
+    else:
+        model_cache = ModelCache(args['model_cache_dir'])
+    if args['model_topic'] is not None:
+        comm_config['model_swap'] = {
+            'engine_factory': lambda spec: create_engine(
+                dict(args, **model_paths(spec)), model_cache),
+            'topic': args['model_topic'],
+            'status_topic': args['model_topic'] + '/status'
+        }
 
+    engine = create_engine(args, model_cache)
     if args['service'] == 'classifier':
-        engine = OpenVINOClassifierEngine(
-                     model = args['model'],
-                     labels = args['label'],
-                     top_k = args['top_k'],
-                     device = args['device'])
         service_functor = OpenVINOClassifierService
-    elif args['service'] == 'detector':
-        engine = OpenVINODetectorEngine(
-                     model = args['model'],
-                     labels = args['label'],
-                     device = args['device'])
-        service_functor = OpenVINODetectorService
     else:
-        raise Exception('Illegal service {}, it should be '
-                        'classifier or detector'.format(args['service']))
+        service_functor = OpenVINODetectorService
 
     engine_service = service_functor(args['service_name'],
                                      engine,
@@ -22,7 +22,6 @@ import argparse
 import logging
 
 from berrynet import logger
-from berrynet.comm import payload
 from berrynet.dlmodelmgr import DLModelManager
 from berrynet.engine.tensorflow_engine import TensorFlowEngine
 from berrynet.service import EngineService
@@ -37,7 +36,7 @@ class TensorFlowService(EngineService):
     def result_hook(self, generalized_result):
         logger.debug('result_hook, annotations: {}'.format(generalized_result['annotations']))
         self.comm.send('berrynet/engine/tensorflow/result',
-                       payload.serialize_payload(generalized_result))
+                       self.serialize_result(generalized_result))
 
 
 def parse_args():
@@ -56,6 +55,10 @@ def parse_args():
                     help='Display this many predictions',
                     default=3,
                     type=int)
+    ap.add_argument('--fused',
+                    action='store_true',
+                    help=('Wire preprocessing into model input, so that '
+                          'one session run goes from frame to predictions'))
     ap.add_argument('--debug',
                     action='store_true',
                     help='Debug mode toggle')
@@ -78,7 +81,8 @@ def main():
     input_layer = 'input:0'
     output_layer = 'InceptionV3/Predictions/Reshape_1:0'
 
-    tfe = TensorFlowEngine(model, label, input_layer, output_layer)
+    tfe = TensorFlowEngine(model, label, input_layer, output_layer,
+                           fused=args['fused'])
     comm_config = {
         'subscribe': {},
         'broker': {
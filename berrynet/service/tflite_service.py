@@ -20,109 +20,97 @@
 
 import argparse
 import logging
-import time
 
 from berrynet import logger
-from berrynet.comm import payload
 from berrynet.dlmodelmgr import DLModelManager
 from berrynet.engine.tflite_engine import TFLiteClassifierEngine
 from berrynet.engine.tflite_engine import TFLiteDetectorEngine
+from berrynet.service import AsyncEngineService
 from berrynet.service import EngineService
+from berrynet.service import model_paths
 from berrynet.utils import draw_bb
+from berrynet.utils import draw_label
 from berrynet.utils import generate_class_color
 
 
+# Text color of classification labels, BGR
+LABEL_COLOR = (0, 255, 0)
+
+
 class TFLiteClassifierService(EngineService):
+    # Engine takes BGR input.
+    input_rgb = False
+
     def __init__(self, service_name, engine, comm_config, draw=False):
         super(TFLiteClassifierService, self).__init__(service_name,
                                                       engine,
                                                       comm_config)
         self.draw = draw
+        self.reduced_decode = not draw
 
-    def inference(self, pl):
-        t0 = time.time()
-        logger.debug('payload size: {}'.format(len(pl)))
-        logger.debug('payload type: {}'.format(type(pl)))
-        jpg_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes = payload.destringify_jpg(jpg_json['bytes'])
-        logger.debug('destringify_jpg: {} ms'.format(time.time() - t0))
-
-        t1 = time.time()
-        bgr_array = payload.jpg2bgr(jpg_bytes)
-        logger.debug('jpg2bgr: {} ms'.format(time.time() - t1))
-
-        t2 = time.time()
-        image_data = self.engine.process_input(bgr_array)
-        logger.debug('Input processing takes {} ms'.format(time.time() - t2))
-
-        t3 = time.time()
-        output = self.engine.inference(image_data)
-        model_outputs = self.engine.process_output(output)
-        logger.debug('Result: {}'.format(model_outputs))
-        logger.debug('Classification takes {} ms'.format(time.time() - t3))
-
-        classes = self.engine.classes
-        labels = self.engine.labels
-
+    def draw_result(self, bgr_array, result, engine):
         logger.debug('draw = {}'.format(self.draw))
-        if self.draw is False:
-            self.result_hook(self.generalize_result(jpg_json, model_outputs))
-        else:
-            self.result_hook(
-                draw_label(bgr_array,
-                           self.generalize_result(jpg_json, model_outputs),
-                           color,
-                           labels))
+        if self.draw:
+            result = draw_label(bgr_array, result, LABEL_COLOR)
+        return result
 
     def result_hook(self, generalized_result):
         logger.debug('result_hook, annotations: {}'.format(generalized_result['annotations']))
-        self.comm.send('berrynet/engine/tfliteclassifier/result',
-                       payload.serialize_payload(generalized_result))
+        topic = self.channel_topic('berrynet/engine/tfliteclassifier/result',
+                                   generalized_result)
+        self.comm.send(topic, self.serialize_result(generalized_result))
 
 
 class TFLiteDetectorService(EngineService):
+    # Engine takes BGR input.
+    input_rgb = False
+
     def __init__(self, service_name, engine, comm_config, draw=False):
         super(TFLiteDetectorService, self).__init__(service_name,
                                                    engine,
                                                    comm_config)
         self.draw = draw
+        self.reduced_decode = not draw
 
-    def inference(self, pl):
-        t0 = time.time()
-        logger.debug('payload size: {}'.format(len(pl)))
-        logger.debug('payload type: {}'.format(type(pl)))
-        jpg_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes = payload.destringify_jpg(jpg_json['bytes'])
-        logger.debug('destringify_jpg: {} ms'.format(time.time() - t0))
+    def draw_result(self, bgr_array, result, engine):
+        logger.debug('draw = {}'.format(self.draw))
+        if self.draw:
+            result = draw_bb(bgr_array,
+                             result,
+                             generate_class_color(
+                                 class_num=engine.classes),
+                             engine.labels)
+        return result
 
-        t1 = time.time()
-        bgr_array = payload.jpg2bgr(jpg_bytes)
-        logger.debug('jpg2bgr: {} ms'.format(time.time() - t1))
+    def result_hook(self, generalized_result):
+        logger.debug('result_hook, annotations: {}'.format(generalized_result['annotations']))
+        topic = self.channel_topic('berrynet/engine/tflitedetector/result',
+                                   generalized_result)
+        self.comm.send(topic, self.serialize_result(generalized_result))
 
-        t2 = time.time()
-        image_data = self.engine.process_input(bgr_array)
-        output = self.engine.inference(image_data)
-        model_outputs = self.engine.process_output(output)
-        logger.debug('Result: {}'.format(model_outputs))
-        logger.debug('Detection takes {} ms'.format(time.time() - t2))
 
-        classes = self.engine.classes
-        labels = self.engine.labels
+class AsyncTFLiteService(AsyncEngineService):
+    # TFLite engines take BGR input.
+    input_rgb = False
 
-        logger.debug('draw = {}'.format(self.draw))
-        if self.draw is False:
-            self.result_hook(self.generalize_result(jpg_json, model_outputs))
-        else:
-            self.result_hook(
-                draw_bb(bgr_array,
-                        self.generalize_result(jpg_json, model_outputs),
-                        generate_class_color(class_num=classes),
-                        labels))
+    def __init__(self, service_name, engine, comm_config, result_topic,
+                 draw=False):
+        super(AsyncTFLiteService, self).__init__(service_name,
+                                                 engine,
+                                                 comm_config,
+                                                 result_topic=result_topic)
+        self.draw = draw
+        self.reduced_decode = not draw
 
-    def result_hook(self, generalized_result):
-        logger.debug('result_hook, annotations: {}'.format(generalized_result['annotations']))
-        self.comm.send('berrynet/engine/tflitedetector/result',
-                       payload.serialize_payload(generalized_result))
+    def draw_result(self, image, result, engine):
+        if not self.draw:
+            return result
+        if isinstance(engine, TFLiteClassifierEngine):
+            return draw_label(image, result, LABEL_COLOR)
+        return draw_bb(image,
+                       result,
+                       generate_class_color(class_num=engine.classes),
+                       engine.labels)
 
 
 def parse_args():
@@ -158,10 +146,91 @@ def parse_args():
         default=1,
         help="Number of threads for running inference.",
         type=int)
+    ap.add_argument(
+        '--num-interpreters',
+        default=1,
+        type=int,
+        help=('Number of interpreters sharing one model buffer. Frames are '
+              'inferred by the same number of threads in parallel. '
+              '(1 by default)'))
+    ap.add_argument(
+        '--data-topic',
+        default='berrynet/data/rgbimage',
+        help=('Topic of input frames. It can contain MQTT wildcards, e.g. '
+              'berrynet/data/+/rgbimage serves multiple cameras, and '
+              'results of a camera are published to <result topic>/'
+              '<channel>, where channel is the topic level matched by the '
+              'wildcard.'))
+    ap.add_argument(
+        '--mailbox-policy',
+        default='keep-latest',
+        choices=['none', 'keep-latest', 'drop-oldest', 'deadline'],
+        help=('How to drop frames when inference is slower than camera. '
+              'none means frames are never dropped. (keep-latest by default)'))
+    ap.add_argument(
+        '--mailbox-size',
+        default=1,
+        type=int,
+        help='Max number of queued frames for drop-oldest and deadline.')
+    ap.add_argument(
+        '--mailbox-deadline-ms',
+        default=1000,
+        type=int,
+        help='Frames older than the deadline are dropped in deadline policy.')
+    ap.add_argument(
+        '--max-batch',
+        default=1,
+        type=int,
+        help=('Collect frames of all channels into batches of at most '
+              'this size for batched inference. (1 disables batching)'))
+    ap.add_argument(
+        '--max-wait-ms',
+        default=20,
+        type=int,
+        help=('Max time a frame waits for other frames to fill its '
+              'batch. (20 by default)'))
+    ap.add_argument(
+        '--workers',
+        default=1,
+        type=int,
+        help=('Number of engine worker processes forked after model is '
+              'loaded. (1 disables worker pool)'))
+    ap.add_argument(
+        '--dispatch',
+        default='least-loaded',
+        choices=['round-robin', 'least-loaded'],
+        help='How to dispatch frames to engine workers.')
+    ap.add_argument(
+        '--result-by-reference',
+        action='store_true',
+        help=('Send results with a frame reference instead of the image. '
+              'Image is kept in a local frame store for clients on the '
+              'same host.'))
+    ap.add_argument(
+        '--frame-store-capacity',
+        default=128,
+        type=int,
+        help='Max number of images kept in the frame store.')
+    ap.add_argument(
+        '--frame-store-ttl',
+        default=30,
+        type=int,
+        help='Images older than TTL seconds are removed from frame store.')
+    ap.add_argument(
+        '--model-topic',
+        default=None,
+        help=('Topic of model specs, e.g. {"model_package": name}. Engine '
+              'is swapped to the model without restarting service, and '
+              'swap status is published to <model-topic>/status.'))
     ap.add_argument(
         '--draw',
         action='store_true',
         help='Draw bounding boxes on image in result')
+    ap.add_argument(
+        '--asyncio',
+        action='store_true',
+        help=('Overlap receiving, decoding, inference and publishing '
+              'in an asyncio event loop'))
     ap.add_argument(
         '--debug',
         action='store_true',
@@ -169,6 +238,25 @@ def parse_args():
     return vars(ap.parse_args())
 
 
+def create_engine(args):
+    if args['service'] == 'classifier':
+        return TFLiteClassifierEngine(
+                   model = args['model'],
+                   labels = args['label'],
+                   top_k = args['top_k'],
+                   num_threads = args['num_threads'],
+                   num_interpreters = args['num_interpreters'])
+    elif args['service'] == 'detector':
+        return TFLiteDetectorEngine(
+                   model = args['model'],
+                   labels = args['label'],
+                   num_threads = args['num_threads'],
+                   num_interpreters = args['num_interpreters'])
+    else:
+        raise Exception('Illegal service {}, it should be '
+                        'classifier or detector'.format(args['service']))
+
+
 def main():
     # Test TFLite engines
     args = parse_args()
@@ -189,30 +277,65 @@ def main():
         'broker': {
             'address': 'localhost',
             'port': 1883
-        }
+        },
+        'mailbox': {
+            args['data_topic']: None
+        },
+        'data_topic': args['data_topic']
     }
+    if args['mailbox_policy'] != 'none':
+        comm_config['mailbox'][args['data_topic']] = {
+            'policy': args['mailbox_policy'],
+            'size': args['mailbox_size'],
+            'deadline_ms': args['mailbox_deadline_ms']
+        }
+    if args['result_by_reference']:
+        comm_config['frame_store'] = {
+            'capacity': args['frame_store_capacity'],
+            'ttl': args['frame_store_ttl']
+        }
+    if args['workers'] > 1:
+        comm_config['workers'] = {
+            'num_workers': args['workers'],
+            'dispatch': args['dispatch']
+        }
+    elif args['num_interpreters'] > 1 and not args['asyncio']:
+        comm_config['workers'] = {
+            'num_workers': args['num_interpreters'],
+            'dispatch': args['dispatch'],
+            'backend': 'thread'
+        }
+    if args['max_batch'] > 1:
+        comm_config['batch'] = {
+            'max_batch': args['max_batch'],
+            'max_wait_ms': args['max_wait_ms']
+        }
+    if args['model_topic'] is not None:
+        comm_config['model_swap'] = {
+            'engine_factory': lambda spec: create_engine(
+                dict(args, **model_paths(spec))),
+            'topic': args['model_topic'],
+            'status_topic': args['model_topic'] + '/status'
+        }
 
+    engine = create_engine(args)
     if args['service'] == 'classifier':
-        engine = TFLiteClassifierEngine(
-                     model = args['model'],
-                     labels = args['label'],
-                     top_k = args['top_k'],
-                     num_threads = args['num_threads'])
         service_functor = TFLiteClassifierService
-    elif args['service'] == 'detector':
-        engine = TFLiteDetectorEngine(
-                     model = args['model'],
-                     labels = args['label'],
-                     num_threads = args['num_threads'])
-        service_functor = TFLiteDetectorService
     else:
-        raise Exception('Illegal service {}, it should be '
-                        'classifier or detector'.format(args['service']))
+        service_functor = TFLiteDetectorService
 
-    engine_service = service_functor(args['service_name'],
-                                     engine,
-                                     comm_config,
-                                     draw=args['draw'])
+    if args['asyncio']:
+        engine_service = AsyncTFLiteService(
+            args['service_name'],
+            engine,
+            comm_config,
+            'berrynet/engine/tflite{}/result'.format(args['service']),
+            draw=args['draw'])
+    else:
+        engine_service = service_functor(args['service_name'],
+                                         engine,
+                                         comm_config,
+                                         draw=args['draw'])
     engine_service.run(args)
 
 
@@ -20,10 +20,8 @@
 
 import argparse
 import logging
-import time
 
 from berrynet import logger
-from berrynet.comm import payload
 from berrynet.dlmodelmgr import DLModelManager
 from berrynet.engine.tfliteyolov4_engine import TFLiteYoloV4DetectorEngine
 from berrynet.service import EngineService
@@ -31,48 +29,31 @@ from berrynet.utils import draw_bb
 from berrynet.utils import generate_class_color
 
 class TFLiteYoloV4DetectorService(EngineService):
+    # Engine takes BGR input.
+    input_rgb = False
+
     def __init__(self, service_name, engine, comm_config, draw=False):
         super(TFLiteYoloV4DetectorService, self).__init__(service_name,
                                                    engine,
                                                    comm_config)
         self.draw = draw
+        self.reduced_decode = not draw
 
-    def inference(self, pl):
-        t0 = time.time()
-        logger.debug('payload size: {}'.format(len(pl)))
-        logger.debug('payload type: {}'.format(type(pl)))
-        jpg_json = payload.deserialize_payload(pl.decode('utf-8'))
-        jpg_bytes = payload.destringify_jpg(jpg_json['bytes'])
-        logger.debug('destringify_jpg: {} ms'.format(time.time() - t0))
-
-        t1 = time.time()
-        bgr_array = payload.jpg2bgr(jpg_bytes)
-        logger.debug('jpg2bgr: {} ms'.format(time.time() - t1))
-
-        t2 = time.time()
-        image_data = self.engine.process_input(bgr_array)
-        output = self.engine.inference(image_data)
-        model_outputs = self.engine.process_output(output)
-        logger.debug('Result: {}'.format(model_outputs))
-        logger.debug('Detection takes {} ms'.format(time.time() - t2))
-
-        classes = self.engine.classes
-        labels = self.engine.labels
-
+    def draw_result(self, bgr_array, result, engine):
         logger.debug('draw = {}'.format(self.draw))
-        if self.draw is False:
-            self.result_hook(self.generalize_result(jpg_json, model_outputs))
-        else:
-            self.result_hook(
-                draw_bb(bgr_array,
-                        self.generalize_result(jpg_json, model_outputs),
-                        generate_class_color(class_num=classes),
-                        labels))
+        if self.draw:
+            result = draw_bb(bgr_array,
+                             result,
+                             generate_class_color(
+                                 class_num=engine.classes),
+                             engine.labels)
+        return result
 
     def result_hook(self, generalized_result):
         logger.debug('result_hook, annotations: {}'.format(generalized_result['annotations']))
-        self.comm.send('berrynet/engine/tfliteyolov4detector/result',
-                       payload.serialize_payload(generalized_result))
+        topic = self.channel_topic(
+            'berrynet/engine/tfliteyolov4detector/result', generalized_result)
+        self.comm.send(topic, self.serialize_result(generalized_result))
 
 
 def parse_args():
@@ -107,6 +88,57 @@ def parse_args():
         '--num_threads',
         default=1,
         help="Number of threads for running inference.")
+    ap.add_argument(
+        '--data-topic',
+        default='berrynet/data/rgbimage',
+        help=('Topic of input frames. It can contain MQTT wildcards, e.g. '
+              'berrynet/data/+/rgbimage serves multiple cameras, and '
+              'results of a camera are published to <result topic>/'
+              '<channel>, where channel is the topic level matched by the '
+              'wildcard.'))
+    ap.add_argument(
+        '--mailbox-policy',
+        default='keep-latest',
+        choices=['none', 'keep-latest', 'drop-oldest', 'deadline'],
+        help=('How to drop frames when inference is slower than camera. '
+              'none means frames are never dropped. (keep-latest by default)'))
+    ap.add_argument(
+        '--mailbox-size',
+        default=1,
+        type=int,
+        help='Max number of queued frames for drop-oldest and deadline.')
+    ap.add_argument(
+        '--mailbox-deadline-ms',
+        default=1000,
+        type=int,
+        help='Frames older than the deadline are dropped in deadline policy.')
+    ap.add_argument(
+        '--workers',
+        default=1,
+        type=int,
+        help=('Number of engine worker processes forked after model is '
+              'loaded. (1 disables worker pool)'))
+    ap.add_argument(
+        '--dispatch',
+        default='least-loaded',
+        choices=['round-robin', 'least-loaded'],
+        help='How to dispatch frames to engine workers.')
+    ap.add_argument(
+        '--result-by-reference',
+        action='store_true',
+        help=('Send results with a frame reference instead of the image. '
+              'Image is kept in a local frame store for clients on the '
+              'same host.'))
+    ap.add_argument(
+        '--frame-store-capacity',
+        default=128,
+        type=int,
+        help='Max number of images kept in the frame store.')
+    ap.add_argument(
+        '--frame-store-ttl',
+        default=30,
+        type=int,
+        help='Images older than TTL seconds are removed from frame store.')
     ap.add_argument(
         '--draw',
         action='store_true',
@@ -138,8 +170,28 @@ def main():
         'broker': {
             'address': 'localhost',
             'port': 1883
-        }
+        },
+        'mailbox': {
+            args['data_topic']: None
+        },
+        'data_topic': args['data_topic']
     }
+    if args['mailbox_policy'] != 'none':
+        comm_config['mailbox'][args['data_topic']] = {
+            'policy': args['mailbox_policy'],
+            'size': args['mailbox_size'],
+            'deadline_ms': args['mailbox_deadline_ms']
+        }
+    if args['result_by_reference']:
+        comm_config['frame_store'] = {
+            'capacity': args['frame_store_capacity'],
+            'ttl': args['frame_store_ttl']
+        }
+    if args['workers'] > 1:
+        comm_config['workers'] = {
+            'num_workers': args['workers'],
+            'dispatch': args['dispatch']
+        }
 
     if args['service'] == 'detector':
         engine = TFLiteYoloV4DetectorEngine(
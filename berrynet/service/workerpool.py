@@ -0,0 +1,270 @@
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Engine worker pool.
+
+Process workers: Model is loaded once by the service process, and
+workers are forked from it, so model weights are shared copy-on-write
+instead of being loaded N times. Each worker decodes and infers frames
+with its own copy of the engine.
+
+Thread workers: Workers share the engine, which should be thread-safe
+(engine.concurrency > 1), e.g. a TFLite engine with multiple
+interpreters.
+
+Results are published by the service process in frame order.
+
+Workers are forked before any other thread of the service is started.
+A dead worker is not respawned, because forking a multi-threaded process
+is unsafe. Its frames are skipped, and the service exits if all the
+workers are dead.
+"""
+
+import multiprocessing
+import os
+import queue
+import threading
+import time
+
+from berrynet import logger
+
+
+DISPATCH_POLICIES = ('round-robin', 'least-loaded')
+WORKER_BACKENDS = ('process', 'thread')
+# Interval in seconds to check if workers are alive.
+WORKER_POLL_INTERVAL = 1
+
+
+class EngineWorkerPool(object):
+    def __init__(self, service, num_workers=2, dispatch='least-loaded',
+                 max_inflight=2, backend='process'):
+        """
+        Args:
+            service: EngineService whose decode, infer and result_hook
+                     are used. decode and infer run in workers, and
+                     result_hook runs in the service process.
+            num_workers: Number of workers.
+            dispatch: round-robin or least-loaded.
+            max_inflight: Max number of frames queued in each worker.
+                          submit() blocks when all the workers are full.
+            backend: process or thread.
+        """
+        if dispatch not in DISPATCH_POLICIES:
+            raise ValueError('Illegal dispatch policy {0}, it should be one '
+                             'of {1}'.format(dispatch, DISPATCH_POLICIES))
+        if backend not in WORKER_BACKENDS:
+            raise ValueError('Illegal worker backend {0}, it should be one '
+                             'of {1}'.format(backend, WORKER_BACKENDS))
+        self.service = service
+        self.num_workers = max(int(num_workers), 1)
+        self.dispatch = dispatch
+        self.max_inflight = max(int(max_inflight), 1)
+        self.backend = backend
+        concurrency = getattr(service.engine, 'concurrency', 1)
+        if backend == 'thread' and self.num_workers > concurrency:
+            logger.warning('Engine supports {} concurrent inferences, '
+                           'but there are {} thread workers'.format(
+                               concurrency, self.num_workers))
+        self.ctx = multiprocessing.get_context('fork')
+        self.task_queues = []
+        self.result_queue = None
+        self.workers = []
+        self.loads = [0] * self.num_workers
+        self.inflight = [set() for _ in range(self.num_workers)]
+        self.dead = set()       # ids of dead workers
+        self.stopping = False
+        self.next_worker = 0
+        self.next_seq = 0       # sequence number of the next frame
+        self.publish_seq = 0    # sequence number of the next result
+        self.reorder = {}       # results waiting for earlier results
+        self.cond = threading.Condition()
+        self.counters = {
+            'submitted': 0,
+            'published': 0,
+            'skipped': 0    # expired frames or failed inferences
+        }
+
+    def start(self):
+        """Start workers, it should be called after model is loaded."""
+        if self.backend == 'thread':
+            self.service.engine.create()
+            self.result_queue = queue.SimpleQueue()
+        else:
+            self.result_queue = self.ctx.Queue()
+        for worker_id in range(self.num_workers):
+            if self.backend == 'thread':
+                task_queue = queue.SimpleQueue()
+                worker = threading.Thread(target=self._work,
+                                          args=(worker_id, task_queue),
+                                          daemon=True)
+            else:
+                task_queue = self.ctx.SimpleQueue()
+                worker = self.ctx.Process(target=self._work,
+                                          args=(worker_id, task_queue),
+                                          daemon=True)
+            worker.start()
+            self.task_queues.append(task_queue)
+            self.workers.append(worker)
+        collector = threading.Thread(target=self._collect, daemon=True)
+        collector.start()
+        logger.info('Started {} engine {} workers'.format(self.num_workers,
+                                                          self.backend))
+
+    def stop(self):
+        with self.cond:
+            self.stopping = True
+        for task_queue in self.task_queues:
+            task_queue.put(None)
+        for worker in self.workers:
+            worker.join()
+
+    def submit(self, jpg_json):
+        """Send a frame to a worker, block if all the workers are full."""
+        with self.cond:
+            worker_id = self._choose()
+            while worker_id is None:
+                self.cond.wait()
+                worker_id = self._choose()
+            seq = self.next_seq
+            self.next_seq += 1
+            self.loads[worker_id] += 1
+            self.inflight[worker_id].add(seq)
+            self.counters['submitted'] += 1
+        self.task_queues[worker_id].put((seq, jpg_json))
+
+    def _choose(self):
+        """Choose a live worker which is not full, or None."""
+        if len(self.dead) == self.num_workers:
+            return None
+        if self.dispatch == 'least-loaded':
+            worker_id = min((i for i in range(self.num_workers)
+                             if i not in self.dead),
+                            key=self.loads.__getitem__)
+        else:
+            worker_id = self.next_worker
+            while worker_id in self.dead:
+                worker_id = (worker_id + 1) % self.num_workers
+            if self.loads[worker_id] < self.max_inflight:
+                self.next_worker = (worker_id + 1) % self.num_workers
+        if self.loads[worker_id] >= self.max_inflight:
+            return None
+        return worker_id
+
+    def stats(self):
+        with self.cond:
+            stats = dict(self.counters)
+            stats['loads'] = list(self.loads)
+            stats['reordering'] = len(self.reorder)
+            stats['dead'] = sorted(self.dead)
+        return stats
+
+    def _collect(self):
+        """Publish results in frame order, run in service process."""
+        t_reap = time.time()
+        while True:
+            try:
+                worker_id, seq, result = self.result_queue.get(
+                    timeout=WORKER_POLL_INTERVAL)
+            except queue.Empty:
+                results = []
+            else:
+                with self.cond:
+                    results = self._finish(worker_id, seq, result)
+            if time.time() - t_reap >= WORKER_POLL_INTERVAL:
+                t_reap = time.time()
+                with self.cond:
+                    results += self._reap()
+            self._publish(results)
+
+    def _finish(self, worker_id, seq, result):
+        """Put result into reorder buffer, caller should hold self.cond.
+
+        Returns:
+            List of results which can be published in frame order.
+        """
+        if seq not in self.inflight[worker_id]:
+            # The frame has been skipped because the worker died.
+            return []
+        self.inflight[worker_id].remove(seq)
+        self.loads[worker_id] -= 1
+        self.cond.notify_all()
+        self.reorder[seq] = result
+        results = []
+        while self.publish_seq in self.reorder:
+            results.append(self.reorder.pop(self.publish_seq))
+            self.publish_seq += 1
+        return results
+
+    def _reap(self):
+        """Skip frames of dead workers, caller should hold self.cond.
+
+        Returns:
+            List of results which can be published in frame order.
+        """
+        if self.stopping:
+            return []
+        results = []
+        for worker_id, worker in enumerate(self.workers):
+            if worker_id in self.dead or worker.is_alive():
+                continue
+            self.dead.add(worker_id)
+            self.cond.notify_all()
+            logger.error('Engine worker {0} exited unexpectedly (exit code '
+                         '{1}), skip its {2} frames'.format(
+                             worker_id, getattr(worker, 'exitcode', None),
+                             len(self.inflight[worker_id])))
+            for seq in sorted(self.inflight[worker_id]):
+                results += self._finish(worker_id, seq, None)
+        if len(self.dead) == self.num_workers:
+            logger.critical('All the engine workers are dead, exit')
+            os._exit(1)
+        return results
+
+    def _publish(self, results):
+        for result in results:
+                if result is None:
+                    with self.cond:
+                        self.counters['skipped'] += 1
+                    continue
+                with self.cond:
+                    self.counters['published'] += 1
+                try:
+                    self.service.result_hook(result)
+                except Exception as e:
+                    logger.exception(e)
+
+    def _work(self, worker_id, task_queue):
+        """Worker main loop, run in worker process or thread."""
+        if self.backend == 'process':
+            self.service.engine.create()
+        while True:
+            task = task_queue.get()
+            if task is None:
+                break
+            seq, jpg_json = task
+            result = None
+            try:
+                image = self.service.decode(jpg_json)
+                if image is None:
+                    logger.warning('Referenced frame has expired, skip it')
+                else:
+                    result = self.service.infer(jpg_json, image)
+            except Exception as e:
+                logger.exception(e)
+            # Failed frames are reported too, so that results after them
+            # are not blocked in reorder buffer.
+            self.result_queue.put((worker_id, seq, result))
@@ -22,8 +22,6 @@ import math
 
 import cv2
 
-from berrynet.comm import payload
-
 
 def generate_class_color(class_num=20):
     """Generate a RGB color set based on given class number.
@@ -66,6 +64,8 @@ def draw_bb(bgr_nparr, infres, class_colors, labels):
     Returens:
         Generalized result whose image data is drew w/ bounding boxes.
     """
+    if not bgr_nparr.flags.writeable:  # e.g. frame in shared memory
+        bgr_nparr = bgr_nparr.copy()
     for res in infres['annotations']:
         left = int(res['left'])
         top = int(res['top'])
@@ -81,8 +81,7 @@ def draw_bb(bgr_nparr, infres, class_colors, labels):
         cv2.putText(bgr_nparr, label, (left, top - 12), 0, 1e-3 * imgHeight,
             color, thick//3)
     #cv2.imwrite('prediction.jpg', bgr_nparr)
-    infres['bytes'] = payload.stringify_jpg(
-                                    cv2.imencode('.jpg', bgr_nparr)[1])
+    infres['bytes'] = cv2.imencode('.jpg', bgr_nparr)[1].tobytes()
     return infres
 
 
@@ -163,6 +162,8 @@ def draw_label(bgr_nparr, infres, class_color, save_image_path=None):
     Returens:
         Generalized result whose image data is drew w/ labels.
     """
+    if not bgr_nparr.flags.writeable:  # e.g. frame in shared memory
+        bgr_nparr = bgr_nparr.copy()
     left = 0
     top = 0
     for res in infres['annotations']:
@@ -179,8 +180,7 @@ def draw_label(bgr_nparr, infres, class_color, save_image_path=None):
                     class_color,
                     thick // 3)
         top += 20
-    infres['bytes'] = payload.stringify_jpg(
-                                    cv2.imencode('.jpg', bgr_nparr)[1])
+    infres['bytes'] = cv2.imencode('.jpg', bgr_nparr)[1].tobytes()
 
     if save_image_path:
         cv2.imwrite(save_image_path, bgr_nparr)
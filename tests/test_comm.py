@@ -0,0 +1,223 @@
+import asyncio
+import gc
+import socket
+import threading
+import time
+import unittest
+
+from collections import deque
+from types import SimpleNamespace
+
+from berrynet.comm import Communicator
+from berrynet.comm import Mailbox
+from berrynet.comm import _publishers
+from berrynet.comm import TopicDispatcher
+from berrynet.comm import payload
+from berrynet.comm import wait_pending
+from berrynet.comm.aio import AsyncCommunicator
+
+
+class TestMailbox(unittest.TestCase):
+    def setUp(self):
+        self.received = []
+        self.gate = threading.Event()
+        self.client = SimpleNamespace(comm_config={
+            'subscribe': {'berrynet/data/rgbimage': self.slow_functor}
+        })
+
+    def slow_functor(self, pl):
+        self.gate.wait()
+        self.received.append(pl)
+
+    def wait_processed(self, mailbox, count, timeout=2):
+        t = time.time()
+        while mailbox.stats()['processed'] + \
+                mailbox.stats()['expired'] < count:
+            if time.time() - t > timeout:
+                self.fail('Mailbox does not process messages in time')
+            time.sleep(0.01)
+
+    def test_keep_latest(self):
+        mailbox = Mailbox(self.client, 'berrynet/data/rgbimage',
+                          policy='keep-latest')
+        mailbox.start()
+        mailbox.put('berrynet/data/rgbimage', None, b'0')
+        time.sleep(0.05)  # worker is blocked by the first message
+        for i in range(1, 10):
+            mailbox.put('berrynet/data/rgbimage', None,
+                        str(i).encode('utf-8'))
+        self.gate.set()
+        self.wait_processed(mailbox, 2)
+        self.assertEqual(self.received, [b'0', b'9'])
+        self.assertEqual(mailbox.stats()['dropped'], 8)
+
+    def test_deadline(self):
+        mailbox = Mailbox(self.client, 'berrynet/data/rgbimage',
+                          policy='deadline', size=4, deadline_ms=100)
+        mailbox.start()
+        stale = payload.serialize_jpg(b'stale')
+        mailbox.put('berrynet/data/rgbimage', None, b'0')
+        time.sleep(0.2)   # worker is blocked by the first message
+        mailbox.put('berrynet/data/rgbimage', None, stale)
+        mailbox.put('berrynet/data/rgbimage', None,
+                    payload.serialize_jpg(b'fresh'))
+        self.gate.set()
+        self.wait_processed(mailbox, 3)
+        self.assertEqual(mailbox.stats()['processed'], 2)
+        self.assertEqual(mailbox.stats()['expired'], 1)
+        self.assertNotIn(stale, self.received)
+
+
+class FakeMessageInfo(object):
+    def __init__(self, published):
+        self.published = published
+        self.timeouts = []
+
+    def wait_for_publish(self, timeout=None):
+        self.timeouts.append(timeout)
+
+    def is_published(self):
+        return self.published
+
+
+class TestWaitPending(unittest.TestCase):
+    def test_published(self):
+        pending = deque(FakeMessageInfo(True) for _ in range(4))
+        wait_pending(pending, 2, timeout=0.1)
+        self.assertEqual(len(pending), 2)
+
+    def test_lost_messages(self):
+        # Messages dropped by reconnect are never published, and waiting
+        # for them is bounded.
+        lost = FakeMessageInfo(False)
+        pending = deque([lost] + [FakeMessageInfo(False) for _ in range(3)])
+        wait_pending(pending, 2, timeout=0.1)
+        self.assertEqual(lost.timeouts, [0.1])
+        self.assertEqual(len(pending), 0)
+
+
+class TestCommunicator(unittest.TestCase):
+    def test_send_while_reconnecting(self):
+        comm = Communicator({
+            'subscribe': {},
+            'broker': {'address': '127.0.0.1', 'port': 1}
+        })
+        # Client has been started by run(), but it is reconnecting.
+        comm.started = True
+        t = time.time()
+        for qos in (0, 1):
+            comm.send('berrynet/engine/test/result', b'0', qos=qos)
+        self.assertLess(time.time() - t, 1)
+        self.assertNotIn(('127.0.0.1', 1), _publishers)
+
+
+class TestAsyncCommunicator(unittest.TestCase):
+    def setUp(self):
+        self.loop = asyncio.new_event_loop()
+
+    def tearDown(self):
+        self.loop.close()
+
+    def test_functor_tasks(self):
+        done = []
+
+        async def functor(pl):
+            await asyncio.sleep(0.01)
+            done.append(pl)
+
+        async def failing_functor(pl):
+            raise RuntimeError('failed')
+
+        comm = AsyncCommunicator(
+            {'subscribe': {'a': functor, 'b': failing_functor}},
+            loop=self.loop)
+        comm._on_message(comm.client, None,
+                         SimpleNamespace(topic='a', payload=b'1'))
+        comm._on_message(comm.client, None,
+                         SimpleNamespace(topic='b', payload=b'2'))
+        # Running tasks are kept even if nothing else refers to them.
+        gc.collect()
+        self.assertEqual(len(comm.tasks), 2)
+        self.loop.run_until_complete(asyncio.sleep(0.05))
+        self.assertEqual(done, [b'1'])
+        self.assertEqual(len(comm.tasks), 0)
+
+    def test_reconnect(self):
+        # Nothing listens on port 1, connection is refused.
+        comm = AsyncCommunicator(
+            {'subscribe': {}, 'broker': {'address': 'localhost', 'port': 1}},
+            loop=self.loop)
+        comm.reconnect_delay = 0.01
+        with self.assertRaises(asyncio.TimeoutError):
+            self.loop.run_until_complete(asyncio.wait_for(comm.run(), 0.2))
+        self.assertGreater(comm.reconnect_delay, 0.01)
+
+
+    def test_connect_in_executor(self):
+        server = socket.socket()
+        server.bind(('127.0.0.1', 0))
+        server.listen(1)
+        self.addCleanup(server.close)
+        comm = AsyncCommunicator(
+            {'subscribe': {},
+             'broker': {'address': '127.0.0.1',
+                        'port': server.getsockname()[1]}},
+            loop=self.loop)
+        connect = comm.client.connect
+
+        def slow_connect(*args):
+            time.sleep(0.2)
+            connect(*args)
+        comm.client.connect = slow_connect
+
+        ticks = []
+
+        async def tick():
+            while True:
+                ticks.append(time.time())
+                await asyncio.sleep(0.01)
+
+        async def run():
+            ticker = self.loop.create_task(tick())
+            await comm.connect()
+            await asyncio.sleep(0.01)
+            ticker.cancel()
+
+        self.loop.run_until_complete(run())
+        # Event loop is not blocked while connecting.
+        self.assertGreater(len(ticks), 5)
+        self.assertIsNotNone(comm.misc_task)
+        comm.disconnect()
+        self.loop.run_until_complete(asyncio.sleep(0.01))
+
+
+class TestTopicDispatcher(unittest.TestCase):
+    def setUp(self):
+        self.dispatcher = TopicDispatcher([
+            'berrynet/data/rgbimage',
+            'berrynet/data/+/rgbimage',
+            'berrynet/engine/pipeline/result/#',
+            '#'
+        ])
+
+    def test_exact(self):
+        self.assertIn(('berrynet/data/rgbimage', None),
+                      self.dispatcher.match('berrynet/data/rgbimage'))
+
+    def test_single_level_wildcard(self):
+        matches = self.dispatcher.match('berrynet/data/camera1/rgbimage')
+        self.assertIn(('berrynet/data/+/rgbimage', 'camera1'), matches)
+        self.assertNotIn('berrynet/data/rgbimage', [m[0] for m in matches])
+
+    def test_multi_level_wildcard(self):
+        matches = self.dispatcher.match('berrynet/engine/pipeline/result/3')
+        self.assertIn(('berrynet/engine/pipeline/result/#', '3'), matches)
+        matches = self.dispatcher.match('berrynet/engine/pipeline/result')
+        self.assertIn(('berrynet/engine/pipeline/result/#', None), matches)
+
+    def test_system_topic(self):
+        self.assertEqual(self.dispatcher.match('$SYS/broker/uptime'), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,123 @@
+import json
+import os
+import shutil
+import tempfile
+import unittest
+
+from berrynet.dlmodelmgr import DLModelManager
+
+
+class TestDLModelManager(unittest.TestCase):
+    def setUp(self):
+        self.basedir = tempfile.mkdtemp()
+        self.add_package('mobilenet', task='classification',
+                         framework='tensorflow-lite', input_size=[224, 224])
+        self.add_package('ssd', task='detection',
+                         framework='tensorflow-lite',
+                         input_shape=[300, 300, 3])
+        self.add_package('yolo', task='detection', framework='darknet',
+                         input_size=[416, 416])
+
+    def tearDown(self):
+        shutil.rmtree(self.basedir)
+
+    def add_package(self, name, **meta):
+        pkgdir = os.path.join(self.basedir, name)
+        os.makedirs(pkgdir, exist_ok=True)
+        meta.update({'model': 'model.bin', 'label': 'labels.txt',
+                     'config': {'cfg': 'net.cfg'}})
+        with open(os.path.join(pkgdir, 'model.bin'), 'wb') as f:
+            f.write(b'weights of ' + name.encode('utf-8'))
+        with open(os.path.join(pkgdir, 'meta.json'), 'w') as f:
+            json.dump(meta, f)
+
+    def test_meta(self):
+        dlmm = DLModelManager(self.basedir)
+        self.assertEqual(sorted(dlmm.get_model_names()),
+                         ['mobilenet', 'ssd', 'yolo'])
+        meta = dlmm.get_model_meta('yolo')
+        self.assertEqual(meta['model'],
+                         os.path.join(self.basedir, 'yolo', 'model.bin'))
+        self.assertEqual(meta['config']['cfg'],
+                         os.path.join(self.basedir, 'yolo', 'net.cfg'))
+
+        # Returned meta is a copy.
+        meta['model'] = 'foo'
+        self.assertNotEqual(dlmm.get_model_meta('yolo')['model'], 'foo')
+        with self.assertRaises(IOError):
+            dlmm.get_model_meta('missing')
+
+    def test_find(self):
+        dlmm = DLModelManager(self.basedir)
+        self.assertEqual(dlmm.find(task='detection'), ['ssd', 'yolo'])
+        self.assertEqual(dlmm.find(backend='tensorflow-lite'),
+                         ['mobilenet', 'ssd'])
+        self.assertEqual(dlmm.find(task='detection',
+                                   backend='tensorflow-lite'), ['ssd'])
+        self.assertEqual(dlmm.find(input_size=(300, 300)), ['ssd'])
+        self.assertEqual(dlmm.find(input_size=[416, 416]), ['yolo'])
+        self.assertEqual(dlmm.find(task='segmentation'), [])
+
+    def test_invalidation(self):
+        dlmm = DLModelManager(self.basedir)
+        self.assertEqual(dlmm.find(task='detection'), ['ssd', 'yolo'])
+        self.assertFalse(dlmm.refresh())
+
+        self.add_package('yolo', task='classification', framework='darknet')
+        self.add_package('resnet', task='classification',
+                         framework='openvino')
+        shutil.rmtree(os.path.join(self.basedir, 'ssd'))
+        self.assertEqual(dlmm.find(task='detection'), [])
+        self.assertEqual(dlmm.find(task='classification'),
+                         ['mobilenet', 'resnet', 'yolo'])
+
+    def test_broken_package(self):
+        dlmm = DLModelManager(self.basedir)
+        self.assertEqual(dlmm.find(task='detection'), ['ssd', 'yolo'])
+        with open(os.path.join(self.basedir, 'yolo', 'meta.json'), 'w') as f:
+            json.dump({'model': 'model.bin', 'task': 'detection'}, f)
+        self.assertEqual(sorted(dlmm.get_model_names()),
+                         ['mobilenet', 'ssd', 'yolo'])
+        self.assertEqual(dlmm.find(task='detection'), ['ssd'])
+        self.assertFalse(dlmm.refresh())
+        with self.assertRaises(IOError):
+            dlmm.get_model_meta('yolo')
+
+    def test_file_invalidation(self):
+        dlmm = DLModelManager(self.basedir, hashes=True)
+        model = os.path.join(self.basedir, 'yolo', 'model.bin')
+        info = dlmm.get_file_info('yolo')[model]
+        self.assertEqual(sorted(info), ['sha1', 'size'])
+
+        # Model is replaced without touching meta.json.
+        with open(model, 'wb') as f:
+            f.write(b'new weights of yolo')
+        new_info = dlmm.get_file_info('yolo')[model]
+        self.assertEqual(new_info['size'], len(b'new weights of yolo'))
+        self.assertNotEqual(new_info['sha1'], info['sha1'])
+        self.assertEqual(new_info,
+                         DLModelManager(self.basedir, hashes=True)
+                         .get_file_info('yolo')[model])
+
+    def test_persistent_index(self):
+        index_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, index_dir)
+        index_path = os.path.join(index_dir, 'index.json')
+        dlmm = DLModelManager(self.basedir, index_path=index_path,
+                              hashes=True)
+        names = dlmm.get_model_names()
+        files = dlmm.get_file_info('yolo')
+        model = os.path.join(self.basedir, 'yolo', 'model.bin')
+        self.assertEqual(files[model]['size'], len(b'weights of yolo'))
+        self.assertEqual(len(files[model]['sha1']), 40)
+
+        # A new manager loads index instead of parsing packages again.
+        dlmm = DLModelManager(self.basedir, index_path=index_path,
+                              hashes=True)
+        self.assertEqual(dlmm.find(task='detection'), ['ssd', 'yolo'])
+        self.assertEqual(dlmm.get_file_info('yolo'), files)
+        self.assertEqual(sorted(dlmm.get_model_names()), sorted(names))
+
+
+if __name__ == '__main__':
+    unittest.main()
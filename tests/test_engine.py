@@ -0,0 +1,61 @@
+import sys
+import unittest
+from types import ModuleType
+from types import SimpleNamespace
+from unittest import mock
+
+import numpy as np
+
+from berrynet.engine import DLEngine
+from berrynet.engine import tflite_backend
+
+
+class MeanEngine(DLEngine):
+    def process_input(self, tensor):
+        self.size = tensor.shape[:2]
+        return tensor
+
+    def inference(self, tensor):
+        return float(tensor.mean())
+
+    def process_output(self, output):
+        return {'mean': output, 'size': self.size}
+
+
+class TestDLEngine(unittest.TestCase):
+    def test_default_infer_batch(self):
+        engine = MeanEngine()
+        tensors = [np.full((h, 4), h, dtype=np.uint8) for h in (1, 2, 3)]
+        self.assertEqual(engine.infer_batch(tensors),
+                         [{'mean': h, 'size': (h, 4)} for h in (1, 2, 3)])
+
+
+class TestTFLiteBackend(unittest.TestCase):
+    def setUp(self):
+        tflite_backend._backend = None
+        self.addCleanup(setattr, tflite_backend, '_backend', None)
+
+    def get_backend(self, tensorflow):
+        # tflite_runtime is not installed, and tensorflow.lite is not
+        # importable as a module.
+        with mock.patch.dict(sys.modules, {
+                'tflite_runtime': None,
+                'tflite_runtime.interpreter': None,
+                'tensorflow': tensorflow,
+                'tensorflow.lite': None}):
+            return tflite_backend.get_backend()
+
+    def test_tensorflow_fallback(self):
+        tf = ModuleType('tensorflow')
+        tf.lite = SimpleNamespace(Interpreter='lite')
+        self.assertEqual(self.get_backend(tf), ('tensorflow', 'lite'))
+
+    def test_tensorflow_contrib_fallback(self):
+        tf = ModuleType('tensorflow')
+        tf.contrib = SimpleNamespace(lite=SimpleNamespace(
+            Interpreter='contrib'))
+        self.assertEqual(self.get_backend(tf), ('tensorflow', 'contrib'))
+
+    def test_no_backend(self):
+        with self.assertRaises(ImportError):
+            self.get_backend(ModuleType('tensorflow'))
@@ -0,0 +1,74 @@
+import os
+import shutil
+import tempfile
+import time
+import unittest
+
+from berrynet.comm import framestore
+from berrynet.comm import payload
+from berrynet.comm.framestore import FrameStore
+
+
+class TestFrameStore(unittest.TestCase):
+    def setUp(self):
+        self.store = FrameStore('berrynet-test-frames', capacity=2, ttl=30)
+
+    def tearDown(self):
+        shutil.rmtree(self.store.dirpath)
+
+    def test_fifo_eviction(self):
+        refs = [self.store.put(str(i), str(i).encode('utf-8'))
+                for i in range(3)]
+        self.assertIsNone(self.store.get('0'))
+        self.assertEqual(framestore.fetch(refs[2]), b'2')
+
+    def test_ttl(self):
+        self.store.put('0', b'0')
+        self.store.ttl = 0.01
+        time.sleep(0.05)
+        self.assertIsNone(self.store.get('0'))
+
+    def test_producer_ttl(self):
+        store = FrameStore('berrynet-test-frames', capacity=2, ttl=120)
+        ref = store.put('0', b'0')
+        t = time.time() - 60
+        os.utime(store._filepath('0'), (t, t))
+        # Consumer expires frames by TTL of producer, not its default.
+        self.assertEqual(framestore.fetch(ref), b'0')
+        ref['ttl'] = 30
+        self.assertIsNone(framestore.fetch(ref))
+
+    def test_illegal_reference(self):
+        ref = self.store.put('0', b'0')
+        victim = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, victim)
+        filepath = os.path.join(victim, 'frame.jpg')
+        with open(filepath, 'wb') as f:
+            f.write(b'0')
+        t = time.time() - 60
+        os.utime(filepath, (t, t))
+
+        for store in (victim, '../' + os.path.basename(victim)):
+            self.assertIsNone(framestore.fetch(dict(ref, store=store, ttl=0)))
+        self.assertIsNone(framestore.fetch(dict(ref, id='../0')))
+        # Consumer never removes files outside of its frames.
+        self.assertTrue(os.path.exists(filepath))
+        with self.assertRaises(ValueError):
+            FrameStore(victim)
+
+    def test_result_by_reference(self):
+        jpg_bytes = bytes(range(256)) * 40
+        obj = payload.deserialize(payload.serialize_jpg(jpg_bytes))
+        obj['annotations'] = []
+        pl = payload.serialize(payload.to_reference(obj, self.store))
+        self.assertLess(len(pl), 512)
+
+        lazy = payload.deserialize_lazy(pl)
+        self.assertEqual(lazy.image, jpg_bytes)
+        result = payload.deserialize(pl)
+        self.assertEqual(payload.pop_image(result), jpg_bytes)
+        self.assertNotIn('frame_ref', result)
+
+
+if __name__ == '__main__':
+    unittest.main()
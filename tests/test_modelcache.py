@@ -0,0 +1,77 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+from berrynet.engine.modelcache import ModelCache
+
+
+class TestModelCache(unittest.TestCase):
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.cache = ModelCache(os.path.join(self.tmpdir, 'cache'))
+        self.model = os.path.join(self.tmpdir, 'model.bin')
+        with open(self.model, 'wb') as f:
+            f.write(b'weights')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_key(self):
+        key = self.cache.key([self.model], 'openvino-CPU-b1', '2020.1')
+        self.assertTrue(key.startswith('openvino-CPU-b1-'))
+        self.assertEqual(
+            key, self.cache.key([self.model], 'openvino-CPU-b1', '2020.1'))
+        self.assertNotEqual(
+            key, self.cache.key([self.model], 'openvino-CPU-b1', '2020.2'))
+        self.assertNotEqual(
+            key, self.cache.key([self.model], 'openvino-MYRIAD-b1', '2020.1'))
+
+        # Changed model gets a new key.
+        with open(self.model, 'wb') as f:
+            f.write(b'new weights')
+        self.assertNotEqual(
+            key, self.cache.key([self.model], 'openvino-CPU-b1', '2020.1'))
+
+    def test_hash_index(self):
+        sha1 = self.cache.file_hash(self.model)
+        self.assertTrue(os.path.exists(self.cache.index_path))
+
+        # Unchanged file is not hashed again.
+        stat = os.stat(self.model)
+        with open(self.model, 'wb') as f:
+            f.write(b'WEIGHTS')
+        os.utime(self.model, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+        self.assertEqual(sha1, self.cache.file_hash(self.model))
+
+    def test_entries(self):
+        key = self.cache.key([self.model], 'openvino-CPU-b1')
+        self.assertIsNone(self.cache.read_json(key, 'network.json'))
+        self.cache.write_json(key, 'network.json', {'exported': False})
+        self.assertEqual(self.cache.read_json(key, 'network.json'),
+                         {'exported': False})
+
+        with self.cache.writing(key, 'network.blob') as path:
+            with open(path, 'wb') as f:
+                f.write(b'blob')
+            self.assertFalse(self.cache.has(key, 'network.blob'))
+        self.assertTrue(self.cache.has(key, 'network.blob'))
+
+        # Failed writing leaves neither entry nor temporary file.
+        with self.assertRaises(RuntimeError):
+            with self.cache.writing(key, 'other.blob') as path:
+                raise RuntimeError('export failed')
+        self.assertFalse(self.cache.has(key, 'other.blob'))
+        self.assertEqual(sorted(os.listdir(os.path.dirname(path))),
+                         ['network.blob', 'network.json'])
+
+    def test_unwritable_cache(self):
+        # Cache directory can not be created under a file.
+        cache = ModelCache(os.path.join(self.model, 'cache'))
+        key = cache.key([self.model], 'openvino-CPU-b1')
+        cache.write_json(key, 'network.json', {'exported': False})
+        self.assertIsNone(cache.read_json(key, 'network.json'))
+
+
+if __name__ == '__main__':
+    unittest.main()
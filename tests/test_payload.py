@@ -0,0 +1,139 @@
+import json
+import unittest
+
+import cv2
+import numpy as np
+
+from berrynet.comm import payload
+
+
+class TestPayload(unittest.TestCase):
+    def setUp(self):
+        self.jpg_bytes = bytes(range(256)) * 40
+        self.meta = {'channel': 1}
+
+    def test_envelope_is_smaller(self):
+        s_jpg = payload.serialize_jpg(self.jpg_bytes, meta=self.meta)
+        b_jpg = payload.serialize_jpg(self.jpg_bytes, meta=self.meta,
+                                      binary=True)
+        self.assertTrue(payload.is_envelope(b_jpg))
+        self.assertFalse(payload.is_envelope(s_jpg.encode('utf-8')))
+        self.assertLess(len(b_jpg), len(s_jpg) * 0.8)
+
+    def test_deserialize_both_formats(self):
+        for binary in (False, True):
+            pl = payload.serialize_jpg(self.jpg_bytes, md5sum=True,
+                                       meta=self.meta, binary=binary)
+            if not binary:
+                pl = pl.encode('utf-8')
+            obj = payload.deserialize(pl)
+            self.assertEqual(obj['bytes'], self.jpg_bytes)
+            self.assertEqual(obj['meta'], self.meta)
+            self.assertEqual(obj.binary, binary)
+
+    def test_serialize_follows_input_format(self):
+        obj = payload.deserialize(
+            payload.serialize_jpg(self.jpg_bytes, binary=True))
+        obj.update({'annotations': [{'label': 'dog', 'confidence': 0.9}]})
+        result = payload.deserialize(payload.serialize(obj))
+        self.assertTrue(result.binary)
+        self.assertEqual(result['bytes'], self.jpg_bytes)
+        self.assertEqual(result['annotations'][0]['label'], 'dog')
+
+        legacy = json.loads(payload.serialize(obj, binary=False))
+        self.assertEqual(payload.destringify_jpg(legacy['bytes']),
+                         self.jpg_bytes)
+
+    def test_deserialize_list(self):
+        pl = json.dumps([json.loads(payload.serialize_jpg(self.jpg_bytes))])
+        objs = payload.deserialize(pl)
+        self.assertEqual(len(objs), 1)
+        self.assertEqual(objs[0]['bytes'], self.jpg_bytes)
+
+    def test_lazy_payload(self):
+        obj = payload.deserialize(payload.serialize_jpg(self.jpg_bytes))
+        obj.update({'annotations': [{'label': 'dog', 'confidence': 0.9}]})
+        for binary in (False, True):
+            pl = payload.serialize(obj, binary=binary)
+            if not binary:
+                pl = pl.encode('utf-8')
+            lazy = payload.deserialize_lazy(pl)
+            self.assertEqual(lazy.annotations[0]['label'], 'dog')
+            self.assertNotIn('bytes', lazy.meta)
+            self.assertIsNone(lazy._image)
+            self.assertEqual(lazy['bytes'], self.jpg_bytes)
+            self.assertEqual(dict(lazy.to_payload()), dict(obj))
+
+    def test_lazy_payload_without_image(self):
+        pl = json.dumps({'bytes': None, 'annotations': []})
+        lazy = payload.deserialize_lazy(pl)
+        self.assertFalse(lazy.has_image())
+        self.assertIsNone(lazy.image)
+        self.assertEqual(lazy.meta, {'annotations': []})
+
+    def test_frame_id(self):
+        frame_id = payload.generate_frame_id(self.jpg_bytes)
+        self.assertEqual(len(frame_id), 16)
+        self.assertEqual(frame_id,
+                         payload.generate_frame_id(bytearray(self.jpg_bytes)))
+        self.assertNotEqual(frame_id,
+                            payload.generate_frame_id(self.jpg_bytes[1:]))
+
+        obj = payload.deserialize(
+            payload.serialize_jpg(self.jpg_bytes, frame_id=frame_id))
+        self.assertEqual(obj['frame_id'], frame_id)
+        del obj['frame_id']
+        self.assertEqual(payload.get_frame_id(obj), frame_id)
+
+    def test_batch(self):
+        objs = []
+        for seq in range(3):
+            obj = payload.create_jpg_object(self.jpg_bytes[seq:],
+                                            meta={'seq': seq})
+            obj['seq'] = seq
+            objs.append(obj)
+        objs.append(payload.create_frame_handle_object({'slot': 0}))
+        for binary in (False, True):
+            pl = payload.serialize_batch(objs, binary=binary)
+            self.assertEqual(payload.is_envelope(pl), binary)
+            frames = payload.deserialize(pl)
+            self.assertEqual([f.get('seq') for f in frames], [0, 1, 2, None])
+            for seq in range(3):
+                self.assertEqual(frames[seq]['bytes'], self.jpg_bytes[seq:])
+            self.assertNotIn('bytes', frames[3])
+            self.assertEqual(frames[3]['shm'], {'slot': 0})
+
+
+class TestJpegDecode(unittest.TestCase):
+    def setUp(self):
+        im = np.zeros((1079, 1917, 3), dtype=np.uint8)
+        im[:, :, 0] = 200
+        im[:, :, 2] = 50
+        self.jpg_bytes = cv2.imencode('.jpg', im)[1].tobytes()
+
+    def test_jpg_size(self):
+        self.assertEqual(payload.jpg_size(self.jpg_bytes), (1917, 1079))
+        self.assertIsNone(payload.jpg_size(b'not a jpeg'))
+
+    def test_jpg_scale(self):
+        self.assertEqual(payload.jpg_scale((1920, 1080), (300, 300)), 2)
+        self.assertEqual(payload.jpg_scale((1920, 1080), (224, 224)), 4)
+        self.assertEqual(payload.jpg_scale((2400, 2400), (300, 300)), 8)
+        self.assertEqual(payload.jpg_scale((320, 240), (300, 300)), 1)
+
+    def test_reduced_decode(self):
+        image, size = payload.decode_jpg(self.jpg_bytes, rgb=True,
+                                         min_size=(300, 300))
+        self.assertEqual(size, (1917, 1079))
+        # libjpeg rounds up scaled size
+        self.assertEqual(image.shape, (540, 959, 3))
+        np.testing.assert_allclose(image[270, 480], [50, 0, 200], atol=2)
+
+        bgr = payload.jpg2bgr(self.jpg_bytes)
+        self.assertEqual(bgr.shape, (1079, 1917, 3))
+        np.testing.assert_array_equal(payload.jpg2rgb(self.jpg_bytes),
+                                      bgr[:, :, ::-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,142 @@
+import unittest
+
+import numpy as np
+
+from berrynet.engine import postprocess
+
+
+def loop_annotations(boxes, scores, classes, labels, img_w, img_h, threshold):
+    """Box by box implementation used by SSD engines before."""
+    annotations = []
+    for i in range(boxes.shape[0]):
+        ymin, xmin, ymax, xmax = tuple(boxes[i].tolist())
+        if scores[i] < threshold:
+            continue
+        annotations.append({
+            'label': labels[classes[i]],
+            'confidence': float(scores[i]),
+            'left': int(xmin * img_w),
+            'top': int(ymin * img_h),
+            'right': int(xmax * img_w),
+            'bottom': int(ymax * img_h)
+        })
+    return annotations
+
+
+class TestPostprocess(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.num = 1917
+        self.labels = ['class{}'.format(i) for i in range(91)]
+        self.boxes = rng.rand(self.num, 4).astype(np.float32)
+        self.scores = rng.rand(self.num).astype(np.float32)
+        self.classes = rng.randint(0, 91, self.num).astype(np.float32)
+
+    def test_same_as_loop(self):
+        expected = loop_annotations(self.boxes, self.scores,
+                                    self.classes.astype(np.int32),
+                                    self.labels, 640, 480, 0.5)
+        annotations = postprocess.annotate_detections(
+            self.boxes, self.scores, self.classes, self.labels,
+            img_size=(640, 480), threshold=0.5)
+        self.assertEqual(annotations, expected)
+        self.assertIsInstance(annotations[0]['left'], int)
+        self.assertIsInstance(annotations[0]['confidence'], float)
+
+    def test_top_k(self):
+        annotations = postprocess.annotate_detections(
+            self.boxes, self.scores, self.classes, None,
+            img_size=(640, 480), threshold=0.5, top_k=10)
+        expected = np.sort(self.scores)[::-1][:10].tolist()
+        self.assertEqual([a['confidence'] for a in annotations], expected)
+        self.assertEqual(postprocess.top_k_indices(self.scores, 3).tolist(),
+                         self.scores.argsort()[-3:][::-1].tolist())
+        self.assertEqual(len(postprocess.top_k_indices([0.1, 0.2], 5)), 2)
+
+    def test_center_boxes(self):
+        annotations = postprocess.annotate_detections(
+            [[10, 20, 4, 8]], [0.9], [1], ['a', 'b'],
+            box_format='cxcywh', extra={'id': -1})
+        self.assertEqual(annotations, [{
+            'label': 'b',
+            'confidence': 0.9,
+            'left': 8.0,
+            'top': 16.0,
+            'right': 12.0,
+            'bottom': 24.0,
+            'id': -1
+        }])
+
+    def test_empty(self):
+        self.assertEqual(postprocess.annotate_detections(
+            np.zeros((0, 4)), [], [], None, img_size=(1, 1), threshold=0.5),
+            [])
+
+
+class TestYoloPostprocess(unittest.TestCase):
+    """Golden results of tf.image.combined_non_max_suppression rules:
+    strict score and IoU thresholds, lower index first for ties, boxes
+    clipped to [0, 1] and zero padded."""
+
+    def test_filter_boxes(self):
+        boxes, conf = postprocess.yolo_filter_boxes(
+            [[[208, 208, 416, 208], [100, 100, 10, 10]]],
+            [[[0.3, 0.1], [0.1, 0.2]]],
+            score_threshold=0.25)
+        np.testing.assert_array_equal(boxes, [[[0.25, 0, 0.75, 1]]])
+        np.testing.assert_array_equal(conf, np.float32([[[0.3, 0.1]]]))
+
+    def test_combined_nms(self):
+        boxes = np.float32([[
+            [0, 0, 0.5, 0.5],         # A
+            [0, 0, 0.45, 0.5],        # B, IoU with A is 0.9
+            [0.5, 0.5, 1, 1],         # C
+            [0.2, 0.2, 1.2, 1.2],     # D
+            [-0.1, 0.6, 0.3, 1.1]     # E, clipped in output
+        ]])
+        scores = np.float32([[
+            [0.9, 0.1],
+            [0.8, 0.6],
+            [0.7, 0.0],
+            [0.1, 0.2],
+            [0.0, 0.5]
+        ]])
+        nmsed_boxes, nmsed_scores, nmsed_classes, valid = \
+            postprocess.combined_non_max_suppression(
+                boxes.reshape(1, 5, 1, 4), scores,
+                max_output_size_per_class=50, max_total_size=5,
+                iou_threshold=0.45, score_threshold=0.25)
+        np.testing.assert_array_equal(nmsed_boxes, np.float32([[
+            [0, 0, 0.5, 0.5],
+            [0.5, 0.5, 1, 1],
+            [0, 0, 0.45, 0.5],
+            [0, 0.6, 0.3, 1],
+            [0, 0, 0, 0]
+        ]]))
+        np.testing.assert_array_equal(nmsed_scores,
+                                      np.float32([[0.9, 0.7, 0.6, 0.5, 0]]))
+        np.testing.assert_array_equal(nmsed_classes, [[0, 0, 1, 1, 0]])
+        np.testing.assert_array_equal(valid, [4])
+
+        # Truncated by max_total_size
+        _, nmsed_scores, _, valid = postprocess.combined_non_max_suppression(
+            boxes.reshape(1, 5, 1, 4), scores, 50, 2, 0.45, 0.25)
+        np.testing.assert_array_equal(nmsed_scores, np.float32([[0.9, 0.7]]))
+        np.testing.assert_array_equal(valid, [2])
+
+    def test_nms_ties_and_threshold(self):
+        boxes = np.float32([[0, 0, 1, 1], [0, 0, 1, 1], [0, 0, 1, 0.5]])
+        # Same scores, the lower index is selected.
+        self.assertEqual(postprocess.non_max_suppression(
+            boxes[:2], [0.5, 0.5], 10, 0.5).tolist(), [0])
+        # IoU equal to threshold is not suppressed.
+        self.assertEqual(postprocess.non_max_suppression(
+            boxes[1:], [0.5, 0.4], 10, 0.5).tolist(), [0, 1])
+        # Score equal to threshold is dropped.
+        self.assertEqual(postprocess.non_max_suppression(
+            boxes[1:], [0.5, 0.4], 10, 0.5, score_threshold=0.4).tolist(),
+            [0])
+
+
+if __name__ == '__main__':
+    unittest.main()
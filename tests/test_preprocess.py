@@ -0,0 +1,56 @@
+import unittest
+
+import cv2
+import numpy as np
+
+from berrynet.engine import preprocess
+
+
+class TestPreprocess(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(42)
+        self.frame = rng.randint(0, 256, (480, 640, 3)).astype(np.uint8)
+        self.buf = preprocess.resize_buffer((300, 300, 3))
+
+    def test_nhwc_uint8(self):
+        expected = cv2.resize(cv2.cvtColor(self.frame, cv2.COLOR_BGR2RGB),
+                              (300, 300))
+        tensor = np.zeros((2, 300, 300, 3), dtype=np.uint8)
+        preprocess.write_nhwc(self.frame, tensor[1], self.buf)
+        np.testing.assert_array_equal(tensor[1], expected)
+        np.testing.assert_array_equal(tensor[0], 0)
+
+    def test_nhwc_float(self):
+        rgb = cv2.resize(cv2.cvtColor(self.frame, cv2.COLOR_BGR2RGB),
+                         (300, 300))
+        expected = ((2.0 / 255.0) * rgb - 1.0).astype(np.float32)
+        tensor = np.zeros((1, 300, 300, 3), dtype=np.float32)
+        preprocess.write_nhwc(self.frame, tensor[0], self.buf,
+                              mean=127.5, std=127.5)
+        np.testing.assert_allclose(tensor[0], expected, atol=1e-6)
+
+        # Frames in network input size are not resized, and are kept
+        # untouched.
+        frame = self.frame[:300, :300].copy()
+        preprocess.write_nhwc(frame, tensor[0], self.buf, swap_rb=False)
+        np.testing.assert_array_equal(tensor[0], frame)
+        np.testing.assert_array_equal(frame, self.frame[:300, :300])
+
+    def test_nchw(self):
+        expected = cv2.resize(self.frame, (300, 300)).transpose((2, 0, 1))
+        blob = np.zeros((1, 3, 300, 300), dtype=np.float32)
+        preprocess.write_nchw(self.frame, blob[0], self.buf)
+        np.testing.assert_array_equal(blob[0], expected)
+
+    def test_nchw_darknet(self):
+        # nparray_to_image of Darknet engine: scaled float CHW, and RGB
+        # swapped by rgbgr_image
+        expected = np.float32(
+            (self.frame[:, :, ::-1].transpose(2, 0, 1) / 255.0).flatten())
+        image = np.empty((3, 480, 640), dtype=np.float32)
+        preprocess.write_nchw(self.frame, image, swap_rb=True, std=255.0)
+        np.testing.assert_array_equal(image.flatten(), expected)
+
+
+if __name__ == '__main__':
+    unittest.main()
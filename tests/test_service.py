@@ -0,0 +1,365 @@
+import asyncio
+import os
+import threading
+import time
+import unittest
+
+import cv2
+import numpy as np
+
+from berrynet.comm import payload
+from berrynet.engine import DLEngine
+from berrynet.service import AsyncEngineService
+from berrynet.service import EngineService
+
+
+class SlowEngine(object):
+    def __init__(self):
+        self.gate = threading.Event()
+        self.shapes = []
+
+    def process_input(self, tensor):
+        self.gate.wait()
+        self.shapes.append(tensor.shape)
+        return tensor
+
+    def inference(self, tensor):
+        return {'mean': float(tensor.mean())}
+
+    def process_output(self, output):
+        return {'annotations': [output]}
+
+
+class BatchEngine(DLEngine):
+    def __init__(self):
+        super(BatchEngine, self).__init__()
+        self.batch_sizes = []
+
+    def infer_batch(self, tensors):
+        self.batch_sizes.append(len(tensors))
+        return [{'annotations': [{'mean': float(t.mean())}]}
+                for t in tensors]
+
+
+class SleepEngine(DLEngine):
+    """Inference time in ms is the mean pixel value of image."""
+    def inference(self, tensor):
+        mean = float(tensor.mean())
+        time.sleep(mean / 1000)
+        return {'annotations': [{'mean': mean}]}
+
+
+class CrashEngine(DLEngine):
+    """Worker process exits when mean pixel value is high."""
+    def inference(self, tensor):
+        mean = float(tensor.mean())
+        if mean > 128:
+            os._exit(1)
+        return {'annotations': [{'mean': mean}]}
+
+
+class SizeEngine(DLEngine):
+    input_size = (30, 30)
+
+    def process_input(self, tensor, image_size=None):
+        return {'shape': tensor.shape, 'original_size': image_size}
+
+    def inference(self, tensor):
+        return tensor
+
+
+class ModelEngine(DLEngine):
+    """Result is the model name, the engine fails if model is broken."""
+    def __init__(self, model):
+        super(ModelEngine, self).__init__()
+        self.model = model
+
+    def inference(self, tensor):
+        if self.model == 'broken':
+            raise RuntimeError('broken model')
+        return {'annotations': [{'model': self.model}]}
+
+
+def create_frame(value):
+    im = np.full((8, 8, 3), value, dtype=np.uint8)
+    return payload.create_jpg_object(cv2.imencode('.jpg', im)[1].tobytes(),
+                                     meta={'value': value})
+
+
+class TestEngineService(unittest.TestCase):
+    def test_batch_payload(self):
+        engine = SlowEngine()
+        engine.gate.set()
+        service = EngineService('test', engine, {'subscribe': {}})
+        results = []
+        service.result_hook = results.append
+        frames = [create_frame(value) for value in (0, 100, 200)]
+        for binary in (False, True):
+            del results[:]
+            service.inference(payload.serialize_batch(frames, binary),
+                              channel='camera1')
+            self.assertEqual([r['meta']['value'] for r in results],
+                             [0, 100, 200])
+            self.assertEqual([r['channel'] for r in results],
+                             ['camera1'] * 3)
+
+    def test_reduced_decode(self):
+        im = np.zeros((240, 320, 3), dtype=np.uint8)
+        frame = payload.create_jpg_object(
+            cv2.imencode('.jpg', im)[1].tobytes())
+        service = EngineService('test', SizeEngine(), {'subscribe': {}})
+        results = []
+        service.result_hook = results.append
+        service.inference(payload.serialize(frame))
+        # Decoded at 1/8 scale, and engine gets the original size.
+        self.assertEqual(results[0]['shape'], (30, 40, 3))
+        self.assertEqual(results[0]['original_size'], (320, 240))
+        self.assertEqual(results[0]['image_size'], [320, 240])
+
+        service.reduced_decode = False
+        service.inference(payload.serialize(frame))
+        self.assertEqual(results[1]['shape'], (240, 320, 3))
+        self.assertIsNone(results[1]['original_size'])
+        self.assertNotIn('image_size', results[1])
+
+
+    def test_batch_scheduler(self):
+        engine = BatchEngine()
+        service = EngineService(
+            'test', engine,
+            {'subscribe': {}, 'batch': {'max_batch': 3, 'max_wait_ms': 500}})
+        results = []
+        done = threading.Event()
+
+        def result_hook(result):
+            results.append(result)
+            if len(results) == 4:
+                done.set()
+        service.result_hook = result_hook
+
+        for value, channel in ((0, 'camera1'), (100, 'camera2'),
+                               (200, 'camera1'), (50, 'camera2')):
+            service.inference(payload.serialize(create_frame(value)),
+                              channel=channel)
+        self.assertTrue(done.wait(5))
+        # The first batch is full, and the last frame waits until timeout.
+        self.assertEqual(engine.batch_sizes, [3, 1])
+        self.assertEqual([(r['meta']['value'], r['channel']) for r in results],
+                         [(0, 'camera1'), (100, 'camera2'),
+                          (200, 'camera1'), (50, 'camera2')])
+        stats = service.batch_stats()
+        self.assertEqual(stats['frames'], 4)
+        self.assertEqual(stats['avg_batch_size'], 2)
+        self.assertGreaterEqual(stats['max_delay_ms'], 400)
+
+
+    def test_worker_pool_order(self):
+        for backend in ('process', 'thread'):
+            with self.subTest(backend=backend):
+                self.check_worker_pool_order(backend)
+
+    def check_worker_pool_order(self, backend):
+        engine = SleepEngine()
+        engine.concurrency = 2
+        service = EngineService(
+            'test', engine,
+            {'subscribe': {},
+             'workers': {'num_workers': 2, 'backend': backend}})
+        results = []
+        done = threading.Event()
+
+        def result_hook(result):
+            results.append(result['meta']['value'])
+            if len(results) == 4:
+                done.set()
+        service.result_hook = result_hook
+        service.worker_pool.start()
+        try:
+            # Later frames finish first, and wait in reorder buffer.
+            for value in (200, 0, 100, 0):
+                service.inference(payload.serialize(create_frame(value)))
+            self.assertTrue(done.wait(5))
+        finally:
+            service.worker_pool.stop()
+        self.assertEqual(results, [200, 0, 100, 0])
+        self.assertEqual(service.worker_pool.stats()['published'], 4)
+
+    def test_dead_worker(self):
+        service = EngineService(
+            'test', CrashEngine(),
+            {'subscribe': {},
+             'workers': {'num_workers': 2, 'max_inflight': 1}})
+        results = []
+        done = threading.Event()
+
+        def result_hook(result):
+            results.append(result['meta']['value'])
+            if len(results) == 3:
+                done.set()
+        service.result_hook = result_hook
+        service.worker_pool.start()
+        try:
+            # Frames of the dead worker are skipped, and the others are
+            # served by the live worker.
+            for value in (255, 0, 1, 2):
+                service.inference(payload.serialize(create_frame(value)))
+            self.assertTrue(done.wait(5))
+        finally:
+            service.worker_pool.stop()
+        self.assertEqual(results, [0, 1, 2])
+        stats = service.worker_pool.stats()
+        self.assertEqual(len(stats['dead']), 1)
+        self.assertEqual(stats['skipped'], 1)
+
+
+class TestEngineSwap(unittest.TestCase):
+    def setUp(self):
+        self.gate = threading.Event()
+        self.gate.set()
+
+        def engine_factory(spec):
+            self.gate.wait()
+            return ModelEngine(spec['model'])
+        self.service = EngineService(
+            'test', ModelEngine('old'),
+            {'subscribe': {},
+             'model_swap': {'engine_factory': engine_factory,
+                            'topic': 'berrynet/engine/test/model'}})
+        self.results = []
+        self.service.result_hook = self.results.append
+        self.statuses = []
+        self.service.swap_hook = self.statuses.append
+
+    def infer(self):
+        self.service.inference(payload.serialize(create_frame(0)))
+        return self.results[-1]['annotations'][0]['model']
+
+    def test_swap(self):
+        self.assertIn('berrynet/engine/test/model',
+                      self.service.comm_config['subscribe'])
+        self.gate.clear()
+        self.service.load_model(b'{"model": "new"}')
+        # Old engine keeps serving while new engine is loading.
+        self.assertEqual(self.infer(), 'old')
+        self.assertFalse(self.service.swapper.swap({'model': 'newer'}))
+        self.gate.set()
+        self.service.swapper.join(5)
+        self.assertEqual(self.infer(), 'new')
+
+        status = self.statuses[0]
+        self.assertEqual(status['status'], 'swapped')
+        self.assertEqual(status['model'], {'model': 'new'})
+        for key in ('load_ms', 'warmup_ms', 'swap_ms', 'total_ms'):
+            self.assertGreaterEqual(status[key], 0)
+        stats = self.service.swap_stats()
+        self.assertEqual((stats['swaps'], stats['failures'],
+                          stats['rejected']), (1, 0, 1))
+        self.assertFalse(stats['swapping'])
+
+    def test_rollback(self):
+        self.service.load_model(b'{"model": "broken"}')
+        self.service.swapper.join(5)
+        self.assertEqual(self.statuses[0]['status'], 'failed')
+        self.assertIn('broken model', self.statuses[0]['error'])
+        self.assertEqual(self.infer(), 'old')
+
+        # Illegal specs are rolled back too.
+        self.service.swapper.swap({'label': 'no model'})
+        self.service.swapper.join(5)
+        self.assertEqual(self.statuses[1]['status'], 'failed')
+        self.assertEqual(self.service.swap_stats()['failures'], 2)
+        self.assertEqual(self.infer(), 'old')
+
+    def test_draw_with_inferring_engine(self):
+        new_engine = ModelEngine('new')
+        old_engine = self.service.engine
+
+        # Swap lands between inference and drawing.
+        def inference(tensor):
+            self.service.engine = new_engine
+            return {'annotations': [{'model': 'old'}]}
+        old_engine.inference = inference
+        self.service.draw_result = lambda image, result, engine: dict(
+            result, drawn_by=engine.model)
+        self.assertEqual(self.infer(), 'old')
+        self.assertEqual(self.results[-1]['drawn_by'], 'old')
+
+    def test_process_workers(self):
+        with self.assertRaises(Exception):
+            EngineService(
+                'test', ModelEngine('old'),
+                {'subscribe': {},
+                 'workers': {'num_workers': 2},
+                 'model_swap': {'engine_factory': ModelEngine}})
+
+
+class TestAsyncEngineService(unittest.TestCase):
+    def setUp(self):
+        self.engine = SlowEngine()
+        self.service = AsyncEngineService(
+            'test', self.engine, {'subscribe': {}},
+            result_topic='berrynet/engine/test/result', max_inflight=1)
+        self.loop = asyncio.new_event_loop()
+        self.service.comm.loop = self.loop
+        self.sent = []
+        self.service.comm.send = \
+            lambda topic, pl, qos=None: self.sent.append((topic, pl))
+
+    def tearDown(self):
+        self.loop.close()
+
+    def frame(self, value):
+        return payload.serialize(create_frame(value))
+
+    def test_keep_latest_while_busy(self):
+        async def feed():
+            topic = 'berrynet/data/rgbimage'
+            first = self.loop.create_task(
+                self.service.inference(self.frame(0), topic=topic))
+            await asyncio.sleep(0.05)  # first frame is blocked in engine
+            for value in (50, 100, 200):
+                await self.service.inference(self.frame(value), topic=topic)
+            self.loop.call_later(0.05, self.engine.gate.set)
+            await first
+
+        self.loop.run_until_complete(feed())
+        self.assertEqual(len(self.sent), 2)
+        results = [payload.deserialize(pl) for _, pl in self.sent]
+        self.assertEqual([r['meta']['value'] for r in results], [0, 200])
+        self.assertEqual(self.engine.shapes, [(8, 8, 3), (8, 8, 3)])
+        self.assertIn('annotations', results[1])
+
+    def test_channel_topic(self):
+        async def feed():
+            await self.service.inference(
+                self.frame(0), topic='berrynet/data/camera1/rgbimage',
+                channel='camera1')
+
+        self.engine.gate.set()
+        self.loop.run_until_complete(feed())
+        self.assertEqual(self.sent[0][0],
+                         'berrynet/engine/test/result/camera1')
+        self.assertEqual(
+            self.service.channel_topic('berrynet/engine/test/result', {}),
+            'berrynet/engine/test/result')
+
+    def test_swap_hook_in_loop(self):
+        self.service.status_topic = 'berrynet/engine/test/status'
+        loop_thread = []
+        self.service.comm.send = lambda topic, pl, qos=None: \
+            loop_thread.append(threading.current_thread())
+
+        async def swap():
+            t = threading.Thread(target=self.service.swap_hook,
+                                 args=({'status': 'swapped'},))
+            t.start()
+            await self.loop.run_in_executor(None, t.join)
+            await asyncio.sleep(0)
+
+        self.loop.run_until_complete(swap())
+        # Status is sent in the event loop, not in the swapper thread.
+        self.assertEqual(loop_thread, [threading.current_thread()])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import unittest
+
+import numpy as np
+
+from berrynet.comm import payload
+from berrynet.comm import shm
+from berrynet.engine import DLEngine
+from berrynet.service import EngineService
+
+
+class OverwritingEngine(DLEngine):
+    """Producer writes frames into the ring while engine infers."""
+    def __init__(self, ring, frame, writes):
+        super(OverwritingEngine, self).__init__()
+        self.ring = ring
+        self.frame = frame
+        self.writes = writes
+
+    def inference(self, tensor):
+        for _ in range(self.writes):
+            self.ring.write(self.frame)
+        return {'annotations': []}
+
+
+class TestFrameRing(unittest.TestCase):
+    def setUp(self):
+        self.frame = np.arange(4 * 6 * 3, dtype=np.uint8).reshape((4, 6, 3))
+        self.ring = shm.FrameRing('berrynet-test-ring', slots=2,
+                                  slot_size=self.frame.nbytes, create=True)
+
+    def tearDown(self):
+        self.ring.unlink()
+
+    def test_read_frame_by_handle(self):
+        handle = self.ring.write(self.frame)
+        obj = payload.deserialize(
+            payload.serialize_frame_handle(handle, meta={'channel': 0}))
+        bgr = payload.to_bgr(obj)
+        np.testing.assert_array_equal(bgr, self.frame)
+        self.assertFalse(bgr.flags.writeable)
+
+    def test_expired_frame(self):
+        handle = self.ring.write(self.frame)
+        self.ring.write(self.frame)
+        self.ring.write(self.frame)
+        self.assertIsNone(shm.read_frame(handle))
+
+    def test_attach_inferred_frame(self):
+        other = np.zeros_like(self.frame)
+        for writes, dropped in ((1, False), (2, True)):
+            with self.subTest(writes=writes):
+                service = EngineService(
+                    'test', OverwritingEngine(self.ring, other, writes),
+                    {'subscribe': {}})
+                service.input_rgb = False
+                results = []
+                service.result_hook = results.append
+                handle = self.ring.write(self.frame)
+                service.inference(payload.serialize_frame_handle(handle))
+                if dropped:
+                    self.assertEqual(results, [])
+                    continue
+                # Image is encoded from the inferred frame, although the
+                # ring has a newer frame.
+                self.assertNotIn('shm', results[0])
+                image = payload.jpg2bgr(results[0]['bytes'])
+                self.assertLess(
+                    np.abs(image.astype(int) - self.frame).mean(), 8)
+
+    def test_remote_handle(self):
+        handle = self.ring.write(self.frame)
+        handle['host'] = 'another-host'
+        with self.assertRaises(IOError):
+            shm.read_frame(handle)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,6 +1,7 @@
 import unittest
 
 import cv2
+import numpy as np
 
 from berrynet.engine.tensorflow_engine import TensorFlowEngine
 
@@ -22,6 +23,30 @@ class TestTensorFlowEngine(unittest.TestCase):
         tfe.process_output(tfe.inference(tfe.process_input(rgb_array)))
         #self.assertEqual('foo'.upper(), 'FOO')
 
+    def test_fused_engine(self):
+        model = 'berrynet/engine/inception_v3_2016_08_28_frozen.pb'
+        label = 'berrynet/engine/imagenet_slim_labels.txt'
+        jpg_filepath = 'berrynet/engine/grace_hopper.jpg'
+        input_layer = 'input:0'
+        output_layer = 'InceptionV3/Predictions/Reshape_1:0'
+
+        tfe = TensorFlowEngine(model, label, input_layer, output_layer)
+        fused = TensorFlowEngine(model, label, input_layer, output_layer,
+                                 fused=True)
+        self.assertEqual((fused.input_height, fused.input_width), (299, 299))
+        tfe.create()
+        fused.create()
+        rgb_array = cv2.cvtColor(
+            cv2.imread(jpg_filepath),
+            cv2.COLOR_BGR2RGB)
+        expected = tfe.inference(tfe.process_input(rgb_array))
+        output = fused.inference(fused.process_input(rgb_array))
+        np.testing.assert_allclose(output, expected, atol=1e-5)
+
+        results = fused.infer_batch([rgb_array, rgb_array])
+        self.assertEqual(results[0], results[1])
+        self.assertEqual(results[0], tfe.process_output(expected))
+
     #def test_isupper(self):
     #    self.assertTrue('FOO'.isupper())
     #    self.assertFalse('Foo'.isupper())
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Darknet image construction benchmark.
+
+Compare building image data of Darknet engine by a ctypes array copied
+element by element, as before, with writing into a reused float32 CHW
+buffer handed to Darknet by pointer. It does not need libdarknet, and
+rgbgr_image, which the old way also ran in C, is not included.
+
+Example:
+
+    $ python3 utils/benchmark/darknet_input.py --size 416 416 640 480
+"""
+
+import argparse
+import time
+
+from ctypes import POINTER, c_float
+
+import numpy as np
+
+from berrynet.engine import preprocess
+
+
+def c_array(ctype, values):
+    arr = (ctype*len(values))()
+    arr[:] = values
+    return arr
+
+
+def copy_image(arr, buf):
+    arr = arr.transpose(2, 0, 1)
+    arr = (arr/255.0).flatten()
+    return c_array(c_float, arr)
+
+
+def buffer_image(arr, buf):
+    preprocess.write_nchw(arr, buf, swap_rb=True, std=255.0)
+    return buf.ctypes.data_as(POINTER(c_float))
+
+
+def bench(functor, count, arr):
+    buf = np.empty((arr.shape[2],) + arr.shape[:2], dtype=np.float32)
+    t = time.time()
+    for i in range(count):
+        functor(arr, buf)
+    return (time.time() - t) / count * 1000
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-n', '--count', default=20, type=int,
+                    help='Number of runs per case.')
+    ap.add_argument('--size', default=[416, 416, 640, 480], type=int,
+                    nargs='+', help='Widths and heights of frames.')
+    return vars(ap.parse_args())
+
+
+def main():
+    args = parse_args()
+    rng = np.random.RandomState(0)
+    sizes = args['size']
+    for w, h in zip(sizes[::2], sizes[1::2]):
+        arr = rng.randint(0, 256, (h, w, 3)).astype(np.uint8)
+        t_copy = bench(copy_image, args['count'], arr)
+        t_buffer = bench(buffer_image, args['count'], arr)
+        print('{}x{}: ctypes copy {:.2f} ms, buffer {:.2f} ms '
+              '({:.0f}x)'.format(w, h, t_copy, t_buffer, t_copy / t_buffer))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Frame hashing benchmark.
+
+Compare the legacy md5sum (base64 + md5) with frame id algorithms.
+
+Example:
+
+    $ python3 utils/benchmark/frame_id.py -n 1000 --size 100000
+"""
+
+import argparse
+import os
+import time
+
+from berrynet.comm import payload
+
+
+def bench(functor, count, content):
+    t = time.time()
+    for i in range(count):
+        functor(content)
+    return (time.time() - t) / count * 1000
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-n', '--count', default=1000, type=int,
+                    help='Number of hashes per algorithm.')
+    ap.add_argument('--size', default=100000, type=int,
+                    help='Content size in bytes (~100 KB for a VGA JPEG).')
+    return vars(ap.parse_args())
+
+
+def main():
+    args = parse_args()
+    content = os.urandom(args['size'])
+
+    functors = [('md5sum (legacy)', payload.generate_bytes_md5sum)]
+    for algorithm in payload.FRAME_ID_ALGORITHMS:
+        if algorithm == 'xxh64' and payload.xxhash is None:
+            print('xxh64: skipped, xxhash is not installed')
+            continue
+        functors.append(
+            (algorithm,
+             lambda c, a=algorithm: payload.generate_frame_id(c, a)))
+    for name, functor in functors:
+        print('{0}: {1:.3f} ms'.format(
+            name, bench(functor, args['count'], content)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Module import time and memory benchmark.
+
+Each module is imported in a fresh interpreter, and the import time and
+max RSS of the process are reported. The default modules compare the
+TFLite service itself with the backends it may load: startup of the
+service is the service import plus the backend import.
+
+Example:
+
+    $ python3 utils/benchmark/import_time.py
+    $ python3 utils/benchmark/import_time.py -m berrynet.service.tflite_service
+"""
+
+import argparse
+import json
+import subprocess
+import sys
+
+
+PROBE = '''
+import json, resource, sys, time
+t = time.time()
+try:
+    __import__(sys.argv[1])
+    error = None
+except ImportError as e:
+    error = str(e)
+print(json.dumps({
+    'time_ms': (time.time() - t) * 1000,
+    'max_rss_mb': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+    'error': error
+}))
+'''
+
+
+def measure(module, repeat):
+    results = []
+    for i in range(repeat):
+        out = subprocess.check_output([sys.executable, '-c', PROBE, module])
+        results.append(json.loads(out.decode('utf-8').splitlines()[-1]))
+    if results[0]['error'] is not None:
+        return results[0]
+    return {
+        'time_ms': min(r['time_ms'] for r in results),
+        'max_rss_mb': max(r['max_rss_mb'] for r in results),
+        'error': None
+    }
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-m', '--modules', nargs='+',
+                    default=['berrynet.service.tflite_service',
+                             'tflite_runtime.interpreter',
+                             'tensorflow'],
+                    help='Modules to import.')
+    ap.add_argument('-r', '--repeat', default=3, type=int,
+                    help='Number of imports per module, the min time is '
+                         'reported.')
+    return vars(ap.parse_args())
+
+
+def main():
+    args = parse_args()
+    baseline = measure('sys', args['repeat'])
+    print('python: {:.1f} MB'.format(baseline['max_rss_mb']))
+    for module in args['modules']:
+        r = measure(module, args['repeat'])
+        if r['error'] is not None:
+            print('{}: skipped, {}'.format(module, r['error']))
+            continue
+        print('{}: {:.1f} ms, {:.1f} MB (+{:.1f} MB)'.format(
+            module, r['time_ms'], r['max_rss_mb'],
+            r['max_rss_mb'] - baseline['max_rss_mb']))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""JPEG decoding benchmark.
+
+Compare full-scale decoding, as services did before, with reduced-scale
+decoding not smaller than network input. Both include resizing to
+network input, which engines do next.
+
+Example:
+
+    $ python3 utils/benchmark/jpeg_decode.py -i berrynet/engine/grace_hopper.jpg
+"""
+
+import argparse
+import time
+
+import cv2
+
+from berrynet.comm import payload
+
+
+def full_decode(jpg_bytes, input_size):
+    image = payload.jpg2bgr(jpg_bytes)
+    return cv2.resize(image, input_size)
+
+
+def reduced_decode(jpg_bytes, input_size):
+    image = payload.jpg2bgr(jpg_bytes, min_size=input_size)
+    return cv2.resize(image, input_size)
+
+
+def bench(functor, count, *args):
+    t = time.time()
+    for i in range(count):
+        functor(*args)
+    return (time.time() - t) / count * 1000
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-i', '--image', required=True,
+                    help='Image file, it is resized to each frame size.')
+    ap.add_argument('-n', '--count', default=100, type=int,
+                    help='Number of runs per case.')
+    ap.add_argument('--frame-sizes', default=['1920x1080', '1280x720'],
+                    nargs='+', help='Frame sizes, e.g. 1920x1080.')
+    ap.add_argument('--input-sizes', default=['300x300', '416x416'],
+                    nargs='+', help='Network input sizes, e.g. 300x300.')
+    return vars(ap.parse_args())
+
+
+def main():
+    args = parse_args()
+    image = cv2.imread(args['image'])
+    for frame_size in args['frame_sizes']:
+        frame_size = tuple(map(int, frame_size.split('x')))
+        jpg_bytes = cv2.imencode('.jpg', cv2.resize(image, frame_size))[1]
+        jpg_bytes = jpg_bytes.tobytes()
+        for input_size in args['input_sizes']:
+            input_size = tuple(map(int, input_size.split('x')))
+            t_full = bench(full_decode, args['count'], jpg_bytes, input_size)
+            t_reduced = bench(reduced_decode, args['count'], jpg_bytes,
+                              input_size)
+            print('{}x{} to {}x{}: full {:.2f} ms, reduced 1/{} {:.2f} ms '
+                  '({:.1f}x)'.format(
+                      frame_size[0], frame_size[1],
+                      input_size[0], input_size[1], t_full,
+                      payload.jpg_scale(frame_size, input_size), t_reduced,
+                      t_full / t_reduced))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Detector post-processing benchmark.
+
+Compare the box by box loop used by SSD engines before with the
+vectorized post-processing. 1917 is the number of candidate boxes of
+SSD MobileNet.
+
+Example:
+
+    $ python3 utils/benchmark/postprocess.py -n 1000 --boxes 100 1917
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from berrynet.engine import postprocess
+
+
+def loop_annotations(boxes, scores, classes, labels, img_w, img_h, threshold):
+    annotations = []
+    for i in range(boxes.shape[0]):
+        ymin, xmin, ymax, xmax = tuple(boxes[i].tolist())
+        if scores[i] < threshold:
+            continue
+        annotations.append({
+            'label': labels[classes[i]],
+            'confidence': float(scores[i]),
+            'left': int(xmin * img_w),
+            'top': int(ymin * img_h),
+            'right': int(xmax * img_w),
+            'bottom': int(ymax * img_h)
+        })
+    return annotations
+
+
+def vectorized_annotations(boxes, scores, classes, labels, img_w, img_h,
+                           threshold):
+    return postprocess.annotate_detections(boxes, scores, classes, labels,
+                                           img_size=(img_w, img_h),
+                                           threshold=threshold)
+
+
+def bench(functor, count, *args):
+    t = time.time()
+    for i in range(count):
+        functor(*args)
+    return (time.time() - t) / count * 1000
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-n', '--count', default=1000, type=int,
+                    help='Number of runs per case.')
+    ap.add_argument('--boxes', default=[100, 1917], type=int, nargs='+',
+                    help='Numbers of candidate boxes.')
+    ap.add_argument('--threshold', default=0.5, type=float,
+                    help='Confidence threshold.')
+    return vars(ap.parse_args())
+
+
+def main():
+    args = parse_args()
+    rng = np.random.RandomState(0)
+    labels = ['class{}'.format(i) for i in range(91)]
+    for num in args['boxes']:
+        boxes = rng.rand(num, 4).astype(np.float32)
+        scores = rng.rand(num).astype(np.float32)
+        classes = rng.randint(0, 91, num).astype(np.int32)
+        case = (boxes, scores, classes, labels, 640, 480, args['threshold'])
+        t_loop = bench(loop_annotations, args['count'], *case)
+        t_vec = bench(vectorized_annotations, args['count'], *case)
+        print('{} boxes: loop {:.3f} ms, vectorized {:.3f} ms '
+              '({:.1f}x)'.format(num, t_loop, t_vec, t_loop / t_vec))
+
+
+if __name__ == '__main__':
+    main()
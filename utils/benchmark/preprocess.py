@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Engine pre-processing benchmark.
+
+Compare the pre-processing of TFLite SSD detector used before, which
+allocates a temporary per step and copies the result by set_tensor,
+with writing into a preallocated input tensor in place. Time and peak
+of NumPy allocations per frame are reported.
+
+Example:
+
+    $ python3 utils/benchmark/preprocess.py -n 1000
+"""
+
+import argparse
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from berrynet.engine import preprocess
+
+
+def copy_input(frame, input_tensor, buf):
+    frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    frame = cv2.resize(frame, (300, 300))
+    frame = np.expand_dims(frame, axis=0)
+    frame = (2.0 / 255.0) * frame - 1.0
+    frame = frame.astype('float32')
+    # set_tensor
+    input_tensor[...] = frame
+
+
+def inplace_input(frame, input_tensor, buf):
+    preprocess.write_nhwc(frame, input_tensor[0], buf, mean=127.5, std=127.5)
+
+
+def bench(functor, count, frame):
+    input_tensor = np.empty((1, 300, 300, 3), dtype=np.float32)
+    buf = preprocess.resize_buffer((300, 300, 3))
+    functor(frame, input_tensor, buf)
+    t = time.time()
+    for i in range(count):
+        functor(frame, input_tensor, buf)
+    elapsed = (time.time() - t) / count * 1000
+
+    tracemalloc.start()
+    functor(frame, input_tensor, buf)
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-n', '--count', default=1000, type=int,
+                    help='Number of runs per case.')
+    ap.add_argument('--size', default=[640, 480], type=int, nargs=2,
+                    help='Width and height of input frame.')
+    return vars(ap.parse_args())
+
+
+def main():
+    args = parse_args()
+    w, h = args['size']
+    frame = np.random.RandomState(0).randint(
+        0, 256, (h, w, 3)).astype(np.uint8)
+    for name, functor in (('copy', copy_input), ('in-place', inplace_input)):
+        elapsed, peak = bench(functor, args['count'], frame)
+        print('{}: {:.3f} ms, {:.1f} KB allocated per frame'.format(
+            name, elapsed, peak / 1024))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Publish throughput benchmark against a local broker.
+
+Compare the legacy per-message connection (publish.single) with the
+persistent connection used by Communicator.send.
+
+Example:
+
+    $ python3 utils/benchmark/publish_throughput.py -n 500 --size 100000
+"""
+
+import argparse
+import os
+import time
+
+from berrynet.comm import Communicator
+
+
+def bench(send, flush, count, payload):
+    t = time.time()
+    for i in range(count):
+        send('berrynet/benchmark/publish', payload)
+    flush()
+    return count / (time.time() - t)
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('--broker-ip', default='localhost',
+                    help='MQTT broker IP.')
+    ap.add_argument('--broker-port', default=1883, type=int,
+                    help='MQTT broker port.')
+    ap.add_argument('-n', '--count', default=200, type=int,
+                    help='Number of messages per run.')
+    ap.add_argument('--size', default=100000, type=int,
+                    help='Payload size in bytes (~100 KB for a VGA JPEG).')
+    ap.add_argument('--qos', default=0, type=int,
+                    help='MQTT QoS level.')
+    ap.add_argument('--pipeline-depth', default=16, type=int,
+                    help='Max number of not yet written messages.')
+    return vars(ap.parse_args())
+
+
+def main():
+    args = parse_args()
+    comm_config = {
+        'subscribe': {},
+        'broker': {
+            'address': args['broker_ip'],
+            'port': args['broker_port']
+        },
+        'publish': {
+            'qos': args['qos'],
+            'pipeline_depth': args['pipeline_depth']
+        }
+    }
+    comm = Communicator(comm_config)
+    payload = os.urandom(args['size'])
+
+    before = bench(comm.send_single, lambda: None, args['count'], payload)
+    after = bench(comm.send, comm.flush, args['count'], payload)
+    print('publish.single:     {:8.1f} msg/s'.format(before))
+    print('Communicator.send:  {:8.1f} msg/s'.format(after))
+    print('speedup:            {:8.2f}x'.format(after / before))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+#
+# Copyright 2020 DT42
+#
+# This file is part of BerryNet.
+#
+# BerryNet is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# BerryNet is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with BerryNet.  If not, see <http://www.gnu.org/licenses/>.
+
+"""Engine worker pool throughput benchmark.
+
+A CPU-bound engine holding the GIL stands for a CPU inference backend.
+Frames are fed to an EngineService without MQTT broker, and throughput
+is measured for each number of workers.
+
+Example:
+
+    $ python3 utils/benchmark/worker_pool.py -n 200 --workers 1 2 4
+"""
+
+import argparse
+import logging
+import threading
+import time
+
+import cv2
+import numpy as np
+
+from berrynet import logger
+from berrynet.comm import payload
+from berrynet.engine import DLEngine
+from berrynet.service import EngineService
+
+
+class BusyEngine(DLEngine):
+    def __init__(self, loops):
+        super(BusyEngine, self).__init__()
+        self.loops = loops
+
+    def inference(self, tensor):
+        total = 0
+        for i in range(self.loops):
+            total += i
+        return {'annotations': [{'total': total}]}
+
+
+def bench(workers, count, loops, dispatch):
+    comm_config = {'subscribe': {}}
+    if workers > 1:
+        comm_config['workers'] = {'num_workers': workers,
+                                  'dispatch': dispatch}
+    service = EngineService('benchmark', BusyEngine(loops), comm_config)
+    done = threading.Event()
+    results = []
+
+    def result_hook(result):
+        results.append(result)
+        if len(results) == count:
+            done.set()
+    service.result_hook = result_hook
+
+    im = np.zeros((480, 640, 3), dtype=np.uint8)
+    pl = payload.serialize(payload.create_jpg_object(
+        cv2.imencode('.jpg', im)[1].tobytes()))
+    if service.worker_pool is not None:
+        service.worker_pool.start()
+    t = time.time()
+    for i in range(count):
+        service.inference(pl)
+    done.wait()
+    elapsed = time.time() - t
+    if service.worker_pool is not None:
+        service.worker_pool.stop()
+    return count / elapsed
+
+
+def parse_args():
+    ap = argparse.ArgumentParser()
+    ap.add_argument('-n', '--count', default=200, type=int,
+                    help='Number of frames per run.')
+    ap.add_argument('--loops', default=200000, type=int,
+                    help='Busy loops per inference.')
+    ap.add_argument('--workers', default=[1, 2, 4], type=int, nargs='+',
+                    help='Numbers of workers to benchmark.')
+    ap.add_argument('--dispatch', default='least-loaded',
+                    choices=['round-robin', 'least-loaded'])
+    return vars(ap.parse_args())
+
+
+def main():
+    args = parse_args()
+    logger.setLevel(logging.WARNING)
+    baseline = None
+    for workers in args['workers']:
+        fps = bench(workers, args['count'], args['loops'], args['dispatch'])
+        baseline = baseline or fps
+        print('{} workers: {:.1f} fps ({:.2f}x)'.format(
+            workers, fps, fps / baseline))
+
+
+if __name__ == '__main__':
+    main()